@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import logging
+
+from model import YuqueActivities, YuqueBook, YuqueGroup
+from yuque import Yuque
+
+logger = logging.getLogger(__name__)
+
+
+class ActivityScan:
+    """
+    一次团队动态扫描的结果
+    """
+
+    def __init__(self, cursors: dict):
+        self.doc_ids: dict[int, set[int]] = {}  # 知识库ID -> 动态涉及的文档ID
+        self.books: dict[int, YuqueBook] = {}  # 动态中带回的知识库信息
+        self.cursors: dict[str, int] = dict(cursors)  # 团队ID -> 已读到的最新动态ID
+        self.events: int = 0  # 新动态数量
+        self.needs_reconcile: bool = False  # 是否需要全量核对
+
+    def add(self, activity: YuqueActivities) -> None:
+        doc_ids = get_activity_doc_ids(activity)
+        if not doc_ids or not activity.book_id:
+            return
+
+        self.events += 1
+        self.doc_ids.setdefault(activity.book_id, set()).update(doc_ids)
+        if (
+            activity.book_id not in self.books
+            and isinstance(activity.book, dict)
+            and activity.book.get("name")
+        ):
+            self.books[activity.book_id] = YuqueBook(activity.book)
+
+    def __str__(self):
+        return f"ActivityScan(events={self.events}, books={len(self.doc_ids)}, needs_reconcile={self.needs_reconcile})"
+
+    def __repr__(self):
+        return self.__str__()
+
+
+def get_activity_doc_ids(activity: YuqueActivities) -> set[int]:
+    """取出动态涉及的文档ID。"""
+    if activity.target_type != "Doc":
+        return set()
+
+    return {
+        target.get("id")
+        for target in activity.targets or []
+        if isinstance(target, dict) and target.get("id")
+    }
+
+
+async def scan_group_activities(
+    yuque: Yuque, group: YuqueGroup, scan: ActivityScan
+) -> None:
+    """从游标位置读取单个团队的新动态，读到已处理过的动态即停止翻页。"""
+    key = str(group.id)
+    cursor = scan.cursors.get(key)
+    newest = cursor
+
+    async with contextlib.aclosing(yuque.iter_group_activities(group)) as activities:
+        async for activity in activities:
+            if activity.id is None:
+                continue
+
+            if newest is None or activity.id > newest:
+                newest = activity.id
+
+            if cursor is None:
+                # 首次读取只记录游标，之前的变更交给全量核对
+                scan.needs_reconcile = True
+                break
+
+            if activity.id <= cursor:
+                break
+
+            scan.add(activity)
+
+    if newest is not None:
+        scan.cursors[key] = newest
+
+
+async def collect_activity_targets(yuque: Yuque, cursors: dict) -> ActivityScan:
+    """
+    读取所有团队自上次游标以来的动态
+
+    :param cursors:  {团队ID: 已处理的最新动态ID}
+    :return:         扫描结果
+    """
+    scan = ActivityScan(cursors)
+
+    async for group in yuque.iter_groups():
+        try:
+            await scan_group_activities(yuque, group, scan)
+        except Exception as exc:
+            scan.needs_reconcile = True
+            logger.warning(
+                "[activity] 读取团队动态失败 group=%s(%s) error=%s",
+                group.name,
+                group.id,
+                exc,
+            )
+
+    logger.info(
+        "[activity] 动态扫描完成 events=%s books=%s reconcile=%s",
+        scan.events,
+        len(scan.doc_ids),
+        scan.needs_reconcile,
+    )
+    return scan
+
+
+async def resolve_target_books(
+    yuque: Yuque, scan: ActivityScan
+) -> list[tuple[YuqueBook, set[int]]]:
+    """
+    把扫描结果整理成 (知识库, 文档ID集合) 列表
+
+    动态里没有带知识库信息时，才去分页查找知识库，找齐即停止。
+    """
+    missing = set(scan.doc_ids) - set(scan.books)
+    if missing:
+        async with contextlib.aclosing(yuque.iter_books()) as books:
+            async for book in books:
+                if book.id in missing:
+                    scan.books[book.id] = book
+                    missing.discard(book.id)
+                    if not missing:
+                        break
+
+    for book_id in missing:
+        logger.warning("[activity] 找不到动态对应的知识库 book_id=%s", book_id)
+
+    return [
+        (scan.books[book_id], doc_ids)
+        for book_id, doc_ids in scan.doc_ids.items()
+        if book_id in scan.books
+    ]
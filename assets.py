@@ -0,0 +1,278 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextlib
+import hashlib
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import urllib.parse
+import uuid
+
+import aiohttp
+from limiter import RequestLimiter
+from metrics import API_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+ASSET_DIR_NAME = "assets"
+ASSET_CHUNK_SIZE = 64 * 1024
+# 资源下载单独限流，图床的限流或故障不影响语雀接口的并发窗口
+ASSET_MAX_CONCURRENCY = 8
+
+# markdown 图片、HTML 图片以及语雀附件链接
+IMAGE_PATTERN = re.compile(r"!\[[^\]]*\]\((https?://[^\s)]+)")
+HTML_IMAGE_PATTERN = re.compile(r'<img\s[^>]*?src="(https?://[^"]+)"')
+ATTACHMENT_PATTERN = re.compile(r"\]\((https?://[^\s)]*/attachments/[^\s)]+)\)")
+EXTENSION_PATTERN = re.compile(r"^\.[A-Za-z0-9]{1,8}$")
+
+
+def find_asset_urls(text: str) -> set[str]:
+    """找出文本中引用的远程图片与附件链接。"""
+    urls = set()
+    for pattern in (IMAGE_PATTERN, HTML_IMAGE_PATTERN, ATTACHMENT_PATTERN):
+        urls.update(pattern.findall(text))
+    return urls
+
+
+def has_remote_assets(path: str) -> bool:
+    """已保存的文件中是否还有未本地化的远程资源链接，逐行读取。"""
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        return any(find_asset_urls(line) for line in f)
+
+
+def get_fetch_url(url: str) -> str:
+    """语雀图片链接的 # 后面是前端参数，不参与下载与去重。"""
+    return urllib.parse.urldefrag(url).url
+
+
+def match_host(host: str, allowed) -> bool:
+    """host 是否为 allowed 中的域名或其子域名。"""
+    host = host.lower().rstrip(".")
+    return any(host == item or host.endswith("." + item) for item in allowed)
+
+
+def guess_extension(url: str, content_type: str | None) -> str:
+    ext = posixpath.splitext(urllib.parse.urlsplit(url).path)[1]
+    if EXTENSION_PATTERN.match(ext):
+        return ext.lower()
+
+    if content_type:
+        ext = mimetypes.guess_extension(content_type.split(";")[0].strip())
+        if ext:
+            return ext
+    return ""
+
+
+class AssetLocalizer:
+    """
+    markdown 资源本地化
+
+    把文档引用的远程图片与附件并发下载到 SAVE_PATH/assets，
+    文件按内容 sha256 命名，不同文档、不同知识库引用的相同资源只保存一份；
+    链接到本地路径的映射记录在状态库中，同一链接只下载一次。
+
+    资源可能来自任意图床，因此使用不带 Cookie 的独立会话与独立限流器下载，
+    只有语雀所在域名与 credential_hosts 中的域名才携带语雀的 Cookie 与 Referer。
+    """
+
+    def __init__(self, yuque, base_path: str, enabled: bool, credential_hosts=()):
+        """
+        :param credential_hosts:  可以携带语雀凭据的域名，含子域名
+        """
+        self.yuque = yuque
+        self.base_path = os.path.abspath(base_path)
+        self.root = os.path.join(self.base_path, ASSET_DIR_NAME)
+        self.enabled = enabled
+        self.credential_hosts = tuple(credential_hosts)
+        self.store = None
+        self.limiter: RequestLimiter | None = None
+        self._http: aiohttp.ClientSession | None = None
+        self._known: dict[str, str] = {}  # 链接 -> 相对 SAVE_PATH 的路径
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def open(self, connector: aiohttp.BaseConnector, read_timeout: float) -> None:
+        """创建下载资源用的会话，与语雀客户端共用连接池但不共用 Cookie。"""
+        if not self.enabled or self._http is not None:
+            return
+        self.limiter = RequestLimiter(
+            rate=0,
+            initial_concurrency=ASSET_MAX_CONCURRENCY,
+            min_concurrency=1,
+            max_concurrency=ASSET_MAX_CONCURRENCY,
+        )
+        self._http = aiohttp.ClientSession(
+            connector=connector,
+            connector_owner=False,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            headers={
+                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+            },
+            timeout=aiohttp.ClientTimeout(
+                total=None, sock_connect=30, sock_read=read_timeout
+            ),
+        )
+
+    async def close(self) -> None:
+        """取消未完成的下载并关闭会话。"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+
+    def attach(self, store) -> None:
+        self.store = store
+
+    def detach(self) -> None:
+        self.store = None
+
+    async def localize(
+        self, urls: set[str], doc_path: str, context: str
+    ) -> dict[str, str]:
+        """
+        下载文档引用的资源
+
+        :param doc_path:  文档保存路径，用于计算相对链接
+        :return:          {原链接: 相对文档的本地路径}，下载失败的链接不包含在内
+        """
+        urls = sorted(urls)
+        paths = await asyncio.gather(
+            *(asyncio.shield(self._get_task(get_fetch_url(url))) for url in urls)
+        )
+
+        doc_dir = os.path.dirname(doc_path)
+        mapping = {}
+        for url, path in zip(urls, paths):
+            if path is None:
+                continue
+            relative = os.path.relpath(os.path.join(self.base_path, path), doc_dir)
+            mapping[url] = relative.replace(os.sep, "/")
+
+        logger.info(
+            "[asset] 资源本地化完成 %s assets=%s localized=%s",
+            context,
+            len(urls),
+            len(mapping),
+        )
+        return mapping
+
+    def _get_task(self, url: str) -> asyncio.Task:
+        task = self._tasks.get(url)
+        if task is None:
+            task = asyncio.create_task(self._get(url))
+            self._tasks[url] = task
+            task.add_done_callback(lambda _: self._tasks.pop(url, None))
+        return task
+
+    def _lookup(self, url: str) -> str | None:
+        path = self._known.get(url)
+        if path is None and self.store is not None:
+            row = self.store.get_asset(url)
+            path = row["path"] if row else None
+
+        if path and os.path.exists(os.path.join(self.base_path, path)):
+            self._known[url] = path
+            return path
+        return None
+
+    async def _get(self, url: str) -> str | None:
+        path = self._lookup(url)
+        if path is not None:
+            return path
+
+        try:
+            result = await self._fetch(url)
+        except Exception as exc:
+            logger.warning("[asset] 下载资源失败 url=%s error=%s", url, exc)
+            return None
+        if result is None:
+            return None
+
+        path, sha256, size = result
+        self._known[url] = path
+        if self.store is not None:
+            self.store.upsert_asset(url, sha256, path, size)
+        return path
+
+    async def _fetch(self, url: str) -> tuple[str, str, int] | None:
+        """分块下载到临时文件，按内容哈希移动到 assets 目录。"""
+        os.makedirs(self.root, exist_ok=True)
+        temp_path = os.path.join(self.root, f"{uuid.uuid4().hex}.temp")
+        digest = hashlib.sha256()
+        size = 0
+
+        try:
+            async with self._request(url) as response:
+                if response.status != 200:
+                    logger.warning(
+                        "[asset] 下载资源失败 url=%s status=%s", url, response.status
+                    )
+                    return None
+
+                ext = guess_extension(url, response.headers.get("Content-Type"))
+                with open(temp_path, "wb") as f:
+                    while True:
+                        async with self.yuque.download_budget.reserve(ASSET_CHUNK_SIZE):
+                            chunk = await response.content.read(ASSET_CHUNK_SIZE)
+                            if not chunk:
+                                break
+                            digest.update(chunk)
+                            size += len(chunk)
+                            f.write(chunk)
+
+            sha256 = digest.hexdigest()
+            path = posixpath.join(ASSET_DIR_NAME, sha256[:2], sha256 + ext)
+            target = os.path.join(self.base_path, path)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                os.replace(temp_path, target)
+            return path, sha256, size
+        finally:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temp_path)
+
+    def _get_headers(self, url: str) -> dict:
+        """只对语雀自身与白名单域名携带语雀凭据，其他图床不会收到 Cookie 与 Referer。"""
+        host = urllib.parse.urlsplit(url).hostname or ""
+        allowed = list(self.credential_hosts)
+        base_host = urllib.parse.urlsplit(self.yuque.base_url or "").hostname
+        if base_host:
+            allowed.append(base_host)
+        if match_host(host, allowed):
+            return self.yuque.get_credential_headers()
+        return {}
+
+    @contextlib.asynccontextmanager
+    async def _request(self, url: str):
+        if self._http is None:
+            raise RuntimeError("资源下载会话未创建")
+
+        async with self.limiter.slot():
+            responded = False
+            try:
+                async with self._http.get(
+                    url, headers=self._get_headers(url)
+                ) as response:
+                    responded = True
+                    API_REQUESTS.inc(endpoint="asset", status=response.status)
+                    await self.limiter.feedback(
+                        response.status, response.headers.get("Retry-After")
+                    )
+                    yield response
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+                if not responded:
+                    API_REQUESTS.inc(endpoint="asset", status=type(exc).__name__)
+                self.limiter.on_congestion(type(exc).__name__)
+                raise
+
+
+def build_link_rewriter(mapping: dict[str, str]):
+    """生成把远程链接替换为本地路径的函数，较长的链接优先匹配。"""
+    pattern = re.compile(
+        "|".join(re.escape(url) for url in sorted(mapping, key=len, reverse=True))
+    )
+    return lambda text: pattern.sub(lambda match: mapping[match.group(0)], text)
@@ -0,0 +1,334 @@
+# -*- coding: utf-8 -*-
+"""
+本地模拟的语雀服务
+
+实现 Yuque 客户端用到的接口，列表数据按参数即时生成，只记录被编辑过的文档：
+知识库与文档列表、导出提交/轮询、下载、文档详情、团队与动态。
+可以配置接口延迟、导出排队时间，以及按比例注入 422/429/5xx。
+不同的 _yuque_session 对应不同的租户，各自看到独立的知识库与文档ID。
+
+单独运行：
+    python bench/mock_yuque.py --port 18080 --books 1000 --docs 20
+"""
+
+import argparse
+import asyncio
+import collections
+import datetime
+import random
+import zlib
+from dataclasses import dataclass
+
+from aiohttp import web
+
+BASE_TIME = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+DOC_ID_FACTOR = 100_000  # 文档ID = 知识库ID * DOC_ID_FACTOR + 序号
+TENANT_ID_FACTOR = 1_000_000  # 知识库ID = 租户序号 * TENANT_ID_FACTOR + 序号
+TENANT_SLOTS = 1000
+GROUP_ID = 1
+FILLER_LINE = "模拟文档内容 lorem ipsum dolor sit amet <font style='x'>yuque</font>\n"
+
+
+@dataclass
+class MockOptions:
+    books: int = 100
+    docs_per_book: int = 20
+    latency_ms: float = 20.0  # 每个请求的平均延迟，实际在 0.5~1.5 倍之间波动
+    pending_seconds: float = 2.0  # 导出从提交到就绪的时间
+    body_kb: int = 32  # 导出文件大小
+    rate_422: float = 0.0  # 下载返回 422（资源未就绪）的比例
+    rate_429: float = 0.0  # 接口返回 429 的比例
+    rate_5xx: float = 0.0  # 接口返回 503 的比例
+    seed: int = 0
+
+
+def format_time(version: int) -> str:
+    """版本号换算为更新时间，版本越大时间越晚。"""
+    moment = BASE_TIME + datetime.timedelta(minutes=version)
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+class MockYuque:
+    def __init__(self, options: MockOptions):
+        self.options = options
+        self.random = random.Random(options.seed)
+        # 编辑记录按 (知识库序号, 文档序号) 保存，所有租户共享
+        self.doc_versions: dict[tuple[int, int], int] = {}
+        self.book_versions: dict[int, int] = {}
+        # (文档ID, 版本, 格式) -> 提交时间，不同格式是各自独立的导出任务
+        self.exports: dict[tuple[int, int, str], float] = {}
+        self.activities: list[dict] = []
+        self.requests = collections.Counter()
+        self.filler = (
+            FILLER_LINE * (options.body_kb * 1024 // len(FILLER_LINE.encode()) + 1)
+        ).encode()[: options.body_kb * 1024]
+
+    def build_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.middleware])
+        app.router.add_get("/api/mine/getRecommendationTip", self.handle_tip)
+        app.router.add_get("/api/mine/user_books", self.handle_books)
+        app.router.add_get("/api/mine/groups", self.handle_groups)
+        app.router.add_get("/api/activities", self.handle_activities)
+        app.router.add_get("/api/docs", self.handle_docs)
+        app.router.add_post("/api/docs/{id}/export", self.handle_export)
+        app.router.add_get("/api/docs/{slug}", self.handle_overview)
+        app.router.add_get("/download/{id}", self.handle_download)
+        app.router.add_post("/_bench/touch", self.handle_touch)
+        app.router.add_get("/_bench/stats", self.handle_stats)
+        return app
+
+    @web.middleware
+    async def middleware(self, request: web.Request, handler):
+        if request.path.startswith("/_bench/"):
+            return await handler(request)
+
+        latency = self.options.latency_ms / 1000
+        if latency:
+            await asyncio.sleep(latency * self.random.uniform(0.5, 1.5))
+
+        if (
+            request.path.startswith("/api/")
+            and request.path != "/api/mine/getRecommendationTip"
+        ):
+            roll = self.random.random()
+            if roll < self.options.rate_429:
+                return self.count(
+                    request,
+                    web.json_response(
+                        {"message": "too many requests"},
+                        status=429,
+                        headers={"Retry-After": "1"},
+                    ),
+                )
+            if roll < self.options.rate_429 + self.options.rate_5xx:
+                return self.count(
+                    request,
+                    web.json_response({"message": "service unavailable"}, status=503),
+                )
+
+        return self.count(request, await handler(request))
+
+    def count(self, request: web.Request, response: web.StreamResponse):
+        resource = request.match_info.route.resource
+        name = resource.canonical if resource is not None else request.path
+        self.requests[f"{request.method} {name} {response.status}"] += 1
+        return response
+
+    # ---- 数据生成 ----
+
+    def tenant_base(self, request: web.Request) -> int:
+        session = request.cookies.get("_yuque_session", "")
+        return (zlib.crc32(session.encode()) % TENANT_SLOTS) * TENANT_ID_FACTOR
+
+    def book_data(self, base: int, index: int) -> dict:
+        book_id = base + index
+        version = self.book_versions.get(index, 0)
+        return {
+            "id": book_id,
+            "type": "Book",
+            "name": f"知识库{index}",
+            "slug": f"book-{index}",
+            "items_count": self.options.docs_per_book,
+            "created_at": format_time(0),
+            "updated_at": format_time(version),
+            "content_updated_at": format_time(version),
+        }
+
+    def doc_data(self, base: int, book_index: int, index: int) -> dict:
+        book_id = base + book_index
+        version = self.doc_versions.get((book_index, index), 0)
+        return {
+            "id": book_id * DOC_ID_FACTOR + index,
+            "type": "Doc",
+            "slug": f"doc-{index}",
+            "title": f"文档{index}",
+            "book_id": book_id,
+            "format": "lake",
+            "word_count": 100 + index,
+            "created_at": format_time(0),
+            "updated_at": format_time(version),
+            "content_updated_at": format_time(version),
+        }
+
+    def split_doc_id(self, doc_id: int) -> tuple[int, int]:
+        """文档ID拆分为 (知识库序号, 文档序号)。"""
+        book_id, index = divmod(doc_id, DOC_ID_FACTOR)
+        return book_id % TENANT_ID_FACTOR, index
+
+    def doc_version(self, doc_id: int) -> int:
+        return self.doc_versions.get(self.split_doc_id(doc_id), 0)
+
+    @staticmethod
+    def page(request: web.Request, total: int, default_limit: int) -> range:
+        offset = int(request.query.get("offset", 0))
+        limit = int(request.query.get("limit", default_limit))
+        return range(min(offset, total), min(offset + limit, total))
+
+    # ---- 接口 ----
+
+    async def handle_tip(self, request: web.Request) -> web.Response:
+        return web.json_response({"data": {}})
+
+    async def handle_books(self, request: web.Request) -> web.Response:
+        base = self.tenant_base(request)
+        indexes = self.page(request, self.options.books, 100)
+        return web.json_response(
+            {"data": [self.book_data(base, i + 1) for i in indexes]}
+        )
+
+    async def handle_docs(self, request: web.Request) -> web.Response:
+        base = self.tenant_base(request)
+        book_index = int(request.query["book_id"]) - base
+        if not 1 <= book_index <= self.options.books:
+            return web.json_response({"data": []})
+
+        indexes = self.page(request, self.options.docs_per_book, 100)
+        return web.json_response(
+            {"data": [self.doc_data(base, book_index, i) for i in indexes]}
+        )
+
+    async def handle_export(self, request: web.Request) -> web.Response:
+        doc_id = int(request.match_info["id"])
+        version = self.doc_version(doc_id)
+        export_type = (await request.json()).get("type")
+        key = (doc_id, version, export_type)
+        loop = asyncio.get_running_loop()
+        submitted_at = self.exports.setdefault(key, loop.time())
+
+        if loop.time() - submitted_at < self.options.pending_seconds:
+            return web.json_response({"data": {"state": "pending"}})
+
+        # 就绪后再次提交会重新排队，与语雀对已下载导出的处理一致
+        del self.exports[key]
+        return web.json_response(
+            {
+                "data": {
+                    "state": "success",
+                    "url": f"/download/{doc_id}?v={version}&type={export_type}",
+                }
+            }
+        )
+
+    async def handle_download(self, request: web.Request) -> web.StreamResponse:
+        if self.random.random() < self.options.rate_422:
+            return web.json_response({"message": "not ready"}, status=422)
+
+        doc_id = request.match_info["id"]
+        version = request.query.get("v", "0")
+        head = f"# 文档 {doc_id} 版本 {version}\n".encode()
+        if request.query.get("type") == "pdf":
+            return web.Response(body=head + self.filler, content_type="application/pdf")
+        return web.Response(
+            body=head + self.filler, content_type="text/markdown", charset="utf-8"
+        )
+
+    async def handle_overview(self, request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "data": {
+                    "word_count": 100,
+                    "contributors": [{"id": 1, "name": "bench", "login": "bench"}],
+                }
+            }
+        )
+
+    async def handle_groups(self, request: web.Request) -> web.Response:
+        groups = [{"id": GROUP_ID, "type": "Group", "login": "bench", "name": "bench"}]
+        return web.json_response(
+            {"data": [groups[i] for i in self.page(request, len(groups), 100)]}
+        )
+
+    async def handle_activities(self, request: web.Request) -> web.Response:
+        base = self.tenant_base(request)
+        newest_first = self.activities[::-1]
+        data = []
+        for i in self.page(request, len(newest_first), 100):
+            activity = newest_first[i]
+            book_id = base + activity["book_index"]
+            data.append(
+                {
+                    "id": activity["id"],
+                    "type": "updateDoc",
+                    "book_id": book_id,
+                    "target_type": "Doc",
+                    "targets": [
+                        {"id": book_id * DOC_ID_FACTOR + activity["doc_index"]}
+                    ],
+                    "book": self.book_data(base, activity["book_index"]),
+                }
+            )
+        return web.json_response({"data": data})
+
+    # ---- 基准测试控制 ----
+
+    async def handle_touch(self, request: web.Request) -> web.Response:
+        """随机编辑一部分文档，模拟两次同步之间的更新。"""
+        fraction = float(request.query.get("fraction", 0.01))
+        total = self.options.books * self.options.docs_per_book
+        count = min(total, max(1, round(total * fraction)))
+        for position in self.random.sample(range(total), count):
+            book_index = position // self.options.docs_per_book + 1
+            index = position % self.options.docs_per_book
+            version = self.doc_versions.get((book_index, index), 0) + 1
+            self.doc_versions[(book_index, index)] = version
+            self.book_versions[book_index] = max(
+                self.book_versions.get(book_index, 0), version
+            )
+            self.activities.append(
+                {
+                    "id": len(self.activities) + 1,
+                    "book_index": book_index,
+                    "doc_index": index,
+                }
+            )
+        return web.json_response({"touched": count})
+
+    async def handle_stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"requests": dict(self.requests)})
+
+
+def parse_args(argv=None) -> tuple[argparse.Namespace, MockOptions]:
+    parser = argparse.ArgumentParser(description="本地模拟的语雀服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    add_mock_arguments(parser)
+    args = parser.parse_args(argv)
+    return args, options_from_args(args)
+
+
+def add_mock_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = MockOptions()
+    parser.add_argument("--books", type=int, default=defaults.books)
+    parser.add_argument(
+        "--docs", type=int, default=defaults.docs_per_book, help="每个知识库的文档数"
+    )
+    parser.add_argument("--latency-ms", type=float, default=defaults.latency_ms)
+    parser.add_argument(
+        "--pending-seconds", type=float, default=defaults.pending_seconds
+    )
+    parser.add_argument("--body-kb", type=int, default=defaults.body_kb)
+    parser.add_argument("--rate-422", type=float, default=defaults.rate_422)
+    parser.add_argument("--rate-429", type=float, default=defaults.rate_429)
+    parser.add_argument("--rate-5xx", type=float, default=defaults.rate_5xx)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def options_from_args(args: argparse.Namespace) -> MockOptions:
+    return MockOptions(
+        books=args.books,
+        docs_per_book=args.docs,
+        latency_ms=args.latency_ms,
+        pending_seconds=args.pending_seconds,
+        body_kb=args.body_kb,
+        rate_422=args.rate_422,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        seed=args.seed,
+    )
+
+
+if __name__ == "__main__":
+    args, options = parse_args()
+    web.run_app(
+        MockYuque(options).build_app(), host=args.host, port=args.port, print=None
+    )
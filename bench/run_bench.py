@@ -0,0 +1,219 @@
+# -*- coding: utf-8 -*-
+"""
+端到端同步基准测试
+
+启动本地模拟的语雀服务（独立进程，不与被测代码争用事件循环），
+对空目录执行一次 download_all，再随机编辑一部分文档后执行 monitor_updates，
+输出每轮的文档吞吐、单文档导出耗时 p50/p99 与进程峰值内存。
+
+    python bench/run_bench.py --books 1000 --docs 20 --touch 0.05
+    python bench/run_bench.py --rate-429 0.02 --rate-5xx 0.01 --output result.json
+
+同步配置照常从环境变量读取，例如 YUQUE_RATE_LIMIT=0 可去掉客户端限速。
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import engine  # noqa: E402
+import profiler  # noqa: E402
+from config import reload_settings  # noqa: E402
+from metrics import percentile  # noqa: E402
+from mock_yuque import add_mock_arguments  # noqa: E402
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+logger = logging.getLogger("bench")
+
+MOCK_STARTUP_SECONDS = 10
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="语雀同步端到端基准测试")
+    add_mock_arguments(parser)
+    parser.add_argument(
+        "--format", default="pdf", help="导出格式，多个格式用逗号分隔，如 pdf,markdown"
+    )
+    parser.add_argument(
+        "--touch", type=float, default=0.05, help="monitor 前被编辑的文档比例"
+    )
+    parser.add_argument(
+        "--scenario",
+        default="download,monitor",
+        help="依次执行的场景，逗号分隔：download、monitor",
+    )
+    parser.add_argument("--save-path", help="导出目录，默认使用临时目录")
+    parser.add_argument("--output", help="结果另存为 JSON")
+    parser.add_argument("--verbose", action="store_true", help="输出同步日志")
+    return parser.parse_args()
+
+
+def get_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def get_peak_rss_bytes() -> int | None:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 单位为 KB，macOS 为字节
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+async def start_mock(args, port: int) -> asyncio.subprocess.Process:
+    mock_args = [
+        f"--books={args.books}",
+        f"--docs={args.docs}",
+        f"--latency-ms={args.latency_ms}",
+        f"--pending-seconds={args.pending_seconds}",
+        f"--body-kb={args.body_kb}",
+        f"--rate-422={args.rate_422}",
+        f"--rate-429={args.rate_429}",
+        f"--rate-5xx={args.rate_5xx}",
+        f"--seed={args.seed}",
+    ]
+    process = await asyncio.create_subprocess_exec(
+        sys.executable,
+        os.path.join(BENCH_DIR, "mock_yuque.py"),
+        f"--port={port}",
+        *mock_args,
+    )
+
+    url = f"http://127.0.0.1:{port}/_bench/stats"
+    deadline = time.monotonic() + MOCK_STARTUP_SECONDS
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(url) as response:
+                    if response.status == 200:
+                        return process
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError("模拟服务启动超时")
+
+
+async def mock_call(base_url: str, method: str, path: str, **params) -> dict:
+    async with aiohttp.ClientSession() as session:
+        async with session.request(method, base_url + path, params=params) as response:
+            response.raise_for_status()
+            return await response.json()
+
+
+async def run_scenario(name: str, sync) -> dict:
+    """执行一轮同步，从阶段统计中汇总吞吐与单文档耗时。"""
+    started = time.perf_counter()
+    with profiler.profile_run(f"bench-{name}", os.environ["SAVE_PATH"]) as run:
+        ok = await sync()
+    wall_seconds = time.perf_counter() - started
+
+    latencies = [
+        profiler.total_seconds(entry["phases"])
+        for entry in run.docs.values()
+        if "download" in entry["phases"]
+    ]
+    phases = {
+        phase: round(total, 3) for phase, (_, total, _) in sorted(run.phases.items())
+    }
+    p50 = percentile(latencies, 0.5)
+    p99 = percentile(latencies, 0.99)
+    return {
+        "scenario": name,
+        "ok": ok,
+        "wall_seconds": round(wall_seconds, 3),
+        "docs": len(latencies),
+        "docs_per_second": round(len(latencies) / wall_seconds, 2),
+        "export_p50_seconds": round(p50, 3) if p50 is not None else None,
+        "export_p99_seconds": round(p99, 3) if p99 is not None else None,
+        "peak_rss_bytes": get_peak_rss_bytes(),
+        "phase_seconds": phases,
+    }
+
+
+async def main() -> int:
+    args = parse_args()
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.WARNING,
+        format="%(asctime)s - %(message)s",
+    )
+
+    port = get_free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    save_path = args.save_path or tempfile.mkdtemp(prefix="yuque-bench-")
+    os.environ.update(
+        {
+            "YUQUE_TOKEN": "bench",
+            "YUQUE_SESSION": "bench",
+            "YUQUE_BASE_URL": base_url,
+            "SAVE_PATH": save_path,
+            "EXPORT_FORMAT": args.format,
+            "METRICS_PORT": "0",
+        }
+    )
+    reload_settings()
+    profiler.enable_profiling(
+        profiler.ProfileOptions(directory=os.path.join(save_path, ".bench"))
+    )
+
+    mock = await start_mock(args, port)
+    results = []
+    try:
+        for scenario in filter(None, args.scenario.split(",")):
+            if scenario == "download":
+                result = await run_scenario("download", engine.download_all)
+            elif scenario == "monitor":
+                touched = await mock_call(
+                    base_url, "POST", "/_bench/touch", fraction=args.touch
+                )
+                result = await run_scenario("monitor", engine.monitor_updates)
+                result["touched"] = touched["touched"]
+            else:
+                logger.error("未知场景 %s", scenario)
+                return 1
+            results.append(result)
+            print(
+                f"{result['scenario']:<8} docs={result['docs']:<6} "
+                f"wall={result['wall_seconds']:.2f}s "
+                f"docs/s={result['docs_per_second']:<8} "
+                f"p50={result['export_p50_seconds'] or '-'}s "
+                f"p99={result['export_p99_seconds'] or '-'}s "
+                f"peak_rss={(result['peak_rss_bytes'] or 0) / 1048576:.1f}MB"
+            )
+        server_stats = await mock_call(base_url, "GET", "/_bench/stats")
+    finally:
+        mock.terminate()
+        await mock.wait()
+
+    if args.output:
+        report = {
+            "options": vars(args),
+            "save_path": save_path,
+            "results": results,
+            "server_requests": server_stats["requests"],
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 0 if all(result["ok"] for result in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -1,24 +1,45 @@
 # -*- coding: utf-8 -*-
+import json
+import logging
 import os
+from dataclasses import dataclass, replace
 from typing import Any
-from dotenv import load_dotenv
+from dotenv import dotenv_values, load_dotenv
 
-def load_env():
+logger = logging.getLogger(__name__)
+
+# 进程启动时已有的环境变量，重新加载 .env 时不覆盖
+_PROCESS_ENV_KEYS = frozenset(os.environ)
+
+EXPORT_FORMATS = ("pdf", "markdown")
+
+
+def load_env(reload: bool = False):
     """
     加载环境变量
+
+    :param reload: 重新读取 .env，更新之前由 .env 提供的变量，进程环境变量仍然优先
     """
     try:
-        load_dotenv()
+        if not reload:
+            load_dotenv()
+            return
+
+        for key, value in dotenv_values().items():
+            if key not in _PROCESS_ENV_KEYS and value is not None:
+                os.environ[key] = value
     except:
         print("跳过加载 .env")
         pass
-        
 
-def get_config() -> dict[str, Any]:
+
+def get_config(reload: bool = False) -> dict[str, Any]:
     """
     从环境变量获取配置，如果环境变量不存在则使用默认值
+
+    每次调用都会重新读取 .env 并解析，运行中请使用 get_settings()。
     """
-    load_env()
+    load_env(reload)
 
     # 读取环境变量
     yuque_base_url = os.getenv("YUQUE_BASE_URL", "https://www.yuque.com")
@@ -26,12 +47,46 @@ def get_config() -> dict[str, Any]:
     yuque_session = os.getenv("YUQUE_SESSION", "")
     save_path = os.getenv("SAVE_PATH", "/data")
     monitor_interval = os.getenv("MONITOR_INTERVAL_MINUTES", "10")
+    monitor_mode = os.getenv("MONITOR_MODE", "full").lower()
+    monitor_reconcile_every = os.getenv("MONITOR_RECONCILE_EVERY", "12")
+    monitor_jitter_percent = os.getenv("MONITOR_JITTER_PERCENT", "10")
     export_format = os.getenv("EXPORT_FORMAT", "pdf").lower()
+    export_workers = os.getenv("EXPORT_WORKERS", "3")
+    book_priority = os.getenv("BOOK_PRIORITY", "")
+    download_schedule = os.getenv("DOWNLOAD_SCHEDULE", "longest").lower()
+    export_max_inflight = os.getenv("EXPORT_MAX_INFLIGHT", "50")
+    yuque_page_size = os.getenv("YUQUE_PAGE_SIZE", "100")
+    yuque_rate_limit = os.getenv("YUQUE_RATE_LIMIT", "10")
+    yuque_min_concurrency = os.getenv("YUQUE_MIN_CONCURRENCY", "1")
+    yuque_max_concurrency = os.getenv("YUQUE_MAX_CONCURRENCY", "8")
+    http_max_connections = os.getenv("HTTP_MAX_CONNECTIONS", "100")
+    http_max_connections_per_host = os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", "10")
+    http_keepalive_seconds = os.getenv("HTTP_KEEPALIVE_SECONDS", "30")
+    http_timeout_seconds = os.getenv("HTTP_TIMEOUT_SECONDS", "120")
+    download_buffer_mb = os.getenv("DOWNLOAD_BUFFER_MB", "8")
+    localize_assets = os.getenv("LOCALIZE_ASSETS", "false").lower()
+    asset_credential_hosts = os.getenv("ASSET_CREDENTIAL_HOSTS", "yuque.com,nlark.com")
+    detail_cache_ttl_hours = os.getenv("DETAIL_CACHE_TTL_HOURS", "168")
+    detail_cache_max_entries = os.getenv("DETAIL_CACHE_MAX_ENTRIES", "10000")
+    revision_keep = os.getenv("REVISION_KEEP", "20")
+    revision_max_age_days = os.getenv("REVISION_MAX_AGE_DAYS", "90")
+    metrics_host = os.getenv("METRICS_HOST", "127.0.0.1")
+    metrics_port = os.getenv("METRICS_PORT", "0")
+    webhook_host = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+    webhook_port = os.getenv("WEBHOOK_PORT", "0")
+    webhook_token = os.getenv("WEBHOOK_TOKEN", "")
+    webhook_debounce_seconds = os.getenv("WEBHOOK_DEBOUNCE_SECONDS", "10")
+    webhook_reconcile_minutes = os.getenv("WEBHOOK_RECONCILE_MINUTES", "360")
+    accounts_file = os.getenv("ACCOUNTS_FILE", "")
+    global_max_concurrency = os.getenv("GLOBAL_MAX_CONCURRENCY", "0")
+    sharding = os.getenv("SHARDING", "false").lower()
+    shard_replica_id = os.getenv("SHARD_REPLICA_ID", "")
+    shard_lease_seconds = os.getenv("SHARD_LEASE_SECONDS", "120")
 
-    # 验证必需的配置
-    if not yuque_token:
+    # 验证必需的配置，使用账号文件时凭据来自文件
+    if not accounts_file and not yuque_token:
         print("警告: YUQUE_TOKEN 未设置或为空")
-    if not yuque_session:
+    if not accounts_file and not yuque_session:
         print("警告: YUQUE_SESSION 未设置或为空")
 
     config = {
@@ -42,19 +97,383 @@ def get_config() -> dict[str, Any]:
         },
         "save_path": save_path,
         "monitor_interval_minutes": int(monitor_interval),
-        "export_format": export_format,
+        "monitor_mode": monitor_mode,
+        "monitor_reconcile_every": max(1, int(monitor_reconcile_every)),
+        "monitor_jitter_percent": min(100.0, max(0.0, float(monitor_jitter_percent))),
+        "export_formats": parse_export_formats(export_format),
+        "export_workers": max(1, int(export_workers)),
+        "export_max_inflight": max(1, int(export_max_inflight)),
+        "book_priority": parse_book_priority(book_priority),
+        "download_schedule": download_schedule,
+        "page_size": max(1, int(yuque_page_size)),
+        "limit": {
+            "requests_per_second": float(yuque_rate_limit),
+            "min_concurrency": max(1, int(yuque_min_concurrency)),
+            "max_concurrency": max(1, int(yuque_max_concurrency)),
+            "global_max_concurrency": max(0, int(global_max_concurrency)),
+        },
+        "http": {
+            "max_connections": int(http_max_connections),
+            "max_connections_per_host": int(http_max_connections_per_host),
+            "keepalive_seconds": float(http_keepalive_seconds),
+            "timeout_seconds": float(http_timeout_seconds),
+        },
+        "download_buffer_bytes": max(1, int(float(download_buffer_mb) * 1024 * 1024)),
+        "localize_assets": localize_assets in ("1", "true", "yes", "on"),
+        "asset_credential_hosts": parse_hosts(asset_credential_hosts),
+        "detail_cache": {
+            "ttl_seconds": max(0.0, float(detail_cache_ttl_hours)) * 3600,
+            "max_entries": max(1, int(detail_cache_max_entries)),
+        },
+        "revision": {
+            "keep": max(0, int(revision_keep)),
+            "max_age_days": max(0.0, float(revision_max_age_days)),
+        },
+        "metrics_host": metrics_host,
+        "metrics_port": max(0, int(metrics_port)),
+        "webhook": {
+            "host": webhook_host,
+            "port": max(0, int(webhook_port)),
+            "token": webhook_token,
+            "debounce_seconds": max(0.0, float(webhook_debounce_seconds)),
+            "reconcile_minutes": max(1, int(webhook_reconcile_minutes)),
+        },
+        "shard": {
+            "enabled": sharding in ("1", "true", "yes", "on"),
+            "replica_id": shard_replica_id.strip(),
+            "lease_seconds": max(10.0, float(shard_lease_seconds)),
+        },
     }
 
-    # 验证导出格式
-    if config["export_format"] not in ["pdf", "markdown"]:
-        print(f"警告: 不支持的导出格式 '{config['export_format']}'，将使用默认格式 'pdf'")
-        config["export_format"] = "pdf"
+    # 第一个格式为主格式，用于只需要单一格式的地方
+    config["export_format"] = config["export_formats"][0]
+    config["accounts"] = load_accounts(accounts_file, config) if accounts_file else []
 
     return config
 
+
+def load_accounts(path: str, defaults: dict[str, Any]) -> list[dict[str, Any]]:
+    """
+    读取多账号配置文件
+
+    JSON 格式，{"accounts": [...]} 或直接为列表，每个账号：
+        name              账号名称，必填且不能重复，用于日志、指标与 webhook 地址
+        token / session   语雀凭据，必填
+        base_url          默认使用 YUQUE_BASE_URL
+        save_path         默认为 SAVE_PATH/<name>
+        export_format     默认使用 EXPORT_FORMAT，同样支持逗号分隔多个格式
+        max_concurrency   该账号的并发上限，默认使用 YUQUE_MAX_CONCURRENCY
+        rate_limit        该账号每秒请求数上限，默认使用 YUQUE_RATE_LIMIT
+
+    可选项为 null 时同样使用默认值。
+
+    :raises ValueError:  文件无法读取或格式错误，错误信息中包含出错的账号名称
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError) as exc:
+        raise ValueError(f"无法读取账号配置文件 {path}: {exc}") from exc
+
+    items = data.get("accounts") if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        raise ValueError(f"账号配置文件 {path} 中没有账号")
+
+    limit = defaults["limit"]
+    accounts = []
+    for item in items:
+        name = str(item.get("name") or "").strip() if isinstance(item, dict) else ""
+        if not name:
+            raise ValueError(f"账号配置文件 {path} 中有账号缺少 name")
+        if any(account["name"] == name for account in accounts):
+            raise ValueError(f"账号配置文件 {path} 中账号名称重复: {name}")
+        if not item.get("token") or not item.get("session"):
+            print(f"警告: 账号 '{name}' 的 token 或 session 为空")
+
+        export_format = item.get("export_format")
+        if export_format is not None and not isinstance(export_format, str):
+            raise ValueError(
+                f"账号配置文件 {path} 中账号 '{name}' 的 export_format 必须是字符串"
+            )
+
+        def get_number(key: str, convert, default):
+            value = item.get(key)
+            if value is None:
+                return default
+            try:
+                return convert(value)
+            except (TypeError, ValueError):
+                raise ValueError(
+                    f"账号配置文件 {path} 中账号 '{name}' 的 {key} 无效: {value!r}"
+                ) from None
+
+        accounts.append(
+            {
+                "name": name,
+                "base_url": item.get("base_url") or defaults["yuque"]["base_url"],
+                "token": item.get("token") or "",
+                "session": item.get("session") or "",
+                "save_path": item.get("save_path")
+                or os.path.join(defaults["save_path"], name),
+                "export_formats": (
+                    parse_export_formats(export_format.lower())
+                    if export_format
+                    else defaults["export_formats"]
+                ),
+                "max_concurrency": max(
+                    1, get_number("max_concurrency", int, limit["max_concurrency"])
+                ),
+                "requests_per_second": get_number(
+                    "rate_limit", float, limit["requests_per_second"]
+                ),
+            }
+        )
+    return accounts
+
+
+def parse_export_formats(value: str) -> list[str]:
+    """
+    解析导出格式列表
+
+    格式为逗号分隔，例如 "pdf,markdown"；不支持的格式忽略，全部无效时使用 pdf。
+    """
+    formats = []
+    for item in value.split(","):
+        export_format = item.strip()
+        if not export_format or export_format in formats:
+            continue
+        if export_format not in EXPORT_FORMATS:
+            print(f"警告: 不支持的导出格式 '{export_format}'，已忽略")
+            continue
+        formats.append(export_format)
+
+    if not formats:
+        print("警告: 没有有效的导出格式，将使用默认格式 'pdf'")
+        formats.append("pdf")
+    return formats
+
+
+def parse_hosts(value: str) -> list[str]:
+    """解析逗号分隔的域名列表，例如 "yuque.com,*.nlark.com"，统一为小写、去掉开头的 *. 。"""
+    hosts = []
+    for item in value.split(","):
+        host = item.strip().lower().removeprefix("*.").strip(".")
+        if host and host not in hosts:
+            hosts.append(host)
+    return hosts
+
+
+def parse_book_priority(value: str) -> dict[str, float]:
+    """
+    解析知识库优先级权重
+
+    格式为逗号分隔的 "知识库ID或名称:权重"，例如 "123:3,周报:0.5"；
+    权重越大越先导出，未配置的知识库为 1。
+    """
+    weights = {}
+    for item in value.split(","):
+        key, sep, weight = item.strip().rpartition(":")
+        if not sep or not key.strip():
+            if item.strip():
+                print(f"警告: 无法解析的 BOOK_PRIORITY 项 '{item.strip()}'，已忽略")
+            continue
+        try:
+            weights[key.strip()] = max(0.01, float(weight))
+        except ValueError:
+            print(f"警告: 无法解析的 BOOK_PRIORITY 权重 '{item.strip()}'，已忽略")
+    return weights
+
+
 def save_config(config_data: dict[str, Any]) -> bool:
     """
     环境变量模式下不支持保存配置
     """
     print("警告: 环境变量模式下不支持保存配置，请直接设置环境变量")
-    return False
\ No newline at end of file
+    return False
+
+
+@dataclass(frozen=True)
+class YuqueSettings:
+    base_url: str
+    token: str
+    session: str
+
+
+@dataclass(frozen=True)
+class LimitSettings:
+    requests_per_second: float
+    min_concurrency: int
+    max_concurrency: int
+    global_max_concurrency: int  # 所有账号合计的并发上限，0 表示不限制
+
+
+@dataclass(frozen=True)
+class HttpSettings:
+    max_connections: int
+    max_connections_per_host: int
+    keepalive_seconds: float
+    timeout_seconds: float
+
+
+@dataclass(frozen=True)
+class DetailCacheSettings:
+    ttl_seconds: float
+    max_entries: int
+
+
+@dataclass(frozen=True)
+class RevisionSettings:
+    keep: int
+    max_age_days: float
+
+
+@dataclass(frozen=True)
+class WebhookSettings:
+    host: str
+    port: int  # 0 表示不启动
+    token: str
+    debounce_seconds: float
+    reconcile_minutes: int  # 启用 webhook 后的全量核对间隔
+
+
+@dataclass(frozen=True)
+class ShardSettings:
+    enabled: bool
+    replica_id: str  # 为空时使用 主机名-进程号
+    lease_seconds: float  # 副本心跳与知识库租约的有效期
+
+
+@dataclass(frozen=True)
+class AccountSettings:
+    name: str
+    base_url: str
+    token: str
+    session: str
+    save_path: str
+    export_formats: tuple[str, ...]
+    max_concurrency: int
+    requests_per_second: float
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    不可变的配置快照
+
+    由 get_config() 的结果转换而来，进程内只解析一次，
+    通过 get_settings() 获取，reload_settings() 重新加载。
+    """
+
+    yuque: YuqueSettings
+    save_path: str
+    monitor_interval_minutes: int
+    monitor_mode: str
+    monitor_reconcile_every: int
+    monitor_jitter_percent: float
+    export_format: str  # 主格式，即 export_formats[0]
+    export_formats: tuple[str, ...]
+    export_workers: int
+    export_max_inflight: int
+    book_priority: dict[str, float]  # 知识库ID或名称 -> 优先级权重
+    download_schedule: str  # 全量下载的出队顺序：longest 或 fair
+    page_size: int
+    limit: LimitSettings
+    http: HttpSettings
+    download_buffer_bytes: int
+    localize_assets: bool
+    asset_credential_hosts: tuple[str, ...]  # 下载资源时可以携带语雀凭据的域名
+    detail_cache: DetailCacheSettings
+    revision: RevisionSettings
+    metrics_host: str
+    metrics_port: int
+    webhook: WebhookSettings
+    shard: ShardSettings
+    accounts: tuple[AccountSettings, ...]  # 为空时只同步环境变量中的账号
+    account: str = ""  # 由 for_account() 生成的快照所属的账号
+
+    @classmethod
+    def from_config(cls, cfg: dict[str, Any]) -> "Settings":
+        return cls(
+            yuque=YuqueSettings(**cfg["yuque"]),
+            save_path=cfg["save_path"],
+            monitor_interval_minutes=cfg["monitor_interval_minutes"],
+            monitor_mode=cfg["monitor_mode"],
+            monitor_reconcile_every=cfg["monitor_reconcile_every"],
+            monitor_jitter_percent=cfg["monitor_jitter_percent"],
+            export_format=cfg["export_format"],
+            export_formats=tuple(cfg["export_formats"]),
+            export_workers=cfg["export_workers"],
+            export_max_inflight=cfg["export_max_inflight"],
+            book_priority=cfg["book_priority"],
+            download_schedule=cfg["download_schedule"],
+            page_size=cfg["page_size"],
+            limit=LimitSettings(**cfg["limit"]),
+            http=HttpSettings(**cfg["http"]),
+            download_buffer_bytes=cfg["download_buffer_bytes"],
+            localize_assets=cfg["localize_assets"],
+            asset_credential_hosts=tuple(cfg["asset_credential_hosts"]),
+            detail_cache=DetailCacheSettings(**cfg["detail_cache"]),
+            revision=RevisionSettings(**cfg["revision"]),
+            metrics_host=cfg["metrics_host"],
+            metrics_port=cfg["metrics_port"],
+            webhook=WebhookSettings(**cfg["webhook"]),
+            shard=ShardSettings(**cfg["shard"]),
+            accounts=tuple(
+                AccountSettings(
+                    **{**account, "export_formats": tuple(account["export_formats"])}
+                )
+                for account in cfg["accounts"]
+            ),
+        )
+
+    def for_account(self, account: AccountSettings) -> "Settings":
+        """生成单个账号的配置快照，账号文件中未设置的项沿用全局配置。"""
+        return replace(
+            self,
+            yuque=YuqueSettings(account.base_url, account.token, account.session),
+            save_path=account.save_path,
+            export_format=account.export_formats[0],
+            export_formats=account.export_formats,
+            limit=replace(
+                self.limit,
+                requests_per_second=account.requests_per_second,
+                max_concurrency=account.max_concurrency,
+                min_concurrency=min(
+                    self.limit.min_concurrency, account.max_concurrency
+                ),
+            ),
+            export_workers=min(self.export_workers, account.max_concurrency),
+            account=account.name,
+        )
+
+    def get_account_settings(self) -> list["Settings"]:
+        """需要同步的各账号配置，未配置账号文件时只有当前配置本身。"""
+        if not self.accounts:
+            return [self]
+        return [self.for_account(account) for account in self.accounts]
+
+
+_settings: Settings | None = None
+
+
+def get_settings() -> Settings:
+    """获取当前配置快照，首次调用时加载。"""
+    global _settings
+    if _settings is None:
+        _settings = Settings.from_config(get_config())
+    return _settings
+
+
+def reload_settings() -> Settings:
+    """
+    重新读取 .env 与环境变量，生成新的配置快照
+
+    已经创建的客户端继续使用旧快照，下一轮同步开始时使用新配置。
+    """
+    global _settings
+    try:
+        _settings = Settings.from_config(get_config(reload=True))
+        logger.info("[config] 配置已重新加载")
+    except Exception as exc:
+        logger.error("[config] 重新加载配置失败，继续使用原配置 error=%s", exc)
+    return get_settings()
@@ -0,0 +1,1322 @@
+# -*- coding: utf-8 -*-
+import abc
+import asyncio
+import collections
+import contextlib
+import datetime
+import heapq
+import itertools
+import logging
+import os
+import random
+import signal
+import time
+
+from activity import collect_activity_targets, resolve_target_books
+from config import Settings, get_settings, reload_settings
+from metrics import (
+    QUEUE_DEPTH,
+    SYNCED_DOCS,
+    observe_freshness,
+    parse_timestamp,
+    percentile,
+    start_metrics_server,
+)
+from model import YuqueBook, YuqueDocs
+from pipeline import ExportPipeline, ExportTask
+import profiler
+from shard import ShardCoordinator
+from store import StateStore, get_state_db_path
+from webhook import ACTION_DELETE, DocEvent, WebhookReceiver
+from yuque import (
+    SharedHttp,
+    Yuque,
+    build_doc_save_path,
+    format_book_context,
+    format_doc_context,
+    get_book_dir,
+    get_file_extension,
+    sanitize_filename,
+    scan_directory_files,
+)
+
+logger = logging.getLogger(__name__)
+
+BOOK_LISTING_WORKERS = 4
+DAEMON_RETRY_SECONDS = 60
+
+# 导出任务的出队顺序
+SCHEDULE_FAIR = "fair"  # 按知识库轮转
+SCHEDULE_FRESHNESS = "freshness"  # 最近编辑的文档优先
+SCHEDULE_LONGEST = "longest"  # 预计耗时最长的文档优先
+
+# 没有耗时记录时的先验估算：耗时 = 基础耗时 + 每字耗时 * 字数，按导出格式区分
+EXPORT_COST_PRIORS = {
+    "markdown": (2.0, 0.0005),
+    "pdf": (8.0, 0.004),
+}
+# 先验相当于多少个样本，样本越多拟合结果的权重越大
+EXPORT_COST_PRIOR_WEIGHT = 20
+# 每个字对应的导出文件字节数，没有字数记录时由上次的文件大小换算
+BYTES_PER_WORD = {
+    "markdown": 4,
+    "pdf": 80,
+}
+
+
+class BookFairQueue:
+    """
+    按知识库轮转出队的导出队列
+
+    每个知识库维护一个子队列，出队时在知识库之间轮换，
+    小知识库的文档不会排在大知识库的全部文档之后。
+    """
+
+    def __init__(self, account: str = "default"):
+        """
+        :param account:  队列长度指标中的账号
+        """
+        self.account = account
+        self._queues: dict[int, collections.deque] = {}
+        self._order: collections.deque = collections.deque()
+        self._size = 0
+        self._closed = False
+        self._changed = asyncio.Condition()
+
+    def __len__(self) -> int:
+        return self._size
+
+    async def put(self, task: ExportTask) -> None:
+        async with self._changed:
+            book_queue = self._queues.get(task.book.id)
+            if book_queue is None:
+                book_queue = self._queues[task.book.id] = collections.deque()
+                self._order.append(task.book.id)
+            book_queue.append(task)
+            self._size += 1
+            QUEUE_DEPTH.set(self._size, account=self.account)
+            self._changed.notify()
+
+    async def close(self) -> None:
+        """标记不会再有新任务，队列取空后 get() 返回 None。"""
+        async with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    async def get(self) -> ExportTask | None:
+        async with self._changed:
+            while not self._size:
+                if self._closed:
+                    return None
+                await self._changed.wait()
+
+            book_id = self._order.popleft()
+            book_queue = self._queues[book_id]
+            task = book_queue.popleft()
+            self._size -= 1
+            QUEUE_DEPTH.set(self._size, account=self.account)
+
+            if book_queue:
+                self._order.append(book_id)
+            else:
+                del self._queues[book_id]
+            return task
+
+
+class PriorityExportQueue(abc.ABC):
+    """
+    跨知识库的优先级导出队列
+
+    所有知识库的任务放在同一个堆中，按 get_priority(task) 从小到大出队。
+    hold_until_closed 为真时规划结束（close()）后才开始出队，排序覆盖全部知识库；
+    否则有任务即出队，规划与导出重叠，只在已规划的任务中排序。
+    """
+
+    hold_until_closed = False
+
+    def __init__(self, account: str = "default"):
+        """
+        :param account:  队列长度指标中的账号
+        """
+        self.account = account
+        self._heap: list[tuple[float, int, ExportTask]] = []
+        self._sequence = itertools.count()
+        self._closed = False
+        self._changed = asyncio.Condition()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    @abc.abstractmethod
+    def get_priority(self, task: ExportTask) -> float:
+        """出队顺序，越小越先导出。"""
+
+    async def put(self, task: ExportTask) -> None:
+        async with self._changed:
+            heapq.heappush(
+                self._heap, (self.get_priority(task), next(self._sequence), task)
+            )
+            QUEUE_DEPTH.set(len(self._heap), account=self.account)
+            self._changed.notify()
+
+    async def close(self) -> None:
+        """标记不会再有新任务，队列取空后 get() 返回 None。"""
+        async with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+
+    async def get(self) -> ExportTask | None:
+        async with self._changed:
+            await self._changed.wait_for(self._can_get)
+            if not self._heap:
+                return None
+            task = heapq.heappop(self._heap)[2]
+            QUEUE_DEPTH.set(len(self._heap), account=self.account)
+            return task
+
+    def _can_get(self) -> bool:
+        if self._closed:
+            return True
+        return bool(self._heap) and not self.hold_until_closed
+
+
+class FreshnessQueue(PriorityExportQueue):
+    """
+    按新鲜度排序的全局导出队列
+
+    最近编辑的文档最先导出；排序键为文档编辑至今的时间除以知识库权重，权重越大越靠前。
+    为了在全部知识库之间比较，规划结束后才开始出队。
+    """
+
+    hold_until_closed = True
+
+    def __init__(
+        self, weights: dict[str, float] | None = None, account: str = "default"
+    ):
+        """
+        :param weights:  知识库ID或名称 -> 优先级权重，未配置的知识库为 1
+        """
+        super().__init__(account)
+        self.weights = weights or {}
+        self._now = time.time()
+
+    def get_weight(self, book: YuqueBook) -> float:
+        weight = self.weights.get(str(book.id))
+        if weight is None:
+            weight = self.weights.get(book.name, 1.0)
+        return weight
+
+    def get_priority(self, task: ExportTask) -> float:
+        updated = parse_timestamp(task.doc.updated_at)
+        if updated is None:
+            return float("inf")
+        age = max(0.0, self._now - updated.timestamp())
+        return age / self.get_weight(task.book)
+
+
+class ExportCostModel:
+    """
+    预测单个文档的导出耗时（提交到就绪 + 下载）
+
+    导出过的文档直接使用上次记录的耗时；
+    没有记录的文档按字数估算：耗时 = a + b * 字数，
+    a、b 从按格式设定的先验出发，随状态库中记录的样本增多逐渐过渡到最小二乘拟合的结果，
+    刚开始同步时也能按字数区分大小文档，不会退化为先进先出。
+    """
+
+    def __init__(self, base_seconds: float, seconds_per_word: float):
+        self.base_seconds = base_seconds
+        self.seconds_per_word = seconds_per_word
+
+    @classmethod
+    def from_prior(cls, export_format: str) -> "ExportCostModel":
+        return cls(*EXPORT_COST_PRIORS.get(export_format, EXPORT_COST_PRIORS["pdf"]))
+
+    @classmethod
+    def from_store(cls, store: StateStore, export_format: str) -> "ExportCostModel":
+        prior = cls.from_prior(export_format)
+        stats = store.get_export_duration_stats(export_format)
+        count = stats["count"]
+        if count == 0:
+            return prior
+
+        variance = count * stats["sum_xx"] - stats["sum_x"] ** 2
+        if variance > 0:
+            slope = (
+                count * stats["sum_xy"] - stats["sum_x"] * stats["sum_y"]
+            ) / variance
+            slope = max(0.0, slope)
+        else:
+            # 样本字数都相同时无法拟合斜率，沿用先验
+            slope = prior.seconds_per_word
+        base = max(0.0, (stats["sum_y"] - slope * stats["sum_x"]) / count)
+
+        weight = count / (count + EXPORT_COST_PRIOR_WEIGHT)
+        return cls(
+            base_seconds=weight * base + (1 - weight) * prior.base_seconds,
+            seconds_per_word=weight * slope + (1 - weight) * prior.seconds_per_word,
+        )
+
+    def estimate(self, task: ExportTask) -> float:
+        if task.previous_seconds is not None:
+            return task.previous_seconds
+        words = task.doc.word_count or task.previous_words or 0
+        return self.base_seconds + self.seconds_per_word * words
+
+
+class LongestFirstQueue(PriorityExportQueue):
+    """
+    预计耗时最长的文档最先导出
+
+    大文档的导出排队时间长，先提交可以和其余文档的导出重叠，
+    避免一轮同步最后只剩几个大文档在等待，缩短整轮的完成时间。
+    不同格式的导出耗时差别很大，各用一个 ExportCostModel。
+    """
+
+    def __init__(
+        self, cost_models: dict[str, ExportCostModel], account: str = "default"
+    ):
+        super().__init__(account)
+        self.cost_models = cost_models
+
+    def get_priority(self, task: ExportTask) -> float:
+        return -self.cost_models[task.export_format].estimate(task)
+
+
+def has_document_update(doc: YuqueDocs, version: dict | None) -> bool:
+    """文档更新时间晚于上次记录的版本时视为有更新。"""
+    if not version:
+        return True
+    return (doc.updated_at or "") > (version.get("updated_at") or "")
+
+
+def get_previous_word_count(version: dict | None, export_format: str) -> int | None:
+    """上次记录的字数，没有时按上次保存的文件大小换算。"""
+    if not version:
+        return None
+    if version.get("word_count"):
+        return version["word_count"]
+    if version.get("file_size"):
+        return version["file_size"] // BYTES_PER_WORD.get(export_format, 1)
+    return None
+
+
+def get_file_size(path: str) -> int | None:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def get_previous_export_seconds(version: dict | None) -> float | None:
+    """上次导出的总耗时，没有记录时返回 None。"""
+    if not version:
+        return None
+    pending = version.get("pending_seconds")
+    download = version.get("download_seconds")
+    if pending is None or download is None:
+        return None
+    return pending + download
+
+
+async def build_book_export_tasks(
+    book: YuqueBook,
+    docs: list[YuqueDocs],
+    versions: dict[tuple[int, str], dict],
+    save_base_path: str,
+    export_formats: tuple[str, ...],
+    check_missing: bool = True,
+) -> tuple[list[ExportTask], int]:
+    """
+    构建单个知识库的导出任务。
+
+    每个知识库只扫描一次目录，逐个文档的存在判断都在内存中完成；
+    每个文档只规划一次，需要更新的格式各生成一个任务。
+
+    :param versions:      该知识库已记录的版本 {(文档ID, 格式): 版本记录}
+    :param check_missing: 本地文件缺失时是否重新导出
+    :return:              (导出任务列表, 所有格式都无需导出的文档数)
+    """
+    export_tasks = []
+    skip_count = 0
+    book_dir = get_book_dir(save_base_path, book)
+    existing_files = scan_directory_files(book_dir) if check_missing else set()
+
+    for doc in docs:
+        if doc.type != "Doc":
+            skip_count += 1
+            continue
+
+        doc_tasks = []
+        for export_format in export_formats:
+            filename = sanitize_filename(doc.title) + get_file_extension(export_format)
+            save_path = os.path.join(book_dir, filename)
+            version = versions.get((doc.id, export_format))
+            previous_seconds = get_previous_export_seconds(version)
+            previous_words = get_previous_word_count(version, export_format)
+            if check_missing and filename not in existing_files:
+                doc_tasks.append(
+                    ExportTask(
+                        book,
+                        doc,
+                        save_path,
+                        export_format,
+                        previous_seconds=previous_seconds,
+                        previous_words=previous_words,
+                    )
+                )
+                continue
+
+            if not has_document_update(doc, version):
+                continue
+
+            logger.info(
+                "[plan] 文档有更新，准备重新导出 %s format=%s",
+                format_doc_context(book, doc),
+                export_format,
+            )
+            doc_tasks.append(
+                ExportTask(
+                    book,
+                    doc,
+                    save_path,
+                    export_format,
+                    previous_hash=version.get("content_hash") if version else None,
+                    previous_seconds=previous_seconds,
+                    previous_words=previous_words,
+                )
+            )
+
+        if not doc_tasks:
+            skip_count += 1
+        export_tasks.extend(doc_tasks)
+
+    return export_tasks, skip_count
+
+
+class SyncEngine:
+    """
+    跨知识库的同步引擎
+
+    规划协程并发列出各知识库的文档，把需要导出的文档放入公平队列；
+    导出流水线同时从队列中取任务提交、轮询、下载，规划与导出互相重叠。
+    schedule 决定出队顺序：fair 按知识库轮转（BookFairQueue），
+    freshness 在全部知识库规划完成后按新鲜度导出（FreshnessQueue），
+    longest 按历史耗时或字数预计的导出耗时从长到短（LongestFirstQueue）。
+    download 与 monitor 命令共用同一个引擎，只在规划策略上不同。
+    传入 shard 时只同步分给本副本的知识库，并在规划前取得知识库的租约、全部任务完成后释放。
+    """
+
+    def __init__(
+        self,
+        yuque: Yuque,
+        store: StateStore,
+        name: str,
+        check_missing: bool = True,
+        schedule: str = SCHEDULE_FAIR,
+        shard: ShardCoordinator | None = None,
+    ):
+        settings = yuque.settings
+        self.yuque = yuque
+        self.store = store
+        self.name = name
+        self.check_missing = check_missing
+        self.shard = shard
+        self.save_base_path = settings.save_path
+        self.export_formats = settings.export_formats
+        # 各阶段协程数取并发上限，实际并发由 yuque.limiter 动态控制
+        self.workers = yuque.limiter.concurrency.maximum
+        self.max_inflight = settings.export_max_inflight
+        if schedule == SCHEDULE_FRESHNESS:
+            self.queue = FreshnessQueue(settings.book_priority, yuque.account)
+        elif schedule == SCHEDULE_LONGEST:
+            self.queue = LongestFirstQueue(
+                {
+                    export_format: ExportCostModel.from_store(store, export_format)
+                    for export_format in self.export_formats
+                },
+                yuque.account,
+            )
+        else:
+            self.queue = BookFairQueue(yuque.account)
+        self._freshness_lags: list[float] = []
+        self.stats = {
+            "books": 0,
+            "docs": 0,
+            "success": 0,
+            "skip": 0,
+            "fail": 0,
+            "unchanged": 0,
+            "books_unchanged": 0,
+            "books_other_shard": 0,
+        }
+        self._book_pending: dict[int, int] = {}
+        self._book_failed: set[int] = set()
+        self._book_full_listing: set[int] = set()
+
+    async def run(
+        self, targets: list[tuple[YuqueBook, set[int]]] | None = None
+    ) -> dict:
+        """
+        执行一轮同步并返回统计信息。
+
+        :param targets: 只同步指定的 (知识库, 文档ID集合)，为 None 时同步全部知识库
+        """
+        logger.info(
+            "[%s] 开始同步 concurrency=%s/%s",
+            self.name,
+            int(self.yuque.limiter.concurrency.limit),
+            self.workers,
+        )
+
+        pipeline = ExportPipeline(
+            yuque=self.yuque,
+            source=self.queue,
+            on_done=self._on_export_done,
+            workers=self.workers,
+            max_inflight=self.max_inflight,
+        )
+        pipeline_task = asyncio.create_task(pipeline.run())
+        try:
+            await self._plan_books(targets)
+        except asyncio.CancelledError:
+            # 停止时不再等待队列中的任务导出完
+            pipeline_task.cancel()
+            raise
+        finally:
+            try:
+                await self.queue.close()
+                await pipeline_task
+            finally:
+                # 取消时 await pipeline_task 抛出 CancelledError，仍要清理缓存
+                self.yuque.detail_cache.evict()
+
+        await self.store.commit()
+        self.stats["freshness_p50_seconds"] = percentile(self._freshness_lags, 0.5)
+        self.stats["freshness_p99_seconds"] = percentile(self._freshness_lags, 0.99)
+        if self.stats["books_unchanged"]:
+            logger.info(
+                "[%s] 跳过未变更的知识库 count=%s",
+                self.name,
+                self.stats["books_unchanged"],
+            )
+        if self.stats["books_other_shard"]:
+            logger.info(
+                "[%s] 跳过其他副本负责的知识库 count=%s",
+                self.name,
+                self.stats["books_other_shard"],
+            )
+        return self.stats
+
+    async def _iter_targets(self, targets):
+        if targets is not None:
+            for book, doc_ids in targets:
+                yield book, doc_ids
+            return
+
+        with profiler.phase("books"):
+            async for book in self.yuque.iter_books():
+                yield book, None
+
+    async def _plan_books(self, targets) -> None:
+        """边分页获取知识库边规划，不必等最后一页返回。"""
+        semaphore = asyncio.Semaphore(BOOK_LISTING_WORKERS)
+        plans = []
+
+        async def plan(book: YuqueBook, doc_ids: set[int] | None) -> None:
+            async with semaphore:
+                await self._plan_book(book, doc_ids)
+
+        try:
+            async for book, doc_ids in self._iter_targets(targets):
+                self.stats["books"] += 1
+                plans.append(asyncio.create_task(plan(book, doc_ids)))
+        except asyncio.CancelledError:
+            for task in plans:
+                task.cancel()
+            raise
+        finally:
+            await asyncio.gather(*plans, return_exceptions=True)
+
+        logger.info("[%s] 知识库数量 count=%s", self.name, self.stats["books"])
+
+    def _is_book_unchanged(self, book: YuqueBook) -> bool:
+        """知识库内容更新时间、名称与上次完整同步时一致，同步过当前所有格式，且本地目录仍在。"""
+        if not book.content_updated_at:
+            return False
+
+        book_state = self.store.get_book_state(book.id)
+        if not book_state:
+            return False
+
+        book_dir = get_book_dir(self.save_base_path, book)
+        synced_formats = set((book_state.get("formats") or "").split(","))
+        return (
+            book_state.get("content_updated_at") == book.content_updated_at
+            and book_state.get("name") == book.name
+            and synced_formats.issuperset(self.export_formats)
+            and os.path.isdir(book_dir)
+        )
+
+    async def _plan_book(self, book: YuqueBook, doc_ids: set[int] | None) -> None:
+        book_context = format_book_context(book)
+        # 只同步部分文档时不能代表整个知识库已同步
+        full_listing = doc_ids is None
+        if self.shard is not None and not await self.shard.owns(book.id):
+            self.stats["books_other_shard"] += 1
+            return
+        # 检查缺失文件时（download 与全量核对）必须列出文档，本地删除的文件才会重新导出
+        if full_listing and not self.check_missing and self._is_book_unchanged(book):
+            self.stats["books_unchanged"] += 1
+            logger.debug("[%s] 知识库无变更，跳过 %s", self.name, book_context)
+            return
+        if self.shard is not None and not await self.shard.acquire(book.id):
+            self.stats["books_other_shard"] += 1
+            logger.info("[%s] 知识库正由其他副本同步，跳过 %s", self.name, book_context)
+            return
+
+        try:
+            with profiler.phase("docs", book):
+                docs = await self.yuque.docs(book)
+            if doc_ids is not None:
+                docs = [doc for doc in docs if doc.id in doc_ids]
+            self.stats["docs"] += len(docs)
+
+            with profiler.phase("plan", book):
+                export_tasks, skip_count = await build_book_export_tasks(
+                    book=book,
+                    docs=docs,
+                    versions=self.store.get_book_versions(book.id),
+                    save_base_path=self.save_base_path,
+                    export_formats=self.export_formats,
+                    check_missing=self.check_missing,
+                )
+            self.stats["skip"] += skip_count
+        except Exception as exc:
+            logger.exception(
+                "[%s] 处理知识库失败 %s error=%s", self.name, book_context, exc
+            )
+            await self._release_book(book)
+            return
+
+        if not export_tasks:
+            logger.info("[%s] 无需导出 %s", self.name, book_context)
+            if full_listing:
+                self.store.upsert_book_state(book, self.export_formats)
+            await self._release_book(book)
+            return
+
+        if full_listing:
+            self._book_full_listing.add(book.id)
+
+        export_tasks.sort(key=lambda task: task.doc.updated_at or "", reverse=True)
+        self._book_pending[book.id] = len(export_tasks)
+        logger.info(
+            "[%s] 加入导出队列 %s tasks=%s queued=%s",
+            self.name,
+            book_context,
+            len(export_tasks),
+            len(self.queue) + len(export_tasks),
+        )
+        for task in export_tasks:
+            await self.queue.put(task)
+
+    async def _on_export_done(self, task: ExportTask, success: bool) -> None:
+        context = (
+            f"{format_doc_context(task.book, task.doc)} format={task.export_format}"
+        )
+        if success and not self.yuque.can_write(task.book):
+            # 文件已在租约内写入，但知识库随后被其他副本接手，状态交给新的持有者记录
+            logger.warning("[%s] 知识库租约已丢失，不记录状态 %s", self.name, context)
+            success = False
+        if success:
+            with profiler.phase("persist", task.book, task.doc):
+                self.store.upsert_version(
+                    task.book,
+                    task.doc,
+                    task.export_format,
+                    task.content_hash,
+                    task.pending_seconds,
+                    task.download_seconds,
+                    get_file_size(task.save_path),
+                )
+            self.stats["success"] += 1
+            if task.unchanged:
+                self.stats["unchanged"] += 1
+                SYNCED_DOCS.inc(result="unchanged")
+            else:
+                SYNCED_DOCS.inc(result="saved")
+                lag = observe_freshness(task.doc.updated_at)
+                if lag is not None:
+                    self._freshness_lags.append(lag)
+            logger.info("[%s] 同步成功 %s", self.name, context)
+        else:
+            self.stats["fail"] += 1
+            SYNCED_DOCS.inc(result="failed")
+            self._book_failed.add(task.book.id)
+            logger.warning("[%s] 同步失败 %s", self.name, context)
+
+        await self._finish_book_task(task.book)
+
+    async def _finish_book_task(self, book: YuqueBook) -> None:
+        """知识库的任务全部完成后提交一次状态，全部成功时记录知识库时间戳。"""
+        self._book_pending[book.id] -= 1
+        if self._book_pending[book.id] > 0:
+            return
+
+        del self._book_pending[book.id]
+        with profiler.phase("persist", book):
+            if (
+                book.id in self._book_full_listing
+                and book.id not in self._book_failed
+                and self.yuque.can_write(book)
+            ):
+                self.store.upsert_book_state(book, self.export_formats)
+            await self.store.commit()
+        await self._release_book(book)
+
+    async def _release_book(self, book: YuqueBook) -> None:
+        if self.shard is not None:
+            # 先提交该知识库的状态，接手的副本才能看到
+            await self.store.commit()
+            await self.shard.release(book.id)
+
+
+def get_download_schedule(settings: Settings) -> str:
+    """DOWNLOAD_SCHEDULE=fair 时全量下载按知识库轮转，否则预计耗时最长的优先。"""
+    if settings.download_schedule == SCHEDULE_FAIR:
+        return SCHEDULE_FAIR
+    return SCHEDULE_LONGEST
+
+
+def open_account_store(yuque: Yuque) -> StateStore:
+    """
+    打开账号的状态库并绑定到客户端
+
+    绑定持续到 close_account_store()，全量同步之外的 activity 监控与 webhook 导出
+    同样复用持久化的文档详情缓存与资源索引。
+    """
+    settings = yuque.settings
+    store = StateStore(
+        get_state_db_path(settings.save_path), settings.export_format
+    ).open()
+    yuque.attach_store(store)
+    return store
+
+
+def close_account_store(yuque: Yuque, store: StateStore) -> None:
+    yuque.detach_store()
+    store.close()
+
+
+async def start_account_shard(yuque: Yuque) -> ShardCoordinator | None:
+    """
+    开启 SHARDING 时加入该账号 SAVE_PATH 下的副本分片，否则返回 None
+
+    客户端写入文件前检查知识库的租约仍由本进程持有。
+    """
+    settings = yuque.settings
+    if not settings.shard.enabled:
+        return None
+    shard = await ShardCoordinator(
+        settings.save_path, settings.shard.replica_id, settings.shard.lease_seconds
+    ).start()
+    yuque.write_guard = shard.holds
+    return shard
+
+
+async def run_accounts(name: str, sync_account) -> bool:
+    """
+    在同一个事件循环中同时同步所有账号
+
+    各账号的客户端共用连接池与全局并发名额，单个账号失败不影响其它账号。
+
+    :param sync_account:  async sync_account(yuque, shard) -> bool，同步单个账号
+    """
+    settings = get_settings()
+    shared = SharedHttp(settings)
+
+    async def run_account(account_settings) -> bool:
+        async with Yuque(account_settings, shared) as yuque:
+            if not yuque.is_initialized:
+                logger.error(
+                    "[%s] 客户端初始化失败 account=%s error=%s",
+                    name,
+                    yuque.account,
+                    yuque.init_error or "未知初始化错误",
+                )
+                return False
+            shard = await start_account_shard(yuque)
+            try:
+                return await sync_account(yuque, shard)
+            finally:
+                if shard is not None:
+                    await shard.close()
+
+    with profiler.profile_run(name, settings.save_path):
+        try:
+            results = await asyncio.gather(
+                *(run_account(item) for item in settings.get_account_settings())
+            )
+        finally:
+            await shared.close()
+    return all(results)
+
+
+async def download_all():
+    """下载所有账号的全部语雀文档"""
+    return await run_accounts("download", download_account)
+
+
+async def download_account(yuque: Yuque, shard: ShardCoordinator | None = None) -> bool:
+    try:
+        logger.info("[download] 开始下载全部文档 account=%s", yuque.account)
+        store = open_account_store(yuque)
+        try:
+            engine = SyncEngine(
+                yuque,
+                store,
+                "download",
+                schedule=get_download_schedule(yuque.settings),
+                shard=shard,
+            )
+            stats = await engine.run()
+        finally:
+            close_account_store(yuque, store)
+        logger.info(
+            "[download] 任务完成 account=%s books=%s docs=%s success=%s unchanged=%s "
+            "skip=%s fail=%s",
+            yuque.account,
+            stats["books"],
+            stats["docs"],
+            stats["success"],
+            stats["unchanged"],
+            stats["skip"],
+            stats["fail"],
+        )
+        return True
+    except Exception as exc:
+        logger.exception(
+            "[download] 下载过程中发生错误 account=%s error=%s", yuque.account, exc
+        )
+        return False
+
+
+async def monitor_updates():
+    """监控所有账号的文档更新并下载"""
+    return await run_accounts("monitor", monitor_account)
+
+
+async def monitor_account(yuque: Yuque, shard: ShardCoordinator | None = None) -> bool:
+    logger.info(
+        "[monitor] 开始监控更新 account=%s at=%s",
+        yuque.account,
+        datetime.datetime.now().isoformat(),
+    )
+    try:
+        store = open_account_store(yuque)
+        try:
+            stats = await run_monitor_cycle(yuque, store, shard)
+        finally:
+            close_account_store(yuque, store)
+
+        log_monitor_stats(stats, yuque.account)
+        return True
+    except Exception as exc:
+        logger.exception(
+            "[monitor] 监控更新过程中发生错误 account=%s error=%s", yuque.account, exc
+        )
+        return False
+
+
+async def run_monitor_cycle(
+    yuque: Yuque, store: StateStore, shard: ShardCoordinator | None = None
+) -> dict:
+    """按 MONITOR_MODE 执行一轮增量同步。"""
+    if yuque.settings.monitor_mode == "activity":
+        return await monitor_by_activity(yuque, store, shard)
+    engine = SyncEngine(
+        yuque,
+        store,
+        "monitor",
+        check_missing=False,
+        schedule=SCHEDULE_FRESHNESS,
+        shard=shard,
+    )
+    return await engine.run()
+
+
+def format_seconds(value: float | None) -> str:
+    return "-" if value is None else f"{value:.0f}s"
+
+
+def log_monitor_stats(stats: dict, account: str) -> None:
+    logger.info(
+        "[monitor] 监控完成 account=%s updates=%s unchanged=%s fail=%s "
+        "freshness_p50=%s freshness_p99=%s at=%s",
+        account,
+        stats["success"],
+        stats["unchanged"],
+        stats["fail"],
+        format_seconds(stats["freshness_p50_seconds"]),
+        format_seconds(stats["freshness_p99_seconds"]),
+        datetime.datetime.now().isoformat(),
+    )
+
+
+async def monitor_by_activity(
+    yuque: Yuque, store: StateStore, shard: ShardCoordinator | None = None
+) -> dict:
+    """
+    按团队动态增量同步
+
+    从持久化的游标读取各团队的新动态，只重新导出动态中提到的文档；
+    首次运行、读取动态失败或每隔 MONITOR_RECONCILE_EVERY 轮执行一次全量核对。
+    分片时每个副本各自保存游标：副本只处理自己的知识库，共用游标会让其它副本错过动态；
+    存活副本变化后执行一次全量核对，接手的知识库在之前的动态不会遗漏。
+    """
+    settings = yuque.settings
+    state_key = "monitor" if shard is None else f"monitor:{shard.replica_id}"
+    monitor_state = store.get_value(state_key, {})
+    cycles = monitor_state.get("cycles_since_reconcile", 0)
+    replicas = await shard.members() if shard is not None else []
+
+    scan = await collect_activity_targets(
+        yuque, monitor_state.get("activity_cursors", {})
+    )
+    reconcile = (
+        scan.needs_reconcile
+        or cycles + 1 >= settings.monitor_reconcile_every
+        or replicas != monitor_state.get("replicas", [])
+    )
+
+    engine = SyncEngine(
+        yuque,
+        store,
+        "monitor",
+        check_missing=reconcile,
+        schedule=SCHEDULE_FRESHNESS,
+        shard=shard,
+    )
+    if reconcile:
+        logger.info("[monitor] 执行全量核对 cycles_since_reconcile=%s", cycles)
+        stats = await engine.run()
+    else:
+        targets = await resolve_target_books(yuque, scan)
+        logger.info(
+            "[monitor] 按动态增量同步 events=%s books=%s",
+            scan.events,
+            len(targets),
+        )
+        stats = await engine.run(targets)
+
+    # 游标总是前进：本轮失败的文档由下一次全量核对兜底
+    monitor_state["activity_cursors"] = scan.cursors
+    monitor_state["cycles_since_reconcile"] = 0 if reconcile else cycles + 1
+    if shard is not None:
+        monitor_state["replicas"] = replicas
+    store.set_value(state_key, monitor_state)
+    await store.commit()
+    return stats
+
+
+def install_reload_handler() -> None:
+    """收到 SIGHUP 时重新加载配置，下一轮同步开始生效。"""
+    if not hasattr(signal, "SIGHUP"):
+        return
+
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, reload_settings)
+    except (NotImplementedError, RuntimeError):
+        pass
+
+
+class AccountSync:
+    """
+    常驻进程中单个账号的同步状态
+
+    持有该账号的语雀客户端与状态库，首轮全量同步，之后按 MONITOR_MODE 增量同步，
+    webhook 事件也由这里导出。开启 SHARDING 时同时持有本副本的分片，在各轮之间保持心跳。
+    """
+
+    def __init__(self, settings: Settings, shared: SharedHttp):
+        self.settings = settings
+        self.shared = shared
+        self.name = settings.account or "default"
+        self.yuque: Yuque | None = None
+        self.store: StateStore | None = None
+        self.shard: ShardCoordinator | None = None
+        self.full_sync_done = False
+
+    async def ensure_client(self) -> bool:
+        if self.yuque is not None:
+            return True
+
+        yuque = Yuque(self.settings, self.shared)
+        await yuque.start()
+        if not yuque.is_initialized:
+            logger.error(
+                "[daemon] 客户端初始化失败 account=%s error=%s",
+                self.name,
+                yuque.init_error or "未知初始化错误",
+            )
+            await yuque.close()
+            return False
+
+        self.yuque = yuque
+        self.store = open_account_store(yuque)
+        self.shard = await start_account_shard(self.yuque)
+        return True
+
+    async def close(self) -> None:
+        if self.shard is not None:
+            await self.shard.close()
+            self.shard = None
+        if self.store is not None:
+            close_account_store(self.yuque, self.store)
+            self.store = None
+        if self.yuque is not None:
+            await self.yuque.close()
+            self.yuque = None
+
+    async def run_cycle(self) -> bool:
+        if not await self.ensure_client():
+            return False
+
+        if not self.full_sync_done:
+            logger.info("[daemon] 执行全量同步 account=%s", self.name)
+            engine = SyncEngine(
+                self.yuque,
+                self.store,
+                "download",
+                schedule=get_download_schedule(self.settings),
+                shard=self.shard,
+            )
+            stats = await engine.run()
+            self.full_sync_done = True
+            logger.info(
+                "[daemon] 全量同步完成 account=%s books=%s docs=%s success=%s "
+                "unchanged=%s skip=%s fail=%s",
+                self.name,
+                stats["books"],
+                stats["docs"],
+                stats["success"],
+                stats["unchanged"],
+                stats["skip"],
+                stats["fail"],
+            )
+            return True
+
+        logger.info(
+            "[monitor] 开始监控更新 account=%s at=%s",
+            self.name,
+            datetime.datetime.now().isoformat(),
+        )
+        stats = await run_monitor_cycle(self.yuque, self.store, self.shard)
+        log_monitor_stats(stats, self.name)
+        return True
+
+    async def on_webhook_doc(self, event: DocEvent) -> bool:
+        """
+        按 webhook 事件重新导出单个文档，失败的文档由下一次核对兜底
+
+        :return:  知识库正由其他副本同步时返回 False，稍后重试
+        """
+        yuque, store = self.yuque, self.store
+        book, doc = event.book, event.doc
+        if yuque is None or store is None:
+            logger.warning(
+                "[webhook] 客户端未就绪，留给下次核对 account=%s doc_id=%s",
+                self.name,
+                doc.id,
+            )
+            return True
+
+        if not book.name:
+            book_state = store.get_book_state(book.id)
+            book.name = book_state["name"] if book_state else None
+        if not book.name:
+            logger.warning(
+                "[webhook] 未知的知识库，留给下次核对 account=%s book_id=%s doc_id=%s",
+                self.name,
+                book.id,
+                doc.id,
+            )
+            return True
+
+        versions = store.get_doc_versions(book.id, doc.id)
+        if not doc.title:
+            # 事件里缺少标题时沿用上次保存的标题，保证文件路径不变
+            titles = [row["doc_title"] for row in versions.values() if row["doc_title"]]
+            doc.title = titles[0] if titles else doc.slug or str(doc.id)
+
+        context = format_doc_context(book, doc)
+        # 分片时任一副本收到事件都可以处理，但要先取得知识库的租约
+        if self.shard is not None and not await self.shard.acquire(book.id):
+            logger.info("[webhook] 知识库正由其他副本同步，稍后重试 %s", context)
+            return False
+
+        try:
+            if event.action == ACTION_DELETE:
+                await self._delete_webhook_doc(book, doc, versions)
+                return True
+            # 各格式是独立的导出任务，同时提交
+            await asyncio.gather(
+                *(
+                    self._export_webhook_doc(book, doc, export_format)
+                    for export_format in yuque.settings.export_formats
+                )
+            )
+            await store.commit()
+        finally:
+            if self.shard is not None:
+                await self.shard.release(book.id)
+        return True
+
+    async def _delete_webhook_doc(
+        self, book: YuqueBook, doc: YuqueDocs, versions: dict[str, dict]
+    ) -> None:
+        """删除已同步过的各格式文件及其状态记录，文件名按保存时的标题拼接。"""
+        yuque, store = self.yuque, self.store
+        context = format_doc_context(book, doc)
+        for export_format, version in versions.items():
+            saved = YuqueDocs(
+                {"id": doc.id, "title": version["doc_title"] or doc.title}
+            )
+            save_path = build_doc_save_path(
+                yuque.settings.save_path, book, saved, export_format
+            )
+            if not await yuque.docs_remove(book, doc, save_path, export_format):
+                logger.warning("[webhook] 知识库租约已丢失，不删除文件 %s", context)
+                return
+
+        store.delete_doc(book.id, doc.id)
+        await store.commit()
+        logger.info(
+            "[webhook] 文档已删除，已移除本地文件 %s formats=%s",
+            context,
+            ",".join(versions) or "-",
+        )
+
+    async def _export_webhook_doc(
+        self, book: YuqueBook, doc: YuqueDocs, export_format: str
+    ) -> None:
+        yuque, store = self.yuque, self.store
+        context = f"{format_doc_context(book, doc)} format={export_format}"
+        version = store.get_version(book.id, doc.id, export_format)
+        if version and doc.updated_at and not has_document_update(doc, version):
+            logger.info("[webhook] 文档已是最新，跳过 %s", context)
+            return
+
+        save_path = build_doc_save_path(
+            yuque.settings.save_path, book, doc, export_format
+        )
+        content_hash = await yuque.docs_export(
+            book,
+            doc,
+            save_path,
+            previous_hash=version.get("content_hash") if version else None,
+            export_format=export_format,
+        )
+        if content_hash is None:
+            SYNCED_DOCS.inc(result="failed")
+            logger.warning("[webhook] 同步失败，留给下次核对 %s", context)
+            return
+        if not yuque.can_write(book):
+            logger.warning("[webhook] 知识库租约已丢失，不记录状态 %s", context)
+            return
+
+        store.upsert_version(
+            book, doc, export_format, content_hash, file_size=get_file_size(save_path)
+        )
+        SYNCED_DOCS.inc(result="saved")
+        observe_freshness(doc.updated_at)
+        logger.info("[webhook] 同步成功 %s", context)
+
+
+class SyncDaemon:
+    """
+    常驻同步进程
+
+    每个账号一个 AccountSync，各账号的客户端（连接池、文档详情缓存、资源索引）与状态库
+    在各轮之间保持打开；每轮所有账号同时同步，共用连接池与全局并发名额。
+    首轮执行全量同步，之后按 MONITOR_MODE 增量同步；
+    两轮之间的等待时间加入随机抖动，多个实例不会在同一时刻请求语雀。
+    启用 webhook 后被编辑的文档由事件触发单独导出，轮询降为 WEBHOOK_RECONCILE_MINUTES 一次的核对。
+    重新加载配置后在下一轮开始前重建所有客户端；
+    收到 SIGTERM/SIGINT 时取消进行中的一轮，已完成文档的状态在关闭状态库时提交。
+    """
+
+    def __init__(self, interval_minutes: int | None = None):
+        """
+        :param interval_minutes: 同步间隔（分钟），为 None 时使用配置，重新加载配置后随之变化
+        """
+        self.interval_minutes = interval_minutes
+        self.settings: Settings | None = None
+        self.shared: SharedHttp | None = None
+        self.accounts: dict[str, AccountSync] = {}
+        self.webhook: WebhookReceiver | None = None
+        self._stopping = asyncio.Event()
+        self._cycle: asyncio.Task | None = None
+
+    def stop(self) -> None:
+        if self._stopping.is_set():
+            return
+        logger.info("[daemon] 收到停止信号，结束当前同步")
+        self._stopping.set()
+        if self._cycle is not None:
+            self._cycle.cancel()
+
+    def install_stop_handler(self) -> None:
+        loop = asyncio.get_running_loop()
+        for name in ("SIGTERM", "SIGINT"):
+            if not hasattr(signal, name):
+                continue
+            try:
+                loop.add_signal_handler(getattr(signal, name), self.stop)
+            except (NotImplementedError, RuntimeError):
+                pass
+
+    async def run(self) -> bool:
+        install_reload_handler()
+        self.install_stop_handler()
+        settings = get_settings()
+        metrics_runner = await start_metrics_server(
+            settings.metrics_host, settings.metrics_port
+        )
+        if settings.webhook.port:
+            webhook = WebhookReceiver(
+                self._on_webhook_doc,
+                settings.webhook.debounce_seconds,
+                settings.webhook.token,
+            )
+            if await webhook.start(settings.webhook.host, settings.webhook.port):
+                self.webhook = webhook
+
+        try:
+            while not self._stopping.is_set():
+                self._cycle = asyncio.create_task(self._run_cycle())
+                try:
+                    ok = await self._cycle
+                except asyncio.CancelledError:
+                    if not self._stopping.is_set():
+                        raise
+                    break
+                except Exception as exc:
+                    logger.exception("[daemon] 同步异常 error=%s", exc)
+                    ok = False
+                finally:
+                    self._cycle = None
+
+                await self._wait(self._next_delay(ok))
+            return True
+        finally:
+            if self.webhook is not None:
+                await self.webhook.close()
+                self.webhook = None
+            await self._close_clients()
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+            logger.info("[daemon] 已停止")
+
+    async def _run_cycle(self) -> bool:
+        await self._ensure_accounts()
+        accounts = list(self.accounts.values())
+        full_sync = not all(account.full_sync_done for account in accounts)
+        name = "download" if full_sync else "monitor"
+        with profiler.profile_run(name, self.settings.save_path):
+            results = await asyncio.gather(
+                *(self._run_account_cycle(account) for account in accounts)
+            )
+        return all(results)
+
+    async def _run_account_cycle(self, account: AccountSync) -> bool:
+        """单个账号的异常不影响同一轮中的其它账号。"""
+        try:
+            return await account.run_cycle()
+        except Exception as exc:
+            logger.exception("[daemon] 同步异常 account=%s error=%s", account.name, exc)
+            return False
+
+    async def _ensure_accounts(self) -> None:
+        """首次运行或配置重新加载后按账号列表创建同步状态，否则沿用。"""
+        settings = get_settings()
+        if settings is self.settings:
+            return
+
+        previous = self.accounts
+        if self.settings is not None:
+            logger.info("[daemon] 配置已更新，重建语雀客户端")
+            if self.webhook is not None:
+                await self.webhook.wait_idle()
+            await self._close_clients()
+
+        self.settings = settings
+        self.shared = SharedHttp(settings)
+        self.accounts = {}
+        for account_settings in settings.get_account_settings():
+            account = AccountSync(account_settings, self.shared)
+            # 已完成全量同步的账号不因重新加载配置再做一次
+            if account.name in previous:
+                account.full_sync_done = previous[account.name].full_sync_done
+            self.accounts[account.name] = account
+        logger.info(
+            "[daemon] 同步账号 accounts=%s global_max_concurrency=%s",
+            ",".join(self.accounts),
+            settings.limit.global_max_concurrency or "unlimited",
+        )
+
+    async def _close_clients(self) -> None:
+        for account in self.accounts.values():
+            await account.close()
+        if self.shared is not None:
+            await self.shared.close()
+            self.shared = None
+
+    def _next_delay(self, ok: bool) -> float:
+        if not ok:
+            logger.error("[daemon] 同步失败，等待%s秒后重试", DAEMON_RETRY_SECONDS)
+            return DAEMON_RETRY_SECONDS
+
+        settings = get_settings()
+        if self.interval_minutes:
+            interval = self.interval_minutes
+        elif self.webhook is not None:
+            interval = settings.webhook.reconcile_minutes
+        else:
+            interval = settings.monitor_interval_minutes
+        jitter = settings.monitor_jitter_percent / 100
+        delay = interval * 60 * (1 + random.uniform(-jitter, jitter))
+        logger.info(
+            "[monitor] 等待下次检查 interval_minutes=%s delay_seconds=%.0f",
+            interval,
+            delay,
+        )
+        return delay
+
+    async def _wait(self, seconds: float) -> None:
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+
+    async def _on_webhook_doc(self, event: DocEvent) -> bool:
+        """按 webhook 地址中的 account 参数交给对应账号，只有一个账号时可以省略。"""
+        account = self.accounts.get(event.account)
+        if account is None and not event.account and len(self.accounts) == 1:
+            account = next(iter(self.accounts.values()))
+        if account is None:
+            logger.warning(
+                "[webhook] 未知的账号，忽略事件 account=%s doc_id=%s",
+                event.account,
+                event.doc.id,
+            )
+            return True
+        return await account.on_webhook_doc(event)
+
+
+async def download_and_monitor(interval_minutes=None):
+    """
+    下载所有文档并持续监控更新
+
+    :param interval_minutes: 监控间隔（分钟），为 None 时使用配置，重新加载配置后随之变化
+    """
+    return await SyncDaemon(interval_minutes).run()
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextlib
+import datetime
+import email.utils
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 两次乘性减小之间的最短间隔，避免同一波失败把并发连续砍到底
+DECREASE_COOLDOWN_SECONDS = 2.0
+# Retry-After 最长遵守时间
+MAX_RETRY_AFTER_SECONDS = 300.0
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    解析 Retry-After 响应头
+
+    :param value: 秒数或 HTTP 日期
+    :return:      需要等待的秒数，无法解析时返回 None
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), MAX_RETRY_AFTER_SECONDS)
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    delay = (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds()
+    return min(max(delay, 0.0), MAX_RETRY_AFTER_SECONDS)
+
+
+class TokenBucket:
+    """
+    令牌桶限速器
+
+    rate <= 0 表示不限速。
+    """
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self._tokens = self.burst
+        self._updated_at: float | None = None
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self._updated_at is not None:
+                    elapsed = now - self._updated_at
+                    self._tokens = min(self.burst, self._tokens + elapsed * self.rate)
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class AimdLimiter:
+    """
+    加性增、乘性减（AIMD）并发控制器
+
+    每成功一个请求，上限增加 1/limit，即大约每一轮并发全部成功后上限加 1；
+    遇到限流或服务端错误时上限乘以 decrease，最低不小于 minimum。
+    """
+
+    def __init__(self, initial: int, minimum: int, maximum: int, decrease: float = 0.5):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.decrease = decrease
+        self.limit = float(min(max(initial, self.minimum), self.maximum))
+        self.active = 0
+        self._changed = asyncio.Condition()
+        self._last_decrease_at = float("-inf")
+
+    async def acquire(self) -> None:
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.active < int(self.limit))
+            self.active += 1
+
+    async def release(self) -> None:
+        async with self._changed:
+            self.active -= 1
+            self._changed.notify_all()
+
+    async def on_success(self) -> None:
+        if self.limit >= self.maximum:
+            return
+
+        previous = int(self.limit)
+        self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+        if int(self.limit) != previous:
+            logger.info(
+                "[limiter] 提高并发上限 limit=%s max=%s", int(self.limit), self.maximum
+            )
+            async with self._changed:
+                self._changed.notify_all()
+
+    def on_congestion(self, reason: str) -> None:
+        now = asyncio.get_running_loop().time()
+        if now - self._last_decrease_at < DECREASE_COOLDOWN_SECONDS:
+            return
+
+        self._last_decrease_at = now
+        previous = int(self.limit)
+        self.limit = max(float(self.minimum), self.limit * self.decrease)
+        logger.warning(
+            "[limiter] 降低并发上限 limit=%s->%s reason=%s",
+            previous,
+            int(self.limit),
+            reason,
+        )
+
+
+class RequestLimiter:
+    """
+    语雀请求限流器
+
+    同一账号的所有请求共用：令牌桶限制每秒请求数，AIMD 控制同时进行的请求数，
+    收到 429 时按 Retry-After 暂停全部新请求。
+    多个账号同时同步时，shared_slots 是所有账号共用的全局并发名额：
+    先占本账号的名额再排队等全局名额，单个账号最多占用自己的上限，不会饿死其它账号。
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        initial_concurrency: int,
+        min_concurrency: int,
+        max_concurrency: int,
+        shared_slots: asyncio.Semaphore | None = None,
+    ):
+        self.shared_slots = shared_slots
+        self.bucket = TokenBucket(rate, burst=max(rate, 1.0))
+        self.concurrency = AimdLimiter(
+            initial=initial_concurrency,
+            minimum=min_concurrency,
+            maximum=max_concurrency,
+        )
+        self._paused_until = 0.0
+        logger.info(
+            "[limiter] 限流配置 rate=%s/s concurrency=%s (min=%s max=%s)",
+            rate if rate > 0 else "unlimited",
+            int(self.concurrency.limit),
+            self.concurrency.minimum,
+            self.concurrency.maximum,
+        )
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        """占用一个请求名额，退出时归还。"""
+        await self._wait_pause()
+        await self.concurrency.acquire()
+        try:
+            if self.shared_slots is None:
+                await self.bucket.acquire()
+                yield
+            else:
+                async with self.shared_slots:
+                    await self.bucket.acquire()
+                    yield
+        finally:
+            await self.concurrency.release()
+
+    async def _wait_pause(self) -> None:
+        loop = asyncio.get_running_loop()
+        while (delay := self._paused_until - loop.time()) > 0:
+            await asyncio.sleep(delay)
+
+    async def feedback(self, status: int, retry_after: str | None = None) -> None:
+        """根据响应状态调整限流。"""
+        if status == 429 or status >= 500:
+            self.on_congestion(f"status={status}")
+            delay = parse_retry_after(retry_after)
+            if delay:
+                loop = asyncio.get_running_loop()
+                self._paused_until = max(self._paused_until, loop.time() + delay)
+                logger.warning(
+                    "[limiter] 服务端要求暂停请求 retry_after=%.1fs status=%s",
+                    delay,
+                    status,
+                )
+            return
+
+        if status < 400:
+            await self.concurrency.on_success()
+
+    def on_congestion(self, reason: str) -> None:
+        """请求异常或导出排队过慢时调用，乘性降低并发上限。"""
+        self.concurrency.on_congestion(reason)
+
+
+class ByteBudget:
+    """
+    全局在途字节预算
+
+    下载协程每次读取前先预留一块额度，写入磁盘后归还，
+    所有下载同时持有的内存不会超过 capacity。
+    单次预留大于 capacity 时，等到没有其它预留后独占执行。
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.in_use = 0
+        self._changed = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, size: int):
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: self.in_use == 0 or self.in_use + size <= self.capacity
+            )
+            self.in_use += size
+        try:
+            yield
+        finally:
+            async with self._changed:
+                self.in_use -= size
+                self._changed.notify_all()
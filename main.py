@@ -2,10 +2,13 @@
 import asyncio
 import logging
 import argparse
+import datetime
 import sys
 import os
-from yuque import download_all, download_and_monitor
-from config import get_config, save_config
+from engine import download_all, download_and_monitor
+from config import get_config, get_settings, save_config
+from profiler import ProfileOptions, enable_profiling
+from revisions import RevisionStore
 
 # 设置Windows环境下的UTF-8编码支持
 if sys.platform.startswith('win'):
@@ -23,18 +26,72 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+def add_profile_arguments(parser):
+    parser.add_argument(
+        '--profile', nargs='?', const='', metavar='DIR',
+        help='每轮同步写入一份阶段耗时报告（JSON），默认保存到 SAVE_PATH/.profiles'
+    )
+    parser.add_argument(
+        '--profile-cpu', action='store_true', help='报告中附带 cProfile 统计'
+    )
+    parser.add_argument(
+        '--profile-memory', action='store_true', help='报告中附带 tracemalloc 内存快照'
+    )
+
+def setup_profiling(args):
+    if args.profile is None and not (args.profile_cpu or args.profile_memory):
+        return
+    enable_profiling(ProfileOptions(
+        directory=args.profile or None,
+        cpu=args.profile_cpu,
+        memory=args.profile_memory,
+    ))
+
+def get_revision_settings(account):
+    """按 --account 找到账号配置，历史版本保存在该账号的 SAVE_PATH 下。"""
+    accounts = get_settings().get_account_settings()
+    if account is None:
+        if len(accounts) > 1:
+            names = ", ".join(item.account for item in accounts)
+            logger.error(f"配置了多个账号，请用 --account 指定: {names}")
+            return None
+        return accounts[0]
+
+    for item in accounts:
+        if item.account == account:
+            return item
+    logger.error(f"账号配置中没有账号 {account}")
+    return None
+
 def parse_args():
     parser = argparse.ArgumentParser(description='语雀文档下载与监控工具')
     subparsers = parser.add_subparsers(dest='command', help='可用命令')
     
     # 下载命令
     download_parser = subparsers.add_parser('download', help='下载所有文档')
+    add_profile_arguments(download_parser)
     
     # 监控命令
-    monitor_parser = subparsers.add_parser('monitor', help='监控文档更新')
+    monitor_parser = subparsers.add_parser(
+        'monitor', aliases=['daemon'], help='常驻运行，持续监控文档更新'
+    )
     monitor_parser.add_argument(
         '--interval', '-i', type=int, help='监控间隔时间（分钟）'
     )
+    add_profile_arguments(monitor_parser)
+    
+    # 历史版本命令
+    revisions_parser = subparsers.add_parser('revisions', help='查看或恢复文档历史版本')
+    revisions_parser.add_argument('doc_id', type=int, help='文档ID')
+    revisions_parser.add_argument(
+        '--restore', '-r', type=int, help='要恢复的版本ID'
+    )
+    revisions_parser.add_argument(
+        '--output', '-o', help='恢复内容的保存路径，默认保存到当前目录'
+    )
+    revisions_parser.add_argument(
+        '--account', '-a', help='账号名称，配置了多个账号（ACCOUNTS_FILE）时必填'
+    )
     
     # 设置配置命令
     config_parser = subparsers.add_parser('config', help='设置配置')
@@ -48,6 +105,9 @@ async def main():
     args = parse_args()
     
     # 根据命令执行对应操作
+    if args.command in ('download', 'monitor', 'daemon'):
+        setup_profiling(args)
+    
     if args.command == 'download':
         logger.info("开始下载所有文档...")
         success = await download_all()
@@ -57,16 +117,49 @@ async def main():
             logger.error("下载失败")
             return 1
     
-    elif args.command == 'monitor':
-        interval = args.interval if args.interval else get_config().get("monitor_interval_minutes", 60)
+    elif args.command in ('monitor', 'daemon'):
+        interval = args.interval or get_settings().monitor_interval_minutes
         logger.info(f"开始监控文档更新，间隔时间: {interval}分钟")
         if args.interval:
             logger.info(f"使用命令行指定的间隔时间: {args.interval}分钟")
-        success = await download_and_monitor(interval)
+        success = await download_and_monitor(args.interval)
         if success is False:
             logger.error("监控启动失败")
             return 1
     
+    elif args.command == 'revisions':
+        settings = get_revision_settings(args.account)
+        if settings is None:
+            return 1
+        with RevisionStore(
+            settings.save_path,
+            keep=settings.revision.keep,
+            max_age_days=settings.revision.max_age_days,
+        ) as store:
+            revisions = store.list_revisions(args.doc_id)
+            if args.restore is None:
+                if not revisions:
+                    logger.info(f"文档 {args.doc_id} 没有历史版本")
+                for item in revisions:
+                    created_at = datetime.datetime.fromtimestamp(item["created_at"])
+                    logger.info(
+                        f"  版本 {item['id']}: {created_at:%Y-%m-%d %H:%M:%S} "
+                        f"{item['format']} {item['size']} 字节 {item['path']}"
+                    )
+                return 0
+
+            revision = next((i for i in revisions if i["id"] == args.restore), None)
+            content = store.restore(args.restore) if revision else None
+            if content is None:
+                logger.error(f"文档 {args.doc_id} 没有版本 {args.restore}")
+                return 1
+
+            name, ext = os.path.splitext(os.path.basename(revision["path"]))
+            output = args.output or f"{name}.r{args.restore}{ext}"
+            with open(output, 'wb') as f:
+                f.write(content)
+            logger.info(f"已恢复版本 {args.restore} 到 {output}")
+    
     elif args.command == 'config':
         if args.interval:
             config = get_config()
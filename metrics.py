@@ -0,0 +1,251 @@
+# -*- coding: utf-8 -*-
+import bisect
+import datetime
+import logging
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+FRESHNESS_BUCKETS = (60, 300, 900, 1800, 3600, 7200, 21600, 86400, 604800)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34)
+
+
+def format_labels(labels: tuple[tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+
+    def escape(value: str) -> str:
+        return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{key}="{escape(value)}"' for key, value in labels) + "}"
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """指标基类，按标签组合保存数值。"""
+
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple[tuple[str, str], ...]:
+        return tuple((name, str(labels.get(name, ""))) for name in self.labelnames)
+
+    def render(self) -> list[str]:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        for key, value in sorted(self._values.items()):
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value) -> list[str]:
+        return [f"{self.name}{format_labels(key)} {format_value(value)}"]
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        state = self._values.get(key)
+        if state is None:
+            # [各区间计数..., +Inf 计数], 总和
+            state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect.bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def _render_sample(self, key, value) -> list[str]:
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            bucket_key = key + (("le", format_value(bound)),)
+            lines.append(f"{self.name}_bucket{format_labels(bucket_key)} {cumulative}")
+        lines.append(f"{self.name}_sum{format_labels(key)} {format_value(total)}")
+        lines.append(f"{self.name}_count{format_labels(key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+API_REQUESTS = REGISTRY.register(
+    Counter("yuque_api_requests_total", "语雀请求数", ("endpoint", "status"))
+)
+API_REQUEST_SECONDS = REGISTRY.register(
+    Histogram("yuque_api_request_seconds", "语雀请求耗时（到响应头）", ("endpoint",))
+)
+EXPORT_READY_SECONDS = REGISTRY.register(
+    Histogram("yuque_export_ready_seconds", "提交导出到拿到下载链接的时间")
+)
+EXPORT_POLLS = REGISTRY.register(
+    Counter("yuque_export_polls_total", "导出处理中时的状态查询次数")
+)
+EXPORT_POLLS_PER_DOC = REGISTRY.register(
+    Histogram(
+        "yuque_export_polls_per_export",
+        "单个导出就绪前的状态查询次数",
+        buckets=COUNT_BUCKETS,
+    )
+)
+DOWNLOAD_BYTES = REGISTRY.register(
+    Counter("yuque_download_bytes_total", "下载的导出文件字节数", ("format",))
+)
+DOWNLOAD_SECONDS = REGISTRY.register(
+    Histogram("yuque_download_seconds", "下载导出文件的耗时", ("format",))
+)
+SAVE_SECONDS = REGISTRY.register(
+    Histogram("yuque_save_seconds", "下载完成后保存文件的耗时", ("format",))
+)
+QUEUE_DEPTH = REGISTRY.register(
+    Gauge("yuque_queue_depth", "等待提交的导出任务数", ("account",))
+)
+INFLIGHT_EXPORTS = REGISTRY.register(
+    Gauge("yuque_inflight_exports", "已提交、尚未完成的导出任务数", ("account",))
+)
+ACTIVE_REQUESTS = REGISTRY.register(
+    Gauge("yuque_active_requests", "正在进行的语雀请求数", ("account",))
+)
+CONCURRENCY_LIMIT = REGISTRY.register(
+    Gauge("yuque_concurrency_limit", "当前自适应并发上限", ("account",))
+)
+SYNCED_DOCS = REGISTRY.register(
+    Counter("yuque_synced_docs_total", "同步结束的文档数", ("result",))
+)
+WEBHOOK_EVENTS = REGISTRY.register(
+    Counter("yuque_webhook_events_total", "收到的 webhook 事件数", ("action",))
+)
+FRESHNESS_LAG_SECONDS = REGISTRY.register(
+    Histogram(
+        "yuque_doc_freshness_lag_seconds",
+        "文档保存到本地的时间与语雀 updated_at 之差",
+        buckets=FRESHNESS_BUCKETS,
+    )
+)
+LAST_SUCCESS_TIMESTAMP = REGISTRY.register(
+    Gauge("yuque_last_success_timestamp_seconds", "最近一次文档同步成功的时间")
+)
+
+
+def parse_timestamp(value: str | None) -> datetime.datetime | None:
+    """解析语雀返回的时间，没有时区时按 UTC 处理。"""
+    if not value:
+        return None
+    try:
+        parsed = datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def observe_freshness(updated_at: str | None) -> float | None:
+    """
+    记录文档保存到本地时的新鲜度
+
+    :return:  与 updated_at 之差（秒），无法解析时为 None
+    """
+    now = datetime.datetime.now(datetime.timezone.utc)
+    LAST_SUCCESS_TIMESTAMP.set(now.timestamp())
+    updated = parse_timestamp(updated_at)
+    if updated is None:
+        return None
+
+    lag = max(0.0, (now - updated).total_seconds())
+    FRESHNESS_LAG_SECONDS.observe(lag)
+    return lag
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    """取第 q 分位（0~1）的值，使用最近秩，没有数据时返回 None。"""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q * (len(values) - 1))))]
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(
+        body=REGISTRY.render().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner | None:
+    """
+    启动 /metrics 端点
+
+    :return:  AppRunner，结束时调用 cleanup()；port 为 0 时不启动
+    """
+    if not port:
+        return None
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as exc:
+        logger.error(
+            "[metrics] 指标端点启动失败 host=%s port=%s error=%s", host, port, exc
+        )
+        await runner.cleanup()
+        return None
+
+    logger.info("[metrics] 指标端点已启动 url=http://%s:%s/metrics", host, port)
+    return runner
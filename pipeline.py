@@ -0,0 +1,337 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextlib
+import heapq
+import itertools
+import logging
+from dataclasses import dataclass
+
+from metrics import (
+    EXPORT_POLLS,
+    EXPORT_POLLS_PER_DOC,
+    EXPORT_READY_SECONDS,
+    INFLIGHT_EXPORTS,
+)
+from model import YuqueBook, YuqueDocs
+import profiler
+from yuque import (
+    DOWNLOAD_NOT_READY,
+    DOWNLOAD_SAVED,
+    DOWNLOAD_UNCHANGED,
+    EXPORT_FAILED,
+    EXPORT_PENDING,
+    EXPORT_PENDING_TIMEOUT_SECONDS,
+    EXPORT_READY,
+    Yuque,
+    format_doc_context,
+    next_pending_wait,
+)
+
+logger = logging.getLogger(__name__)
+
+EXPORT_RETRY_TIMES = 5
+# 导出排队超过该时间视为服务端拥塞，通知限流器降低并发
+EXPORT_SLOW_PENDING_SECONDS = 60
+
+
+@dataclass
+class ExportTask:
+    """单个文档的导出任务"""
+
+    book: YuqueBook
+    doc: YuqueDocs
+    save_path: str
+    export_format: str
+    previous_hash: str | None = None  # 上次导出内容的 sha256
+    content_hash: str | None = None  # 本次导出内容的 sha256，下载完成后填写
+    unchanged: bool = False  # 导出内容与上次一致，未改写文件
+    previous_seconds: float | None = None  # 上次导出的总耗时（提交到就绪 + 下载）
+    previous_words: int | None = (
+        None  # 列表中没有字数时，由上次记录的字数或文件大小估算
+    )
+    pending_seconds: float | None = None  # 本次提交到就绪的时间
+    download_seconds: float | None = None  # 本次下载并保存的时间
+
+
+@dataclass
+class ExportJob:
+    """流水线中一个导出任务的运行状态"""
+
+    task: ExportTask
+    submitted_at: float
+    pending_since: float = 0.0  # 等待超时的起点，每次重试重新计时
+    attempts: int = 0
+    polls: int = 0  # 导出处理中时的查询次数
+    wait: float | None = None
+    download_url: str | None = None
+    slow_reported: bool = False
+
+
+class ExportPipeline:
+    """
+    三段式导出流水线
+
+    submit:   提交协程从任务来源取任务，立即向语雀提交导出请求，
+              最多同时保留 max_inflight 个未完成的任务，让服务端并行排队处理；
+    poll:     轮询协程按到期时间取出处理中的任务，每个查询是独立的协程，
+              慢查询不影响其它任务；等待间隔由 next_pending_wait 从短到长自适应增长；
+    download: 下载协程只处理已就绪的链接，不会被等待中的导出占用。
+
+    同一文档的多种格式是各自独立的任务，在服务端并行排队。
+    任务完成（成功或放弃）时调用 on_done(task, success)。
+    """
+
+    def __init__(
+        self,
+        yuque: Yuque,
+        source,
+        on_done,
+        workers: int,
+        max_inflight: int,
+        retry: int = EXPORT_RETRY_TIMES,
+    ):
+        """
+        :param source:        任务来源，get() 返回 ExportTask，取完后返回 None
+        :param on_done:       任务完成回调 async on_done(task, success)
+        :param workers:       提交、轮询、下载各阶段的协程数，实际并发由 yuque.limiter 控制
+        :param max_inflight:  同时处于提交/等待/下载中的任务上限
+        :param retry:         非等待类失败的最大重试次数
+        """
+        self.yuque = yuque
+        self.source = source
+        self.on_done = on_done
+        self.workers = workers
+        self.retry = retry
+        self._slots = asyncio.Semaphore(max(max_inflight, workers))
+        self._poll_slots = asyncio.Semaphore(workers)
+        self._pending: list[tuple[float, int, ExportJob]] = []
+        self._pending_changed = asyncio.Event()
+        self._sequence = itertools.count()
+        self._polls: set[asyncio.Task] = set()
+        self._downloads: asyncio.Queue[ExportJob] = asyncio.Queue()
+        self._inflight = 0
+        self._idle = asyncio.Condition()
+
+    async def run(self) -> None:
+        """运行流水线，直到任务来源取完且所有任务完成。"""
+        submitters = [
+            asyncio.create_task(self._submit_worker()) for _ in range(self.workers)
+        ]
+        background = [asyncio.create_task(self._poll_loop())] + [
+            asyncio.create_task(self._download_worker()) for _ in range(self.workers)
+        ]
+        try:
+            await asyncio.gather(*submitters)
+            async with self._idle:
+                await self._idle.wait_for(lambda: self._inflight == 0)
+        finally:
+            workers = submitters + background + list(self._polls)
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+
+    async def _submit_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            task = await self.source.get()
+            if task is None:
+                self._slots.release()
+                return
+
+            self._inflight += 1
+            INFLIGHT_EXPORTS.set(self._inflight, account=self.yuque.account)
+            job = ExportJob(
+                task=task, submitted_at=loop.time(), pending_since=loop.time()
+            )
+            if not self.yuque.can_write(task.book):
+                # 分片时知识库已被其他副本接手，排队中的任务不再提交
+                logger.warning(
+                    "[pipeline] 知识库租约已丢失，跳过导出 %s",
+                    format_doc_context(task.book, task.doc),
+                )
+                await self._finish(job, False)
+                continue
+
+            logger.info(
+                "[pipeline] 提交导出 %s format=%s",
+                format_doc_context(task.book, task.doc),
+                task.export_format,
+            )
+            if task.export_format == "markdown":
+                self.yuque.prefetch_doc_detail(task.book, task.doc)
+            await self._submit(job)
+
+    async def _submit(self, job: ExportJob) -> None:
+        task = job.task
+        try:
+            # 首次为提交，之后为轮询查询状态
+            phase = "submit" if not (job.polls or job.attempts) else "poll"
+            with profiler.phase(phase, task.book, task.doc):
+                state, download_url = await self.yuque.submit_export(
+                    task.book, task.doc, task.export_format
+                )
+        except Exception as exc:
+            logger.warning(
+                "[pipeline] 提交导出异常 %s error=%s",
+                format_doc_context(task.book, task.doc),
+                exc,
+            )
+            await self._retry(job)
+            return
+
+        if state == EXPORT_READY:
+            job.download_url = download_url
+            ready_seconds = asyncio.get_running_loop().time() - job.submitted_at
+            task.pending_seconds = ready_seconds
+            EXPORT_READY_SECONDS.observe(ready_seconds)
+            profiler.record("pending", ready_seconds, task.book, task.doc)
+            EXPORT_POLLS_PER_DOC.observe(job.polls)
+            self._downloads.put_nowait(job)
+        elif state == EXPORT_PENDING:
+            job.polls += 1
+            EXPORT_POLLS.inc()
+            self._check_slow_pending(job)
+            await self._schedule_poll(job)
+        elif state == EXPORT_FAILED:
+            await self._finish(job, False)
+        else:
+            await self._retry(job)
+
+    def _check_slow_pending(self, job: ExportJob) -> None:
+        if job.slow_reported:
+            return
+
+        pending_seconds = asyncio.get_running_loop().time() - job.pending_since
+        if pending_seconds > EXPORT_SLOW_PENDING_SECONDS:
+            job.slow_reported = True
+            self.yuque.limiter.on_congestion("slow_pending")
+
+    async def _schedule_poll(self, job: ExportJob) -> None:
+        """把任务放回等待队列，按自适应间隔再次查询。"""
+        loop = asyncio.get_running_loop()
+        if loop.time() - job.pending_since > EXPORT_PENDING_TIMEOUT_SECONDS:
+            logger.error(
+                "[pipeline] 等待导出超时 %s",
+                format_doc_context(job.task.book, job.task.doc),
+            )
+            await self._finish(job, False)
+            return
+
+        job.wait = next_pending_wait(job.wait)
+        heapq.heappush(
+            self._pending, (loop.time() + job.wait, next(self._sequence), job)
+        )
+        self._pending_changed.set()
+
+    async def _retry(self, job: ExportJob) -> None:
+        context = format_doc_context(job.task.book, job.task.doc)
+        if not self.yuque.can_write(job.task.book):
+            logger.warning("[pipeline] 知识库租约已丢失，不再重试 %s", context)
+            await self._finish(job, False)
+            return
+
+        job.attempts += 1
+        if job.attempts >= self.retry:
+            logger.error(
+                "[pipeline] 导出失败，达到最大重试次数 %s retries=%s",
+                context,
+                self.retry,
+            )
+            await self._finish(job, False)
+            return
+
+        logger.warning(
+            "[pipeline] 导出失败，将重试 %s attempt=%s/%s",
+            context,
+            job.attempts,
+            self.retry,
+        )
+        # 重试会重新提交导出，等待超时从这里重新计算
+        job.pending_since = asyncio.get_running_loop().time()
+        await self._schedule_poll(job)
+
+    async def _poll_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            if not self._pending:
+                self._pending_changed.clear()
+                await self._pending_changed.wait()
+                continue
+
+            delay = self._pending[0][0] - loop.time()
+            if delay > 0:
+                self._pending_changed.clear()
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._pending_changed.wait(), delay)
+                continue
+
+            now = loop.time()
+            due = 0
+            while self._pending and self._pending[0][0] <= now:
+                job = heapq.heappop(self._pending)[2]
+                poll = asyncio.create_task(self._poll(job))
+                self._polls.add(poll)
+                poll.add_done_callback(self._polls.discard)
+                due += 1
+
+            logger.info(
+                "[pipeline] 查询导出状态 jobs=%s polling=%s waiting=%s",
+                due,
+                len(self._polls),
+                len(self._pending),
+            )
+
+    async def _poll(self, job: ExportJob) -> None:
+        async with self._poll_slots:
+            await self._submit(job)
+
+    async def _download_worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self._downloads.get()
+            task = job.task
+            started = loop.time()
+            try:
+                result, content_hash = await self.yuque.download_export(
+                    task.book,
+                    task.doc,
+                    job.download_url,
+                    task.save_path,
+                    task.export_format,
+                    task.previous_hash,
+                )
+            except Exception as exc:
+                logger.warning(
+                    "[pipeline] 下载异常 %s error=%s",
+                    format_doc_context(task.book, task.doc),
+                    exc,
+                )
+                await self._retry(job)
+                continue
+
+            if result in (DOWNLOAD_SAVED, DOWNLOAD_UNCHANGED):
+                task.content_hash = content_hash
+                task.unchanged = result == DOWNLOAD_UNCHANGED
+                task.download_seconds = loop.time() - started
+                await self._finish(job, True)
+            elif result == DOWNLOAD_NOT_READY:
+                await self._schedule_poll(job)
+            else:
+                await self._retry(job)
+
+    async def _finish(self, job: ExportJob, success: bool) -> None:
+        try:
+            await self.on_done(job.task, success)
+        except Exception as exc:
+            logger.exception(
+                "[pipeline] 处理导出结果异常 %s error=%s",
+                format_doc_context(job.task.book, job.task.doc),
+                exc,
+            )
+        finally:
+            self._inflight -= 1
+            INFLIGHT_EXPORTS.set(self._inflight, account=self.yuque.account)
+            self._slots.release()
+            async with self._idle:
+                self._idle.notify_all()
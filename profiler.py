@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import contextlib
+import cProfile
+import datetime
+import io
+import json
+import logging
+import os
+import pstats
+import time
+import tracemalloc
+from dataclasses import dataclass
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR_NAME = ".profiles"
+SLOWEST_BOOKS = 10
+SLOWEST_DOCS = 20
+CPU_TOP_FUNCTIONS = 30
+MEMORY_TOP_LINES = 20
+# 提交与轮询请求发生在 pending（提交到就绪）期间，汇总时不重复计入
+NESTED_PHASES = {"submit", "poll"}
+
+
+@dataclass(frozen=True)
+class ProfileOptions:
+    directory: str | None  # 报告目录，为 None 时使用 SAVE_PATH/.profiles
+    cpu: bool = False
+    memory: bool = False
+
+
+class RunProfiler:
+    """
+    单轮同步的阶段耗时统计
+
+    各阶段由并发的协程记录，同一阶段的总耗时是所有协程耗时之和，
+    可能大于整轮的墙钟时间；按知识库、文档汇总后用于找出最慢的对象。
+    """
+
+    def __init__(self, name: str, options: ProfileOptions):
+        self.name = name
+        self.options = options
+        self.started_at = datetime.datetime.now()
+        self._started = time.perf_counter()
+        self.phases: dict[str, list] = {}  # 阶段 -> [次数, 总耗时, 最大耗时]
+        self.books: dict[int, dict] = {}
+        self.docs: dict[int, dict] = {}
+        self._cpu: cProfile.Profile | None = None
+
+    def start(self) -> None:
+        if self.options.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.options.cpu:
+            self._cpu = cProfile.Profile()
+            self._cpu.enable()
+
+    def record(self, name: str, seconds: float, book=None, doc=None) -> None:
+        stat = self.phases.setdefault(name, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += seconds
+        stat[2] = max(stat[2], seconds)
+
+        if book is not None:
+            entry = self.books.setdefault(
+                book.id, {"id": book.id, "name": book.name, "phases": {}}
+            )
+            entry["phases"][name] = entry["phases"].get(name, 0.0) + seconds
+        if doc is not None:
+            entry = self.docs.setdefault(
+                doc.id,
+                {
+                    "id": doc.id,
+                    "title": doc.title,
+                    "book": book.name if book is not None else None,
+                    "phases": {},
+                },
+            )
+            entry["phases"][name] = entry["phases"].get(name, 0.0) + seconds
+
+    def finish(self, directory: str) -> str:
+        """停止采样并写入 JSON 报告，返回报告路径。"""
+        wall_seconds = time.perf_counter() - self._started
+        stamp = self.started_at.strftime("%Y%m%d-%H%M%S")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.name}-{stamp}.json")
+
+        report = {
+            "name": self.name,
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": round(wall_seconds, 3),
+            "phases": {
+                name: {
+                    "count": count,
+                    "total_seconds": round(total, 3),
+                    "mean_seconds": round(total / count, 3),
+                    "max_seconds": round(maximum, 3),
+                }
+                for name, (count, total, maximum) in self.phases.items()
+            },
+            "slowest_books": slowest(self.books.values(), SLOWEST_BOOKS),
+            "slowest_docs": slowest(self.docs.values(), SLOWEST_DOCS),
+        }
+        if self._cpu is not None:
+            self._cpu.disable()
+            report["cpu"] = self._cpu_report(path[: -len(".json")] + ".prof")
+        if self.options.memory and tracemalloc.is_tracing():
+            report["memory"] = memory_report()
+            tracemalloc.stop()
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return path
+
+    def _cpu_report(self, stats_path: str) -> dict:
+        self._cpu.dump_stats(stats_path)
+        stats = pstats.Stats(self._cpu, stream=io.StringIO())
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)
+        rows = rows[:CPU_TOP_FUNCTIONS]
+        return {
+            "stats_file": stats_path,
+            "top": [
+                {
+                    "function": f"{filename}:{line}({func})",
+                    "calls": calls,
+                    "total_seconds": round(total, 4),
+                    "cumulative_seconds": round(cumulative, 4),
+                }
+                for (filename, line, func), (_, calls, total, cumulative, _) in rows
+            ],
+        }
+
+
+def total_seconds(phases: dict[str, float]) -> float:
+    return sum(value for name, value in phases.items() if name not in NESTED_PHASES)
+
+
+def slowest(entries, limit: int) -> list[dict]:
+    rows = []
+    for entry in entries:
+        phases = {name: round(value, 3) for name, value in entry["phases"].items()}
+        total = total_seconds(phases)
+        rows.append({**entry, "total_seconds": round(total, 3), "phases": phases})
+    rows.sort(key=lambda row: row["total_seconds"], reverse=True)
+    return rows[:limit]
+
+
+def memory_report() -> dict:
+    current, peak = tracemalloc.get_traced_memory()
+    snapshot = tracemalloc.take_snapshot().filter_traces(
+        (tracemalloc.Filter(False, tracemalloc.__file__),)
+    )
+    return {
+        "current_bytes": current,
+        "peak_bytes": peak,
+        "top": [
+            {
+                "location": str(stat.traceback),
+                "size_bytes": stat.size,
+                "count": stat.count,
+            }
+            for stat in snapshot.statistics("lineno")[:MEMORY_TOP_LINES]
+        ],
+    }
+
+
+_options: ProfileOptions | None = None
+_current: RunProfiler | None = None
+
+
+def enable_profiling(options: ProfileOptions) -> None:
+    """开启后每轮同步（download_all / monitor_updates）各写一份报告。"""
+    global _options
+    _options = options
+
+
+@contextlib.contextmanager
+def profile_run(name: str, save_path: str):
+    """
+    统计一轮同步，未开启时什么也不做
+
+    嵌套调用时由最外层统计，内层不单独写报告。
+
+    :return:  本轮的 RunProfiler，未开启或嵌套时为 None
+    """
+    global _current
+    if _options is None or _current is not None:
+        yield None
+        return
+
+    profiler = RunProfiler(name, _options)
+    profiler.start()
+    _current = profiler
+    try:
+        yield profiler
+    finally:
+        _current = None
+        directory = _options.directory or os.path.join(save_path, PROFILE_DIR_NAME)
+        try:
+            path = profiler.finish(directory)
+        except OSError as exc:
+            logger.error("[profile] 写入性能报告失败 dir=%s error=%s", directory, exc)
+        else:
+            logger.info("[profile] 性能报告已保存 path=%s", path)
+
+
+def record(name: str, seconds: float, book=None, doc=None) -> None:
+    """记录一段已测得的耗时，用于跨越多个回调的阶段。"""
+    if _current is not None:
+        _current.record(name, seconds, book, doc)
+
+
+@contextlib.contextmanager
+def phase(name: str, book=None, doc=None):
+    """统计代码块的耗时，未开启时什么也不做。"""
+    if _current is None:
+        yield
+        return
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - started, book, doc)
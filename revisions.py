@@ -0,0 +1,476 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import concurrent.futures
+import difflib
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+REVISION_DIR_NAME = ".revisions"
+# 连续增量的最大长度，超过后保存一次完整快照，限制恢复时需要回放的增量数
+SNAPSHOT_EVERY = 10
+# 只有文本格式按行做增量
+TEXT_FORMATS = {"markdown"}
+COPY_CHUNK_SIZE = 1024 * 1024
+# 历史版本很少读取，压缩级别取默认的 3，压缩器占用的内存只有几 MB
+ZSTD_LEVEL = 3
+# 去掉首尾相同的行后，变化部分超过这么多行时不做增量，直接保存完整快照
+DELTA_MAX_LINES = 20000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS revisions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    book_id INTEGER,
+    doc_id INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    path TEXT,
+    content_hash TEXT NOT NULL,
+    object_hash TEXT NOT NULL,
+    codec TEXT NOT NULL,
+    base_id INTEGER,
+    depth INTEGER NOT NULL DEFAULT 0,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_revisions_doc ON revisions (doc_id, format, id);
+CREATE INDEX IF NOT EXISTS idx_revisions_object ON revisions (object_hash);
+"""
+
+
+_local = threading.local()
+
+
+def get_codec() -> str:
+    """有 zstandard 时使用 zstd，否则退回标准库 gzip。"""
+    return "zstd" if zstandard is not None else "gzip"
+
+
+def get_compressor():
+    """每个线程复用一个 zstd 压缩器，压缩器不能在线程之间共用。"""
+    compressor = getattr(_local, "compressor", None)
+    if compressor is None:
+        compressor = _local.compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL)
+    return compressor
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return get_compressor().compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def open_compressed_writer(file_handle, codec: str):
+    if codec == "zstd":
+        return get_compressor().stream_writer(file_handle)
+    return gzip.GzipFile(fileobj=file_handle, mode="wb", compresslevel=6)
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("历史版本使用 zstd 压缩，请先安装 zstandard")
+        # 分块写入的帧头里没有内容长度，需要用流式接口解压
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return gzip.decompress(data)
+
+
+def split_lines(data: bytes) -> list[bytes]:
+    """按换行符切分并保留行尾，与逐行读取文件的结果一致。"""
+    return io.BytesIO(data).readlines()
+
+
+def scan_lines(path: str) -> tuple[str, int, list[int]]:
+    """
+    逐行读取文件，不把整个文件读入内存
+
+    :return:  (内容 sha256, 大小, 每行的哈希)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    keys = []
+    with open(path, "rb") as f:
+        for line in f:
+            digest.update(line)
+            size += len(line)
+            keys.append(hash(line))
+    return digest.hexdigest(), size, keys
+
+
+def make_delta(base: list, target: list) -> list | None:
+    """
+    比较两个版本的行（或行哈希），生成按行的增量
+
+    先去掉首尾相同的行，只比较中间变化的部分；比较时开启 autojunk，
+    空行等大量重复的行不参与匹配，避免 SequenceMatcher 退化为平方级耗时。
+    归档在线程中执行但纯 Python 计算会持有 GIL，耗时必须有上限。
+
+    :return: 按新版本顺序的操作列表，("copy", i1, i2) 表示复制基准版本的第 i1 到 i2 行，
+             ("insert", n) 表示接下来的 n 行是新版本的内容；
+             变化部分超过 DELTA_MAX_LINES 行时返回 None，由调用方保存完整快照
+    """
+    limit = min(len(base), len(target))
+    prefix = 0
+    while prefix < limit and base[prefix] == target[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and base[-1 - suffix] == target[-1 - suffix]:
+        suffix += 1
+
+    base_middle = base[prefix : len(base) - suffix]
+    target_middle = target[prefix : len(target) - suffix]
+    if max(len(base_middle), len(target_middle)) > DELTA_MAX_LINES:
+        return None
+
+    ops = [("copy", 0, prefix)] if prefix else []
+    matcher = difflib.SequenceMatcher(None, base_middle, target_middle)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            ops.append(("copy", prefix + i1, prefix + i2))
+        elif j2 > j1:
+            ops.append(("insert", j2 - j1))
+    if suffix:
+        ops.append(("copy", len(base) - suffix, len(base)))
+    return ops
+
+
+def encode_delta(ops: list, base: list[bytes], path: str) -> bytes:
+    """
+    逐行读取新版本，把操作列表编码为保存的增量
+
+    [i1, i2] 表示复制基准版本的行，字符串列表表示插入这些行；
+    复制的行逐行与基准版本核对，行哈希碰撞时抛出 ValueError，由调用方保存完整快照。
+    """
+    encoded = []
+    with open(path, "rb") as f:
+        for op in ops:
+            if op[0] == "copy":
+                _, i1, i2 = op
+                for i in range(i1, i2):
+                    if f.readline() != base[i]:
+                        raise ValueError("行哈希冲突")
+                encoded.append([i1, i2])
+            else:
+                encoded.append([f.readline().decode("utf-8") for _ in range(op[1])])
+    return json.dumps(encoded, ensure_ascii=False).encode("utf-8")
+
+
+def apply_delta(base: list[bytes], ops: list) -> list[bytes]:
+    lines = []
+    for op in ops:
+        if len(op) == 2 and all(isinstance(i, int) for i in op):
+            lines.extend(base[op[0] : op[1]])
+        else:
+            lines.extend(line.encode("utf-8") for line in op)
+    return lines
+
+
+class RevisionStore:
+    """
+    文档历史版本存储
+
+    文件被新导出覆盖前，旧内容作为一个历史版本保存到 SAVE_PATH/.revisions：
+    objects/ 下按内容 sha256 寻址保存压缩后的数据，相同内容只存一份；
+    markdown 保存为相对上一版本的按行增量，每 SNAPSHOT_EVERY 个版本保存一次完整快照；
+    index.db 记录每个文档的版本链，按 (doc_id, format) 索引查找。
+
+    保留策略：每个文档最多保留 keep 个版本，max_age_days 大于 0 时删除更早的版本；
+    keep 为 0 时不保存历史版本。
+    """
+
+    def __init__(self, base_path: str, keep: int, max_age_days: float):
+        self.root = os.path.join(os.path.abspath(base_path), REVISION_DIR_NAME)
+        self.keep = keep
+        self.max_age_days = max_age_days
+        self.codec = get_codec()
+        self._conn: sqlite3.Connection | None = None
+        # 归档在线程中执行，同一个连接的访问需要串行
+        self._lock = threading.Lock()
+        # 同步时的归档都在这一个线程中依次执行，同时只有一个压缩器和一份文件内容在内存中
+        self._executor: concurrent.futures.ThreadPoolExecutor | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.keep > 0
+
+    def open(self) -> "RevisionStore":
+        if self._conn is not None:
+            return self
+        os.makedirs(os.path.join(self.root, "objects"), exist_ok=True)
+        self._conn = sqlite3.connect(
+            os.path.join(self.root, "index.db"), timeout=30, check_same_thread=False
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        return self
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self) -> "RevisionStore":
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    # 对象读写
+
+    def _object_path(self, object_hash: str, codec: str) -> str:
+        suffix = ".zst" if codec == "zstd" else ".gz"
+        return os.path.join(self.root, "objects", object_hash[:2], object_hash + suffix)
+
+    def _put_object(self, payload: bytes) -> tuple[str, str]:
+        """保存对象，返回 (对象哈希, 压缩方式)；相同内容已存在时直接复用。"""
+        object_hash = hashlib.sha256(payload).hexdigest()
+        row = self._conn.execute(
+            "SELECT codec FROM revisions WHERE object_hash = ? LIMIT 1", (object_hash,)
+        ).fetchone()
+        if row and os.path.exists(self._object_path(object_hash, row["codec"])):
+            return object_hash, row["codec"]
+
+        path = self._object_path(object_hash, self.codec)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp_path = f"{path}.{uuid.uuid4().hex[:8]}.temp"
+            with open(temp_path, "wb") as f:
+                f.write(compress(payload, self.codec))
+            os.replace(temp_path, path)
+        return object_hash, self.codec
+
+    def _put_file(self, path: str) -> tuple[str, str, int]:
+        """
+        分块压缩保存整个文件，内存占用与文件大小无关
+
+        :return:  (对象哈希, 压缩方式, 原始大小)
+        """
+        digest = hashlib.sha256()
+        size = 0
+        temp_path = os.path.join(self.root, "objects", f"{uuid.uuid4().hex}.temp")
+        try:
+            with open(path, "rb") as source, open(temp_path, "wb") as target:
+                with open_compressed_writer(target, self.codec) as writer:
+                    while chunk := source.read(COPY_CHUNK_SIZE):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        writer.write(chunk)
+
+            object_hash = digest.hexdigest()
+            object_path = self._object_path(object_hash, self.codec)
+            if os.path.exists(object_path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.replace(temp_path, object_path)
+            return object_hash, self.codec, size
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+    def _get_object(self, object_hash: str, codec: str) -> bytes:
+        with open(self._object_path(object_hash, codec), "rb") as f:
+            return decompress(f.read(), codec)
+
+    def _delete_unused_object(self, object_hash: str, codec: str) -> None:
+        row = self._conn.execute(
+            "SELECT 1 FROM revisions WHERE object_hash = ? LIMIT 1", (object_hash,)
+        ).fetchone()
+        if row is None:
+            try:
+                os.remove(self._object_path(object_hash, codec))
+            except FileNotFoundError:
+                pass
+
+    # 版本读写
+
+    def _latest(self, doc_id: int, fmt: str) -> sqlite3.Row | None:
+        return self._conn.execute(
+            "SELECT * FROM revisions WHERE doc_id = ? AND format = ? "
+            "ORDER BY id DESC LIMIT 1",
+            (doc_id, fmt),
+        ).fetchone()
+
+    def _load(self, revision: sqlite3.Row) -> bytes:
+        """按增量链回放出某个版本的完整内容，链长不超过 SNAPSHOT_EVERY。"""
+        chain = [revision]
+        while chain[-1]["base_id"] is not None:
+            chain.append(
+                self._conn.execute(
+                    "SELECT * FROM revisions WHERE id = ?", (chain[-1]["base_id"],)
+                ).fetchone()
+            )
+
+        content = self._get_object(chain[-1]["object_hash"], chain[-1]["codec"])
+        if len(chain) == 1:
+            return content
+
+        lines = split_lines(content)
+        for item in reversed(chain[:-1]):
+            ops = json.loads(self._get_object(item["object_hash"], item["codec"]))
+            lines = apply_delta(lines, ops)
+        return b"".join(lines)
+
+    async def archive_async(
+        self,
+        book_id: int,
+        doc_id: int,
+        path: str,
+        export_format: str,
+        context: str = "",
+    ) -> int | None:
+        """在归档线程中执行 archive，多个文档的归档依次进行。"""
+        if self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="revision"
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, self.archive, book_id, doc_id, path, export_format, context
+        )
+
+    def archive(
+        self,
+        book_id: int,
+        doc_id: int,
+        path: str,
+        export_format: str,
+        context: str = "",
+    ) -> int | None:
+        """
+        把即将被覆盖的文件保存为一个历史版本
+
+        :param export_format:  导出格式，markdown 保存为增量
+        :return:  新版本ID，内容与最近一个版本相同或未启用时返回 None
+        """
+        if not self.enabled or not os.path.exists(path):
+            return None
+
+        fmt = export_format
+        with self._lock, self._conn:
+            latest = self._latest(doc_id, fmt)
+            base_id = None
+            depth = 0
+
+            if fmt in TEXT_FORMATS:
+                content_hash, size, keys = scan_lines(path)
+                if latest is not None and latest["content_hash"] == content_hash:
+                    return None
+
+                delta = None
+                if latest is not None and latest["depth"] + 1 < SNAPSHOT_EVERY:
+                    try:
+                        base_lines = split_lines(self._load(latest))
+                        ops = make_delta([hash(line) for line in base_lines], keys)
+                        if ops is not None:
+                            delta = encode_delta(ops, base_lines, path)
+                    except (UnicodeDecodeError, OSError, ValueError) as exc:
+                        logger.warning(
+                            "[revision] 生成增量失败，保存完整版本 %s error=%s",
+                            context,
+                            exc,
+                        )
+                if delta is not None and len(delta) < size:
+                    object_hash, codec = self._put_object(delta)
+                    base_id = latest["id"]
+                    depth = latest["depth"] + 1
+                else:
+                    object_hash, codec, _ = self._put_file(path)
+            else:
+                # 二进制文件按完整内容寻址，对象哈希即内容哈希
+                object_hash, codec, size = self._put_file(path)
+                content_hash = object_hash
+                if latest is not None and latest["content_hash"] == content_hash:
+                    return None
+
+            cursor = self._conn.execute(
+                "INSERT INTO revisions (book_id, doc_id, format, path, content_hash, "
+                "object_hash, codec, base_id, depth, size, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    book_id,
+                    doc_id,
+                    fmt,
+                    path,
+                    content_hash,
+                    object_hash,
+                    codec,
+                    base_id,
+                    depth,
+                    size,
+                    time.time(),
+                ),
+            )
+            self._prune(doc_id, fmt)
+
+        logger.info(
+            "[revision] 已保存历史版本 %s revision=%s delta=%s",
+            context,
+            cursor.lastrowid,
+            base_id is not None,
+        )
+        return cursor.lastrowid
+
+    def _prune(self, doc_id: int, fmt: str) -> None:
+        rows = self._conn.execute(
+            "SELECT * FROM revisions WHERE doc_id = ? AND format = ? ORDER BY id DESC",
+            (doc_id, fmt),
+        ).fetchall()
+
+        kept = rows[: self.keep]
+        if self.max_age_days > 0:
+            min_created_at = time.time() - self.max_age_days * 86400
+            kept = [row for row in kept if row["created_at"] >= min_created_at]
+        removed = rows[len(kept) :]
+        if not removed:
+            return
+
+        # 最早保留的版本如果是增量，它的基准版本会被删除，先转为完整快照
+        if kept and kept[-1]["base_id"] is not None:
+            oldest = kept[-1]
+            object_hash, codec = self._put_object(self._load(oldest))
+            self._conn.execute(
+                "UPDATE revisions SET object_hash = ?, codec = ?, base_id = NULL, "
+                "depth = 0 WHERE id = ?",
+                (object_hash, codec, oldest["id"]),
+            )
+            self._delete_unused_object(oldest["object_hash"], oldest["codec"])
+
+        for row in removed:
+            self._conn.execute("DELETE FROM revisions WHERE id = ?", (row["id"],))
+            self._delete_unused_object(row["object_hash"], row["codec"])
+
+    def list_revisions(self, doc_id: int) -> list[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, book_id, doc_id, format, path, content_hash, base_id, "
+                "size, created_at FROM revisions WHERE doc_id = ? ORDER BY id DESC",
+                (doc_id,),
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def restore(self, revision_id: int) -> bytes | None:
+        """取出某个版本的完整内容，版本不存在时返回 None。"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM revisions WHERE id = ?", (revision_id,)
+            ).fetchone()
+            return self._load(row) if row else None
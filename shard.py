@@ -0,0 +1,371 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import concurrent.futures
+import contextlib
+import hashlib
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+SHARD_DB_NAME = "yuque_shards.db"
+# 规划知识库时最多每隔这么久重新读取一次存活副本
+MEMBERS_REFRESH_SECONDS = 5
+# 心跳过期超过租约有效期的这么多倍后删除副本记录
+STALE_REPLICA_FACTOR = 10
+# 这些网络文件系统上 SQLite 的 WAL 与文件锁在多台主机之间不可靠，无法保证同一知识库只有一个写入者
+NETWORK_FILESYSTEMS = {
+    "nfs",
+    "nfs4",
+    "cifs",
+    "smb3",
+    "smbfs",
+    "afs",
+    "9p",
+    "fuse.sshfs",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS replicas (
+    replica_id TEXT PRIMARY KEY,
+    instance TEXT NOT NULL,
+    heartbeat_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    book_id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+"""
+
+
+def default_replica_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+class LeaseLostError(Exception):
+    """写入前发现知识库的租约已不再由本进程持有。"""
+
+
+def get_filesystem_type(path: str) -> str | None:
+    """按 /proc/mounts 找出 path 所在挂载点的文件系统类型，非 Linux 系统返回 None。"""
+    path = os.path.realpath(path)
+    try:
+        with open("/proc/mounts", encoding="utf-8") as f:
+            mounts = [line.split() for line in f]
+    except OSError:
+        return None
+
+    fs_type, matched = None, ""
+    for fields in mounts:
+        if len(fields) < 3:
+            continue
+        # 挂载点中的空格等字符以八进制转义
+        mount_point = fields[1].encode().decode("unicode_escape")
+        if len(mount_point) <= len(matched):
+            continue
+        if path == mount_point or path.startswith(mount_point.rstrip("/") + "/"):
+            fs_type, matched = fields[2], mount_point
+    return fs_type
+
+
+def rendezvous_owner(book_id: int, replicas: list[str]) -> str | None:
+    """
+    按 rendezvous（最高随机权重）哈希选出知识库所属的副本
+
+    副本增减时只有归属于变化副本的知识库会换主，其余知识库不动。
+    """
+
+    def weight(replica_id: str) -> int:
+        digest = hashlib.blake2b(
+            f"{replica_id}:{book_id}".encode(), digest_size=8
+        ).digest()
+        return int.from_bytes(digest, "big")
+
+    return max(replicas, key=weight, default=None)
+
+
+class ShardCoordinator:
+    """
+    多个副本共用同一个 SAVE_PATH 时的知识库分片
+
+    各副本在 SAVE_PATH/yuque_shards.db 中定期写入心跳，心跳未超过 lease_seconds 的副本视为存活；
+    知识库按 rendezvous 哈希分给存活副本之一（owns），副本同步知识库前还要取得它的租约（acquire），
+    同步完释放。同一知识库同时只有一个副本持有租约，其下的文档与临时文件只有一个写入者。
+    持有的租约随心跳续期；副本崩溃后心跳与租约一起过期，
+    其余副本此后按新的成员列表重新分配，接手它的知识库。
+
+    租约按进程实例记录：同一副本ID的新进程启动时视为旧进程已退出，清除旧进程的租约。
+    同一进程内（如一轮同步与 webhook 导出）对同一知识库的租约按次数计数，全部释放后才删除。
+    租约续期失败或已被其他副本取得后 holds() 返回 False，写入文件与状态前需要先确认。
+
+    SQLite 调用在单独的线程中依次执行，等待写锁时不阻塞事件循环。
+    """
+
+    def __init__(self, save_path: str, replica_id: str, lease_seconds: float):
+        """
+        :param replica_id:  副本ID，各副本必须不同，为空时使用 主机名-进程号
+        """
+        self.path = os.path.join(os.path.abspath(save_path), SHARD_DB_NAME)
+        self.replica_id = replica_id or default_replica_id()
+        self.lease_seconds = lease_seconds
+        self.instance = uuid.uuid4().hex
+        self.active = False
+        self._conn: sqlite3.Connection | None = None
+        self._members: list[str] = []
+        self._members_at = 0.0
+        self._held: dict[int, int] = {}  # 知识库ID -> 本进程内的持有次数
+        # 最近一次成功续期后租约的到期时间，超过后即使还没发现被接手也不再写入
+        self._valid_until = 0.0
+        self._heartbeat: asyncio.Task | None = None
+        # 单个线程执行全部 SQLite 调用，连接只在该线程中使用，调用按提交顺序执行
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="shard"
+        )
+
+    async def start(self) -> "ShardCoordinator":
+        save_path = os.path.dirname(self.path)
+        os.makedirs(save_path, exist_ok=True)
+        fs_type = get_filesystem_type(save_path)
+        if fs_type in NETWORK_FILESYSTEMS:
+            raise RuntimeError(
+                f"SAVE_PATH 位于网络文件系统（{fs_type}），SQLite 文件锁在多台主机之间不可靠，"
+                f"无法开启 SHARDING，请改用本机目录或块存储卷 path={save_path}"
+            )
+
+        await self._run(self._connect)
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        logger.info(
+            "[shard] 副本已加入 replica=%s replicas=%s lease=%ss",
+            self.replica_id,
+            len(await self.members()),
+            self.lease_seconds,
+        )
+        return self
+
+    async def _run(self, func, *args):
+        """在 SQLite 线程中执行 func，取消等待时调用仍会执行完。"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _connect(self) -> None:
+        # 每条语句单独提交，不长时间持有写锁
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._register()
+
+    async def close(self) -> None:
+        """退出时释放全部租约并注销，其余副本立即接手。"""
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._heartbeat
+            self._heartbeat = None
+        self.active = False
+        self._held.clear()
+        try:
+            await self._run(self._unregister)
+        finally:
+            self._executor.shutdown(wait=False)
+        logger.info("[shard] 副本已退出 replica=%s", self.replica_id)
+
+    def _unregister(self) -> None:
+        if self._conn is None:
+            return
+
+        try:
+            self._conn.execute("DELETE FROM leases WHERE owner = ?", (self.instance,))
+            self._conn.execute(
+                "DELETE FROM replicas WHERE replica_id = ? AND instance = ?",
+                (self.replica_id, self.instance),
+            )
+        except sqlite3.Error as exc:
+            logger.error(
+                "[shard] 注销副本失败 replica=%s error=%s", self.replica_id, exc
+            )
+        finally:
+            self._conn.close()
+            self._conn = None
+
+    def _register(self) -> None:
+        now = time.time()
+        with self._transaction():
+            previous = self._conn.execute(
+                "SELECT instance, heartbeat_at FROM replicas WHERE replica_id = ?",
+                (self.replica_id,),
+            ).fetchone()
+            if previous is not None:
+                if previous[1] >= now - self.lease_seconds:
+                    logger.warning(
+                        "[shard] 同一副本ID的旧实例心跳未过期，视为已重启 replica=%s",
+                        self.replica_id,
+                    )
+                self._conn.execute("DELETE FROM leases WHERE owner = ?", (previous[0],))
+            self._conn.execute(
+                "INSERT INTO replicas (replica_id, instance, heartbeat_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (replica_id) DO UPDATE SET instance = excluded.instance, "
+                "heartbeat_at = excluded.heartbeat_at",
+                (self.replica_id, self.instance, now),
+            )
+        self.active = True
+        self._valid_until = now + self.lease_seconds
+        self._members_at = 0.0
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+    async def _heartbeat_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await self._run(self._renew)
+            except sqlite3.Error as exc:
+                # 续期失败时租约可能过期，由其他副本接手；holds() 到期后不再允许写入
+                logger.error(
+                    "[shard] 心跳写入失败 replica=%s error=%s", self.replica_id, exc
+                )
+                continue
+            self._apply_renewal(renewed)
+
+    def _renew(self) -> tuple[float, set[int]] | None:
+        """
+        写入心跳并续期持有的租约，清理早已过期的副本记录
+
+        :return:  (续期时间, 仍由本进程持有的知识库ID)，副本ID已被另一个进程占用时返回 None
+        """
+        now = time.time()
+        with self._transaction():
+            cursor = self._conn.execute(
+                "UPDATE replicas SET heartbeat_at = ? WHERE replica_id = ? AND instance = ?",
+                (now, self.replica_id, self.instance),
+            )
+            if cursor.rowcount == 0:
+                return None
+
+            self._conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE owner = ?",
+                (now + self.lease_seconds, self.instance),
+            )
+            held = {
+                row[0]
+                for row in self._conn.execute(
+                    "SELECT book_id FROM leases WHERE owner = ?", (self.instance,)
+                )
+            }
+            self._conn.execute(
+                "DELETE FROM replicas WHERE heartbeat_at < ?",
+                (now - self.lease_seconds * STALE_REPLICA_FACTOR,),
+            )
+        return now, held
+
+    def _apply_renewal(self, renewed: tuple[float, set[int]] | None) -> None:
+        """在事件循环中更新本进程持有的租约，丢失的知识库此后 holds() 返回 False。"""
+        if renewed is None:
+            # 副本ID被另一个进程占用，停止接手知识库，避免两个写入者
+            if self.active:
+                logger.error(
+                    "[shard] 副本ID已被另一个进程使用，停止同步 replica=%s",
+                    self.replica_id,
+                )
+            self.active = False
+            self._held.clear()
+            return
+
+        now, held = renewed
+        self._valid_until = now + self.lease_seconds
+        lost = self._held.keys() - held
+        if lost:
+            logger.warning(
+                "[shard] 租约已过期并被其他副本取得，停止写入 replica=%s books=%s",
+                self.replica_id,
+                sorted(lost),
+            )
+            for book_id in lost:
+                del self._held[book_id]
+        self._members_at = 0.0
+
+    async def members(self) -> list[str]:
+        """心跳未过期的副本ID，按ID排序。"""
+        now = time.time()
+        if now - self._members_at >= MEMBERS_REFRESH_SECONDS:
+            rows = await self._run(self._fetch_members, now)
+            members = {row[0] for row in rows}
+            if self.active:
+                members.add(self.replica_id)
+            self._members = sorted(members)
+            self._members_at = now
+        return self._members
+
+    def _fetch_members(self, now: float) -> list:
+        return self._conn.execute(
+            "SELECT replica_id FROM replicas WHERE heartbeat_at >= ?",
+            (now - self.lease_seconds,),
+        ).fetchall()
+
+    async def owns(self, book_id: int) -> bool:
+        """知识库是否按当前的存活副本分给了本副本。"""
+        owner = rendezvous_owner(book_id, await self.members())
+        return self.active and owner == self.replica_id
+
+    def holds(self, book_id: int) -> bool:
+        """本进程是否仍持有知识库的租约：未被其他副本取得，且自上次续期起未过期。"""
+        return self.active and book_id in self._held and time.time() < self._valid_until
+
+    async def acquire(self, book_id: int) -> bool:
+        """
+        取得知识库的租约
+
+        :return:  租约空闲、已过期或本来就由本副本持有时返回 True
+        """
+        if not self.active:
+            return False
+        if book_id in self._held:
+            self._held[book_id] += 1
+            return True
+
+        acquired = await self._run(self._insert_lease, book_id)
+        if not acquired or not self.active:
+            return False
+        # 等待写锁期间同一知识库可能已被本进程的另一处取得
+        self._held[book_id] = self._held.get(book_id, 0) + 1
+        return True
+
+    def _insert_lease(self, book_id: int) -> bool:
+        now = time.time()
+        cursor = self._conn.execute(
+            "INSERT INTO leases (book_id, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (book_id) DO UPDATE SET owner = excluded.owner, "
+            "expires_at = excluded.expires_at "
+            "WHERE leases.owner = excluded.owner OR leases.expires_at < ?",
+            (book_id, self.instance, now + self.lease_seconds, now),
+        )
+        return cursor.rowcount > 0
+
+    async def release(self, book_id: int) -> None:
+        count = self._held.pop(book_id, 0)
+        if count > 1:
+            self._held[book_id] = count - 1
+            return
+        if count == 0:
+            return
+        await self._run(self._delete_lease, book_id)
+
+    def _delete_lease(self, book_id: int) -> None:
+        if self._conn is None:
+            return
+        self._conn.execute(
+            "DELETE FROM leases WHERE book_id = ? AND owner = ?",
+            (book_id, self.instance),
+        )
@@ -0,0 +1,505 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import collections
+import concurrent.futures
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import time
+
+from config import get_settings
+from model import YuqueBook, YuqueDocs
+
+logger = logging.getLogger(__name__)
+
+STATE_DB_NAME = "yuque_sync.db"
+# WAL 模式下读取不等待写锁，只在检查点等少数情况下短暂等待
+READ_BUSY_TIMEOUT_SECONDS = 5
+# 写入在单独的线程中执行，可以等待其它副本较长的写事务
+WRITE_BUSY_TIMEOUT_SECONDS = 30
+LEGACY_VERSION_FILE_NAME = "document_versions.json"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS versions (
+    book_id INTEGER NOT NULL,
+    doc_id INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    book_name TEXT,
+    doc_title TEXT,
+    updated_at TEXT NOT NULL DEFAULT '',
+    last_check_time TEXT,
+    content_hash TEXT,
+    word_count INTEGER,
+    file_size INTEGER,
+    pending_seconds REAL,
+    download_seconds REAL,
+    PRIMARY KEY (book_id, doc_id, format)
+);
+CREATE TABLE IF NOT EXISTS books (
+    book_id INTEGER PRIMARY KEY,
+    name TEXT,
+    updated_at TEXT,
+    content_updated_at TEXT,
+    last_sync_time TEXT,
+    formats TEXT
+);
+CREATE TABLE IF NOT EXISTS doc_details (
+    doc_id INTEGER PRIMARY KEY,
+    updated_at TEXT NOT NULL,
+    detail TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    last_used_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assets (
+    url TEXT PRIMARY KEY,
+    sha256 TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS kv (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def get_state_db_path(save_path: str) -> str:
+    """获取状态数据库的文件路径"""
+    return os.path.join(os.path.abspath(save_path), STATE_DB_NAME)
+
+
+class StateStore:
+    """
+    基于 SQLite 的同步状态存储
+
+    文档版本按 (book_id, doc_id, format) 建主键，每种导出格式各记一条；
+    查询在事件循环中直接执行，WAL 模式下读取不等待写锁；
+    写入先在内存中累积，到知识库检查点或一轮结束时 await commit()，
+    由单独的线程在一个短事务里写入。多个副本共用状态库时等待写锁不会阻塞事件循环，
+    进程崩溃只会丢失未提交的部分，不会损坏已有状态。
+    首次打开时自动导入旧版 document_versions.json。
+    """
+
+    def __init__(self, path: str | None = None, export_format: str | None = None):
+        """
+        :param path:           数据库路径，默认为 SAVE_PATH 下的 yuque_sync.db
+        :param export_format:  主导出格式，迁移旧版记录时使用，默认取当前配置
+        """
+        self.path = path or get_state_db_path(get_settings().save_path)
+        self.export_format = export_format or get_settings().export_format
+        self._conn: sqlite3.Connection | None = None
+        self._writer: sqlite3.Connection | None = None  # 只在写入线程中使用
+        self._batch: list[tuple[str, tuple]] = []
+        self._executor: concurrent.futures.ThreadPoolExecutor | None = None
+
+    def open(self) -> "StateStore":
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # 查询连接不开启事务，每次读取都能看到其它连接与副本已提交的写入
+        self._conn = sqlite3.connect(
+            self.path, timeout=READ_BUSY_TIMEOUT_SECONDS, isolation_level=None
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._migrate_legacy_files()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="state-store"
+        )
+        return self
+
+    def close(self) -> None:
+        """写入剩余的批次后关闭，退出时调用，允许短暂阻塞。"""
+        if self._executor is not None:
+            batch, self._batch = self._batch, []
+            try:
+                self._executor.submit(self._flush, batch).result()
+            finally:
+                self._executor.submit(self._close_writer).result()
+                self._executor.shutdown()
+                self._executor = None
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def __enter__(self) -> "StateStore":
+        return self.open()
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    async def commit(self) -> None:
+        """在写入线程中提交当前批次，失败时批次保留到下一次提交。"""
+        if not self._batch:
+            return
+        batch, self._batch = self._batch, []
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._flush, batch)
+        except Exception:
+            self._batch[:0] = batch
+            raise
+
+    def _write(self, sql: str, params: tuple) -> None:
+        self._batch.append((sql, params))
+
+    def _flush(self, batch: list[tuple[str, tuple]]) -> None:
+        if not batch:
+            return
+        if self._writer is None:
+            self._writer = sqlite3.connect(
+                self.path, timeout=WRITE_BUSY_TIMEOUT_SECONDS, isolation_level=None
+            )
+            self._writer.execute("PRAGMA synchronous=NORMAL")
+        self._writer.execute("BEGIN IMMEDIATE")
+        try:
+            for sql, params in batch:
+                self._writer.execute(sql, params)
+        except BaseException:
+            self._writer.execute("ROLLBACK")
+            raise
+        self._writer.execute("COMMIT")
+
+    def _close_writer(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    # 文档版本
+
+    def get_version(self, book_id: int, doc_id: int, export_format: str) -> dict | None:
+        row = self._conn.execute(
+            "SELECT * FROM versions WHERE book_id = ? AND doc_id = ? AND format = ?",
+            (book_id, doc_id, export_format),
+        ).fetchone()
+        return dict(row) if row else None
+
+    def get_book_versions(self, book_id: int) -> dict[tuple[int, str], dict]:
+        """一次取出某个知识库下所有文档、所有格式的版本记录，键为 (文档ID, 格式)。"""
+        rows = self._conn.execute(
+            "SELECT * FROM versions WHERE book_id = ?", (book_id,)
+        ).fetchall()
+        return {(row["doc_id"], row["format"]): dict(row) for row in rows}
+
+    def get_doc_versions(self, book_id: int, doc_id: int) -> dict[str, dict]:
+        """某个文档各格式的版本记录，键为格式。"""
+        rows = self._conn.execute(
+            "SELECT * FROM versions WHERE book_id = ? AND doc_id = ?",
+            (book_id, doc_id),
+        ).fetchall()
+        return {row["format"]: dict(row) for row in rows}
+
+    def delete_doc(self, book_id: int, doc_id: int) -> None:
+        """删除文档的版本记录与详情缓存，文档在语雀上被删除后调用。"""
+        self._write(
+            "DELETE FROM versions WHERE book_id = ? AND doc_id = ?", (book_id, doc_id)
+        )
+        self._write("DELETE FROM doc_details WHERE doc_id = ?", (doc_id,))
+
+    def upsert_version(
+        self,
+        book: YuqueBook,
+        doc: YuqueDocs,
+        export_format: str,
+        content_hash: str | None = None,
+        pending_seconds: float | None = None,
+        download_seconds: float | None = None,
+        file_size: int | None = None,
+    ) -> None:
+        """
+        记录文档版本
+
+        content_hash、字数、文件大小与导出耗时为空时保留已有的值。
+
+        :param pending_seconds:   本次提交导出到就绪的时间
+        :param download_seconds:  本次下载并保存的时间
+        :param file_size:         保存的文件字节数，没有字数时用于估算导出耗时
+        """
+        self._write(
+            """
+            INSERT INTO versions (book_id, doc_id, format, book_name, doc_title, updated_at, last_check_time,
+                                  content_hash, word_count, file_size, pending_seconds, download_seconds)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (book_id, doc_id, format) DO UPDATE SET
+                book_name = excluded.book_name,
+                doc_title = excluded.doc_title,
+                updated_at = excluded.updated_at,
+                last_check_time = excluded.last_check_time,
+                content_hash = COALESCE(excluded.content_hash, versions.content_hash),
+                word_count = COALESCE(excluded.word_count, versions.word_count),
+                file_size = COALESCE(excluded.file_size, versions.file_size),
+                pending_seconds = COALESCE(excluded.pending_seconds, versions.pending_seconds),
+                download_seconds = COALESCE(excluded.download_seconds, versions.download_seconds)
+            """,
+            (
+                book.id,
+                doc.id,
+                export_format,
+                book.name,
+                doc.title,
+                doc.updated_at or "",
+                datetime.datetime.now().isoformat(),
+                content_hash,
+                doc.word_count or None,
+                file_size,
+                pending_seconds,
+                download_seconds,
+            ),
+        )
+
+    def get_export_duration_stats(self, export_format: str) -> dict:
+        """
+        汇总某种格式已记录的导出耗时与字数，用于拟合 耗时 = a + b * 字数
+
+        :return:  {"count", "sum_x", "sum_y", "sum_xx", "sum_xy"}，x 为字数，y 为总耗时
+        """
+        row = self._conn.execute(
+            """
+            SELECT COUNT(*) AS count,
+                   SUM(word_count) AS sum_x,
+                   SUM(pending_seconds + download_seconds) AS sum_y,
+                   SUM(word_count * word_count) AS sum_xx,
+                   SUM(word_count * (pending_seconds + download_seconds)) AS sum_xy
+            FROM versions
+            WHERE format = ? AND word_count > 0
+              AND pending_seconds IS NOT NULL AND download_seconds IS NOT NULL
+            """,
+            (export_format,),
+        ).fetchone()
+        return {key: row[key] or 0 for key in row.keys()}
+
+    # 知识库状态
+
+    def get_book_state(self, book_id: int) -> dict | None:
+        row = self._conn.execute(
+            "SELECT * FROM books WHERE book_id = ?", (book_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def upsert_book_state(self, book: YuqueBook, formats: tuple[str, ...]) -> None:
+        """
+        记录知识库已完整同步
+
+        :param formats:  本次同步的导出格式，增加新格式后需要重新规划该知识库
+        """
+        self._write(
+            """
+            INSERT INTO books (book_id, name, updated_at, content_updated_at, last_sync_time, formats)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (book_id) DO UPDATE SET
+                name = excluded.name,
+                updated_at = excluded.updated_at,
+                content_updated_at = excluded.content_updated_at,
+                last_sync_time = excluded.last_sync_time,
+                formats = excluded.formats
+            """,
+            (
+                book.id,
+                book.name,
+                book.updated_at,
+                book.content_updated_at,
+                datetime.datetime.now().isoformat(),
+                ",".join(formats),
+            ),
+        )
+
+    # 文档详情缓存
+
+    def get_doc_detail(self, doc_id: int) -> dict | None:
+        row = self._conn.execute(
+            "SELECT * FROM doc_details WHERE doc_id = ?", (doc_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        item = dict(row)
+        item["detail"] = json.loads(item["detail"])
+        return item
+
+    def upsert_doc_detail(self, doc_id: int, updated_at: str, detail: dict) -> None:
+        now = time.time()
+        self._write(
+            "INSERT INTO doc_details (doc_id, updated_at, detail, fetched_at, last_used_at) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (doc_id) DO UPDATE SET updated_at = excluded.updated_at, "
+            "detail = excluded.detail, fetched_at = excluded.fetched_at, "
+            "last_used_at = excluded.last_used_at",
+            (doc_id, updated_at, json.dumps(detail, ensure_ascii=False), now, now),
+        )
+
+    def touch_doc_detail(self, doc_id: int) -> None:
+        self._write(
+            "UPDATE doc_details SET last_used_at = ? WHERE doc_id = ?",
+            (time.time(), doc_id),
+        )
+
+    def evict_doc_details(self, max_entries: int, min_fetched_at: float) -> int:
+        """
+        删除过期的条目，并按最近使用时间只保留 max_entries 条
+
+        :return:  待删除的条目数，删除随下一次 commit() 写入
+        """
+        where = (
+            "fetched_at < ? OR doc_id NOT IN "
+            "(SELECT doc_id FROM doc_details ORDER BY last_used_at DESC LIMIT ?)"
+        )
+        params = (min_fetched_at, max_entries)
+        row = self._conn.execute(
+            f"SELECT COUNT(*) FROM doc_details WHERE {where}", params
+        ).fetchone()
+        if row[0]:
+            self._write(f"DELETE FROM doc_details WHERE {where}", params)
+        return row[0]
+
+    # 本地化资源索引
+
+    def get_asset(self, url: str) -> dict | None:
+        row = self._conn.execute(
+            "SELECT * FROM assets WHERE url = ?", (url,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def upsert_asset(self, url: str, sha256: str, path: str, size: int) -> None:
+        self._write(
+            "INSERT INTO assets (url, sha256, path, size, fetched_at) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (url) DO UPDATE SET sha256 = excluded.sha256, "
+            "path = excluded.path, size = excluded.size, fetched_at = excluded.fetched_at",
+            (url, sha256, path, size, datetime.datetime.now().isoformat()),
+        )
+
+    # 其它键值状态
+
+    def get_value(self, key: str, default=None):
+        row = self._conn.execute(
+            "SELECT value FROM kv WHERE key = ?", (key,)
+        ).fetchone()
+        return json.loads(row["value"]) if row else default
+
+    def set_value(self, key: str, value) -> None:
+        self._write(
+            "INSERT INTO kv (key, value) VALUES (?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(value, ensure_ascii=False)),
+        )
+
+    # 旧版 JSON 迁移
+
+    def _migrate_legacy_files(self) -> None:
+        base_path = os.path.dirname(self.path)
+        version_file = os.path.join(base_path, LEGACY_VERSION_FILE_NAME)
+        if os.path.exists(version_file):
+            self._migrate_json(version_file, self._import_versions)
+
+    def _migrate_json(self, path: str, importer) -> None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._conn.execute("BEGIN")
+            try:
+                count = importer(data)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            os.replace(path, path + ".migrated")
+            logger.info("[store] 已迁移旧版状态文件 path=%s records=%s", path, count)
+        except Exception as exc:
+            logger.error("[store] 迁移旧版状态文件失败 path=%s error=%s", path, exc)
+
+    def _import_versions(self, versions: dict) -> int:
+        # 旧版只支持单一格式，记录归入当前的主导出格式
+        rows = [
+            (
+                item.get("book_id"),
+                item.get("doc_id"),
+                self.export_format,
+                item.get("book_name"),
+                item.get("doc_title"),
+                item.get("updated_at") or "",
+                item.get("last_check_time"),
+            )
+            for item in versions.values()
+            if isinstance(item, dict) and item.get("book_id") and item.get("doc_id")
+        ]
+        self._conn.executemany(
+            "INSERT OR IGNORE INTO versions "
+            "(book_id, doc_id, format, book_name, doc_title, updated_at, last_check_time) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+        return len(rows)
+
+
+class DocDetailCache:
+    """
+    文档详情缓存
+
+    按 (doc_id, updated_at) 命中，文档没有更新就不再请求详情接口。
+    内存中按 LRU 保留最近使用的条目；attach() 绑定 StateStore 后同时持久化，
+    下一轮同步或重启后仍可复用。超过 ttl_seconds 的条目视为过期。
+    """
+
+    def __init__(self, ttl_seconds: float, max_entries: int):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max(1, max_entries)
+        self.store: StateStore | None = None
+        self._memory: collections.OrderedDict[int, tuple[str, float, dict]] = (
+            collections.OrderedDict()
+        )
+
+    def attach(self, store: StateStore) -> None:
+        self.store = store
+
+    def detach(self) -> None:
+        """解除绑定前清理持久化的过期条目。"""
+        self.evict()
+        self.store = None
+
+    def evict(self) -> None:
+        """清理持久化的过期条目与超出 max_entries 的最久未用条目。"""
+        if self.store is None:
+            return
+
+        evicted = self.store.evict_doc_details(
+            self.max_entries, time.time() - self.ttl_seconds
+        )
+        if evicted:
+            logger.info("[cache] 清理文档详情缓存 evicted=%s", evicted)
+
+    def _is_fresh(self, updated_at: str, fetched_at: float, expected: str) -> bool:
+        return updated_at == expected and time.time() - fetched_at < self.ttl_seconds
+
+    def get(self, doc_id: int, updated_at: str | None) -> dict | None:
+        updated_at = updated_at or ""
+        item = self._memory.get(doc_id)
+        if item is not None and self._is_fresh(item[0], item[1], updated_at):
+            self._memory.move_to_end(doc_id)
+            return item[2]
+
+        if self.store is None:
+            return None
+
+        row = self.store.get_doc_detail(doc_id)
+        if row is None or not self._is_fresh(
+            row["updated_at"], row["fetched_at"], updated_at
+        ):
+            return None
+
+        self.store.touch_doc_detail(doc_id)
+        self._remember(doc_id, updated_at, row["fetched_at"], row["detail"])
+        return row["detail"]
+
+    def put(self, doc_id: int, updated_at: str | None, detail: dict) -> None:
+        updated_at = updated_at or ""
+        self._remember(doc_id, updated_at, time.time(), detail)
+        if self.store is not None:
+            self.store.upsert_doc_detail(doc_id, updated_at, detail)
+
+    def _remember(
+        self, doc_id: int, updated_at: str, fetched_at: float, detail: dict
+    ) -> None:
+        self._memory[doc_id] = (updated_at, fetched_at, detail)
+        self._memory.move_to_end(doc_id)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
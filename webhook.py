@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextlib
+import hmac
+import json
+import logging
+from dataclasses import dataclass
+
+from aiohttp import web
+
+from metrics import WEBHOOK_EVENTS
+from model import YuqueBook, YuqueDocs
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_PATH = "/webhook"
+# 文档持续被编辑时，距第一次事件最多推迟 debounce 的倍数后导出
+WEBHOOK_MAX_DEBOUNCE_FACTOR = 6
+WEBHOOK_WORKERS = 2
+
+ACTION_DELETE = "delete"
+# 触发重新导出的事件，其余事件（评论等）忽略
+EXPORT_ACTIONS = {"publish", "update"}
+
+
+@dataclass
+class DocEvent:
+    """合并后的单个文档事件，只保留最新的一次。"""
+
+    action: str
+    book: YuqueBook
+    doc: YuqueDocs
+    first_at: float
+    due_at: float
+    account: str = ""  # webhook 地址中的 ?account=，多账号时区分事件来源
+
+    @property
+    def key(self) -> tuple[str, int]:
+        return self.account, self.doc.id
+
+
+def normalize_action(value: str) -> str:
+    """action_type 为 publish 等；webhook_subject_type 为 publish_doc 等，去掉 _doc 后缀统一。"""
+    return value.lower().removesuffix("_doc")
+
+
+def parse_webhook_payload(payload: dict) -> tuple[str, dict, dict] | None:
+    """
+    解析语雀文档 webhook
+
+    :return:  (事件类型, 知识库数据, 文档数据)，不是文档事件时返回 None
+    """
+    data = payload.get("data") if isinstance(payload, dict) else None
+    if not isinstance(data, dict) or not data.get("id"):
+        return None
+
+    action = data.get("action_type") or data.get("webhook_subject_type") or ""
+    book_data = data.get("book") if isinstance(data.get("book"), dict) else {}
+    book_data = {"id": data.get("book_id"), **book_data}
+    if not book_data.get("id"):
+        return None
+    return normalize_action(action), book_data, data
+
+
+class WebhookReceiver:
+    """
+    语雀文档 webhook 接收端
+
+    收到 publish/update/delete 事件后不立即处理：同一文档在 debounce_seconds 内的多次事件合并为一次，
+    持续编辑时最多推迟 debounce_seconds * WEBHOOK_MAX_DEBOUNCE_FACTOR；
+    到期后调用 on_doc(event) 导出或删除本地文件，同一文档同时只有一个任务在进行，
+    导出期间到达的新事件在其完成后再处理；on_doc 返回 False 时事件在 debounce_seconds 后重试。
+    """
+
+    def __init__(self, on_doc, debounce_seconds: float, token: str = ""):
+        """
+        :param on_doc:  async on_doc(event: DocEvent) -> bool
+        :param token:   非空时要求请求带上 ?token=，与语雀中配置的 webhook 地址一致
+
+        同步多个账号时，在各账号的 webhook 地址上加 ?account=<账号名称> 区分来源。
+        """
+        self.on_doc = on_doc
+        self.debounce_seconds = debounce_seconds
+        self.token = token
+        self._events: dict[tuple[str, int], DocEvent] = {}
+        self._running: dict[tuple[str, int], asyncio.Task] = {}
+        self._changed = asyncio.Event()
+        self._slots = asyncio.Semaphore(WEBHOOK_WORKERS)
+        self._runner: web.AppRunner | None = None
+        self._dispatcher: asyncio.Task | None = None
+
+    async def start(self, host: str, port: int) -> bool:
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_request)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, host, port).start()
+        except OSError as exc:
+            logger.error(
+                "[webhook] 接收端启动失败 host=%s port=%s error=%s", host, port, exc
+            )
+            await self._runner.cleanup()
+            self._runner = None
+            return False
+
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        logger.info(
+            "[webhook] 接收端已启动 url=http://%s:%s%s debounce=%ss",
+            host,
+            port,
+            WEBHOOK_PATH,
+            self.debounce_seconds,
+        )
+        return True
+
+    async def close(self) -> None:
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._dispatcher
+            self._dispatcher = None
+        for task in list(self._running.values()):
+            task.cancel()
+        await asyncio.gather(*self._running.values(), return_exceptions=True)
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def wait_idle(self) -> None:
+        """等待进行中的导出完成，未到期的事件不受影响。"""
+        await asyncio.gather(*self._running.values(), return_exceptions=True)
+
+    async def handle_request(self, request: web.Request) -> web.Response:
+        if self.token and not hmac.compare_digest(
+            request.query.get("token", ""), self.token
+        ):
+            return web.json_response({"message": "forbidden"}, status=403)
+
+        try:
+            payload = await request.json()
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return web.json_response({"message": "invalid json"}, status=400)
+
+        parsed = parse_webhook_payload(payload)
+        if parsed is None:
+            WEBHOOK_EVENTS.inc(action="invalid")
+            return web.json_response({"message": "ignored"}, status=202)
+
+        action, book_data, doc_data = parsed
+        WEBHOOK_EVENTS.inc(action=action or "unknown")
+        account = request.query.get("account", "")
+        self.add(action, YuqueBook(book_data), YuqueDocs(doc_data), account)
+        return web.json_response({"message": "accepted"}, status=202)
+
+    def add(
+        self, action: str, book: YuqueBook, doc: YuqueDocs, account: str = ""
+    ) -> None:
+        if action not in EXPORT_ACTIONS and action != ACTION_DELETE:
+            logger.debug("[webhook] 忽略事件 action=%s doc_id=%s", action, doc.id)
+            return
+
+        now = asyncio.get_running_loop().time()
+        event = self._events.get((account, doc.id))
+        first_at = event.first_at if event is not None else now
+        due_at = min(
+            now + self.debounce_seconds,
+            first_at + self.debounce_seconds * WEBHOOK_MAX_DEBOUNCE_FACTOR,
+        )
+        self._events[(account, doc.id)] = DocEvent(
+            action, book, doc, first_at, due_at, account
+        )
+        logger.info(
+            "[webhook] 收到文档事件 account=%s action=%s book_id=%s doc_id=%s merged=%s",
+            account or "-",
+            action,
+            book.id,
+            doc.id,
+            event is not None,
+        )
+        self._changed.set()
+
+    async def _dispatch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            now = loop.time()
+            waiting = [
+                event for key, event in self._events.items() if key not in self._running
+            ]
+            due = [event for event in waiting if event.due_at <= now]
+            for event in due:
+                del self._events[event.key]
+                task = asyncio.create_task(self._run(event))
+                self._running[event.key] = task
+
+            self._changed.clear()
+            pending = [event.due_at for event in waiting if event.due_at > now]
+            timeout = min(pending) - now if pending else None
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._changed.wait(), timeout)
+
+    async def _run(self, event: DocEvent) -> None:
+        try:
+            async with self._slots:
+                handled = await self.on_doc(event)
+            if handled is False and event.key not in self._events:
+                self.add(event.action, event.book, event.doc, event.account)
+        except Exception as exc:
+            logger.exception(
+                "[webhook] 处理文档事件异常 doc_id=%s error=%s", event.doc.id, exc
+            )
+        finally:
+            del self._running[event.key]
+            # 导出期间可能有同一文档的新事件在等待
+            self._changed.set()
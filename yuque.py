@@ -1,36 +1,130 @@
 # -*- coding: utf-8 -*-
 import asyncio
-import concurrent.futures
+import codecs
+import contextlib
+import hashlib
 import logging
 import json
 import os
-import datetime
+import time
+import uuid
+from collections.abc import Callable
 
-import requests
+import aiohttp
 import re
-from config import get_config
-from model import QuickLinksData, YuqueBook, YuqueDocs, YuqueDocDetail, YuqueGroup
+import profiler
+from assets import (
+    AssetLocalizer,
+    build_link_rewriter,
+    find_asset_urls,
+    has_remote_assets,
+)
+from config import HttpSettings, Settings, get_settings
+from limiter import ByteBudget, RequestLimiter, parse_retry_after
+from metrics import (
+    ACTIVE_REQUESTS,
+    API_REQUEST_SECONDS,
+    API_REQUESTS,
+    CONCURRENCY_LIMIT,
+    DOWNLOAD_BYTES,
+    DOWNLOAD_SECONDS,
+    SAVE_SECONDS,
+)
+from model import (
+    QuickLinksData,
+    YuqueActivities,
+    YuqueBook,
+    YuqueDocs,
+    YuqueDocDetail,
+    YuqueGroup,
+)
+from revisions import RevisionStore
+from shard import LeaseLostError
+from store import DocDetailCache, StateStore
 
 logger = logging.getLogger(__name__)
 
-EXPORT_PENDING_WAIT_SECONDS = 10
-MAX_EXPORT_WORKERS = 3
+EXPORT_PENDING_INITIAL_WAIT_SECONDS = 1.0
+EXPORT_PENDING_MAX_WAIT_SECONDS = 15.0
+EXPORT_PENDING_BACKOFF_FACTOR = 1.6
+EXPORT_PENDING_TIMEOUT_SECONDS = 600
 
+# 列表分页遇到限流、服务端错误或网络异常时的重试
+PAGE_MAX_ATTEMPTS = 4
+PAGE_RETRY_INITIAL_WAIT_SECONDS = 1.0
+PAGE_RETRY_MAX_WAIT_SECONDS = 30.0
 
-def get_file_extension(export_format: str = None) -> str:
+# 服务端导出状态
+EXPORT_READY = "ready"
+EXPORT_PENDING = "pending"
+EXPORT_RETRY = "retry"
+EXPORT_FAILED = "failed"
+
+# 下载结果
+DOWNLOAD_SAVED = "saved"
+DOWNLOAD_UNCHANGED = "unchanged"
+DOWNLOAD_NOT_READY = "not_ready"
+DOWNLOAD_FAILED = "failed"
+
+# 流式下载每次读取的块大小
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# markdown 单行最多缓存的字符数
+MARKDOWN_MAX_LINE_CHARS = 1024 * 1024
+FONT_TAG_PATTERN = re.compile(r'<font\s+style="[^"]*">(.*?)</font>')
+
+
+def get_file_extension(export_format: str) -> str:
     """
     根据导出格式获取文件扩展名
 
     :param export_format: 导出格式 ("pdf" 或 "markdown")
     :return: 文件扩展名 (包含点号)
     """
-    if export_format is None:
-        cfg = get_config()
-        export_format = cfg.get("export_format", "pdf")
-
     return ".pdf" if export_format == "pdf" else ".md"
 
 
+def next_pending_wait(wait: float | None) -> float:
+    """
+    计算下一次查询导出状态前的等待时间
+
+    从 EXPORT_PENDING_INITIAL_WAIT_SECONDS 开始按倍数增长，
+    小文档很快就能拿到结果，大文档也不会被频繁轮询。
+
+    :param wait: 上一次的等待时间，首次传 None
+    :return:     本次等待时间（秒）
+    """
+    if wait is None:
+        return EXPORT_PENDING_INITIAL_WAIT_SECONDS
+
+    return min(wait * EXPORT_PENDING_BACKOFF_FACTOR, EXPORT_PENDING_MAX_WAIT_SECONDS)
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """限流（429）、服务端错误（5xx）、网络异常与超时可以重试，其余错误直接失败。"""
+    if isinstance(exc, aiohttp.ClientResponseError):
+        return exc.status == 429 or exc.status >= 500
+    return isinstance(
+        exc,
+        (
+            aiohttp.ClientConnectionError,
+            aiohttp.ClientPayloadError,
+            asyncio.TimeoutError,
+        ),
+    )
+
+
+def get_retry_wait(exc: BaseException, attempt: int) -> float:
+    """优先遵守响应的 Retry-After，否则按尝试次数指数退避。"""
+    headers = getattr(exc, "headers", None)
+    retry_after = parse_retry_after(headers.get("Retry-After")) if headers else None
+    if retry_after is not None:
+        return retry_after
+    return min(
+        PAGE_RETRY_MAX_WAIT_SECONDS,
+        PAGE_RETRY_INITIAL_WAIT_SECONDS * 2 ** (attempt - 1),
+    )
+
+
 def sanitize_filename(title: str) -> str:
     """
     将语雀文档标题转换为合法的文件名
@@ -70,20 +164,35 @@ def format_doc_context(book: YuqueBook, doc: YuqueDocs) -> str:
     return f"{format_book_context(book)} doc={doc.title}({doc.id})"
 
 
+def get_book_dir(base_path: str, book: YuqueBook) -> str:
+    """知识库对应的本地目录。"""
+    return os.path.join(os.path.abspath(base_path), sanitize_filename(book.name))
+
+
 def build_doc_save_path(
-    base_path: str, book: YuqueBook, doc: YuqueDocs, export_format: str = None
+    base_path: str, book: YuqueBook, doc: YuqueDocs, export_format: str
 ) -> str:
-    """构建文档保存路径，并确保目录存在。"""
-    book_dir = os.path.join(os.path.abspath(base_path), sanitize_filename(book.name))
-    os.makedirs(book_dir, exist_ok=True)
+    """
+    构建文档保存路径
+
+    只拼接路径，不访问文件系统；目录在真正写入文件时才创建。
+    """
     filename = sanitize_filename(doc.title) + get_file_extension(export_format)
-    return os.path.join(book_dir, filename)
+    return os.path.join(get_book_dir(base_path, book), filename)
+
 
+def scan_directory_files(path: str) -> set[str]:
+    """
+    一次列出目录下的文件名
 
-def get_export_format() -> str:
-    """获取导出格式配置。"""
-    cfg = get_config()
-    return cfg.get("export_format", "pdf")
+    规划阶段用它判断文件是否存在，代替逐个文档调用 os.path.exists；
+    目录不存在时返回空集合。
+    """
+    try:
+        with os.scandir(path) as entries:
+            return {entry.name for entry in entries if entry.is_file()}
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
 
 
 def get_export_payload(export_format: str) -> dict:
@@ -102,57 +211,197 @@ def get_export_payload(export_format: str) -> dict:
     }
 
 
-def backup_existing_file(save_path: str, context: str) -> None:
-    """如果目标文件已存在，先备份到 .bak。"""
-    if not os.path.exists(save_path):
-        return
+class AtomicFileWriter:
+    """
+    原子化写入文件
 
-    backup_path = save_path + ".bak"
-    try:
-        if os.path.exists(backup_path):
-            os.remove(backup_path)
-        os.rename(save_path, backup_path)
-    except Exception as exc:
-        logger.warning(
-            "[file] 创建备份失败 %s path=%s error=%s", context, save_path, exc
-        )
+    内容先写入同目录下的 .temp 临时文件，边写边统计大小；
+    commit() 时替换目标文件，未提交就退出时删除临时文件，原文件不受影响。
+    """
+
+    def __init__(self, save_path: str):
+        self.save_path = save_path
+        self.temp_path: str | None = None
+        self.size = 0
+        self.committed = False
+        self._file = None
+
+    def __enter__(self) -> "AtomicFileWriter":
+        os.makedirs(os.path.dirname(self.save_path), exist_ok=True)
+        # 同名文档可能同时下载，临时文件名不能固定
+        self.temp_path = f"{self.save_path}.{uuid.uuid4().hex[:8]}.temp"
+        self._file = open(self.temp_path, "xb")
+        return self
+
+    def write(self, data: bytes) -> None:
+        if not data:
+            return
+        self._file.write(data)
+        self.size += len(data)
+
+    def rewrite_lines(self, transform) -> None:
+        """逐行改写已写入的内容，transform 接收并返回一行文本。"""
+        self._file.close()
+        source_path = self.temp_path
+        self.temp_path = f"{self.save_path}.{uuid.uuid4().hex[:8]}.temp"
+        self._file = open(self.temp_path, "xb")
+        self.size = 0
+        try:
+            with open(source_path, "r", encoding="utf-8", newline="") as source:
+                for line in source:
+                    self.write(transform(line).encode("utf-8"))
+        finally:
+            os.remove(source_path)
 
+    def commit(self) -> None:
+        self._file.close()
+        os.replace(self.temp_path, self.save_path)
+        self.committed = True
 
-def save_content_atomically(
-    save_path: str, content, binary: bool, context: str
-) -> bool:
-    """原子化保存文件内容，失败时避免破坏原文件。"""
-    os.makedirs(os.path.dirname(save_path), exist_ok=True)
-    temp_path = save_path + ".temp"
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._file.close()
+        if not self.committed:
+            with contextlib.suppress(OSError):
+                os.remove(self.temp_path)
 
-    try:
-        if binary:
-            with open(temp_path, "wb") as file_handle:
-                file_handle.write(content)
-        else:
-            with open(temp_path, "w", encoding="utf-8") as file_handle:
-                file_handle.write(content)
-
-        backup_existing_file(save_path, context)
-        os.replace(temp_path, save_path)
-        return True
-    except Exception as exc:
-        logger.error("[file] 保存文件失败 %s path=%s error=%s", context, save_path, exc)
-        return False
 
+class MarkdownStreamFilter:
+    """
+    流式处理 markdown 导出内容
+
+    逐块增量解码，凑满整行后去掉语雀导出的 <font style> 标签，再编码为 UTF-8；
+    find_assets 为真时顺带收集引用的远程资源链接。
+    """
+
+    def __init__(self, encoding: str | None = None, find_assets: bool = False):
+        try:
+            decoder_class = codecs.getincrementaldecoder(encoding or "utf-8")
+        except LookupError:
+            decoder_class = codecs.getincrementaldecoder("utf-8")
+        self._decoder = decoder_class(errors="replace")
+        self._pending = ""
+        self.find_assets = find_assets
+        self.asset_urls: set[str] = set()
+
+    def feed(self, chunk: bytes) -> bytes:
+        text = self._pending + self._decoder.decode(chunk)
+        complete, newline, self._pending = text.rpartition("\n")
+        if len(self._pending) > MARKDOWN_MAX_LINE_CHARS:
+            # 超长行不再等待换行，避免单行无限占用内存
+            complete, newline, self._pending = text, "", ""
+        return self._clean(complete + newline)
+
+    def flush(self) -> bytes:
+        text = self._pending + self._decoder.decode(b"", final=True)
+        self._pending = ""
+        return self._clean(text)
+
+    def _clean(self, text: str) -> bytes:
+        text = FONT_TAG_PATTERN.sub(r"\1", text)
+        if self.find_assets:
+            self.asset_urls.update(find_asset_urls(text))
+        return text.encode("utf-8")
+
+
+def create_connector(http_config: HttpSettings) -> aiohttp.TCPConnector:
+    connector = aiohttp.TCPConnector(
+        limit=http_config.max_connections,
+        limit_per_host=http_config.max_connections_per_host,
+        keepalive_timeout=http_config.keepalive_seconds,
+        ttl_dns_cache=300,
+    )
+    logger.info(
+        "[init] 连接池已创建 limit=%s limit_per_host=%s keepalive=%ss",
+        http_config.max_connections,
+        http_config.max_connections_per_host,
+        http_config.keepalive_seconds,
+    )
+    return connector
+
+
+class SharedHttp:
+    """
+    多个账号共用的 HTTP 资源
+
+    连接池、全局并发名额（GLOBAL_MAX_CONCURRENCY）与下载缓冲由所有账号的客户端共享，
+    每个账号仍然使用各自的 Cookie、限流器与并发上限。
+    """
+
+    def __init__(self, settings: Settings):
+        self._http_config = settings.http
+        self._connector: aiohttp.TCPConnector | None = None
+        global_limit = settings.limit.global_max_concurrency
+        self.request_slots = asyncio.Semaphore(global_limit) if global_limit else None
+        self.download_budget = ByteBudget(settings.download_buffer_bytes)
 
-def run_doc_export_sync(
-    yuque_client, book: YuqueBook, doc: YuqueDocs, save_path: str
-) -> bool:
-    """在线程池中执行异步导出逻辑。"""
-    return asyncio.run(yuque_client.docs_export(book, doc, save_path))
+    def get_connector(self) -> aiohttp.TCPConnector:
+        if self._connector is None or self._connector.closed:
+            self._connector = create_connector(self._http_config)
+        return self._connector
+
+    async def close(self) -> None:
+        if self._connector is not None:
+            await self._connector.close()
+            self._connector = None
 
 
 class Yuque:
-    def __init__(self):
-        config = get_config()["yuque"]
+    """
+    语雀客户端
+
+    所有请求共用一个 aiohttp 连接池，使用前需调用 start()，结束后调用 close()，
+    也可以直接 async with Yuque() as yuque 使用。
+    多账号同步时每个账号一个客户端，通过 shared 共用连接池与全局并发名额。
+    """
+
+    def __init__(
+        self, settings: Settings | None = None, shared: SharedHttp | None = None
+    ):
+        """
+        :param settings: 配置快照，默认使用 get_settings() 的当前配置
+        :param shared:   多个客户端共用的 HTTP 资源，为 None 时独占连接池
+        """
+        self.settings = settings or get_settings()
+        self.account = self.settings.account or "default"
+        config = self.settings.yuque
+        self._http_config = self.settings.http
+        self._http: aiohttp.ClientSession | None = None
+        self._shared = shared
+        self.page_size = self.settings.page_size
+        self.limiter = RequestLimiter(
+            rate=self.settings.limit.requests_per_second,
+            initial_concurrency=self.settings.export_workers,
+            min_concurrency=self.settings.limit.min_concurrency,
+            max_concurrency=self.settings.limit.max_concurrency,
+            shared_slots=shared.request_slots if shared is not None else None,
+        )
+        self.download_budget = (
+            shared.download_budget
+            if shared is not None
+            else ByteBudget(self.settings.download_buffer_bytes)
+        )
+        self.detail_cache = DocDetailCache(
+            ttl_seconds=self.settings.detail_cache.ttl_seconds,
+            max_entries=self.settings.detail_cache.max_entries,
+        )
+        self._detail_tasks: dict[tuple[int, str | None], asyncio.Task] = {}
+        # (文档ID, 格式) -> [锁, 使用者数]，同步与 webhook 不会同时写入同一个文件
+        self._export_locks: dict[tuple[int, str], list] = {}
+        # 分片时由 start_account_shard 设置为 ShardCoordinator.holds，知识库租约丢失后不再写入
+        self.write_guard: Callable[[int], bool] | None = None
+        self.assets = AssetLocalizer(
+            self,
+            self.settings.save_path,
+            enabled=self.settings.localize_assets,
+            credential_hosts=self.settings.asset_credential_hosts,
+        )
+        self.revisions = RevisionStore(
+            self.settings.save_path,
+            keep=self.settings.revision.keep,
+            max_age_days=self.settings.revision.max_age_days,
+        )
 
-        raw_base_url = config.get("base_url")
+        raw_base_url = config.base_url
         self.base_url = (
             str(raw_base_url).strip().rstrip("/") if raw_base_url is not None else None
         )
@@ -164,8 +413,8 @@ class Yuque:
             return
 
         # request
-        self._token = config.get("token")
-        self._session = config.get("session")
+        self._token = config.token
+        self._session = config.session
 
         if self._token is None or self._session is None:
             self._set_init_error(
@@ -179,39 +428,119 @@ class Yuque:
             )
             return
 
-        self._requestSession = requests.session()
-        self._requestSession.headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-            "Content-Type": "application/json",
-        }
-        self._requestSession.cookies.update(
-            {"yuque_ctoken": self._token, "_yuque_session": self._session}
-        )
+    async def start(self) -> bool:
+        """创建连接池并测试连接。"""
+        if self.init_error:
+            return False
 
-        if not self._test():
+        if self.revisions.enabled:
+            self.revisions.open()
+
+        if self._http is None:
+            if self._shared is not None:
+                connector = self._shared.get_connector()
+            else:
+                connector = create_connector(self._http_config)
+            self._http = aiohttp.ClientSession(
+                connector=connector,
+                connector_owner=self._shared is None,
+                headers={
+                    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+                    "Content-Type": "application/json",
+                },
+                cookies={"yuque_ctoken": self._token, "_yuque_session": self._session},
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    sock_connect=30,
+                    sock_read=self._http_config.timeout_seconds,
+                ),
+            )
+            self.assets.open(connector, self._http_config.timeout_seconds)
+
+        with profiler.phase("init"):
+            tested = await self._test()
+        if not tested:
             if not self.init_error:
                 self._set_init_error("语雀连接测试失败，请检查 Token 和 Session")
             logger.error(
                 "[init] 获取方式: 浏览器登录语雀 → F12 → Network → 请求头 Cookie"
             )
-            return
+            return False
 
         self.is_initialized = True
-        logger.info("[init] 语雀客户端初始化成功")
+        logger.info("[init] 语雀客户端初始化成功 account=%s", self.account)
+        return True
+
+    async def close(self) -> None:
+        """取消后台获取文档详情与资源的任务，再关闭连接池。"""
+        detail_tasks = list(self._detail_tasks.values())
+        for task in detail_tasks:
+            task.cancel()
+        await asyncio.gather(*detail_tasks, return_exceptions=True)
+        await self.assets.close()
+        if self._http is not None:
+            await self._http.close()
+            self._http = None
+        self.revisions.close()
+        self.is_initialized = False
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
 
     def _set_init_error(self, message: str) -> None:
         self.init_error = message
         logger.error("[init] %s", message)
 
-    def _test(self):
+    @contextlib.asynccontextmanager
+    async def _request(self, method: str, url: str, endpoint: str, **kwargs):
+        """
+        通过共享连接池发起请求
+
+        每个请求都经过限流器：按响应状态调整并发上限，并遵守 Retry-After。
+
+        :param endpoint:  指标中的接口名称，由调用方给出固定值，不从路径推断，
+                          路径中的文档ID、slug 不会变成标签值
+        """
+        concurrency = self.limiter.concurrency
+
+        try:
+            async with self.limiter.slot():
+                ACTIVE_REQUESTS.set(concurrency.active, account=self.account)
+                started = time.monotonic()
+                responded = False
+                try:
+                    async with self._http.request(method, url, **kwargs) as response:
+                        responded = True
+                        API_REQUEST_SECONDS.observe(
+                            time.monotonic() - started, endpoint=endpoint
+                        )
+                        API_REQUESTS.inc(endpoint=endpoint, status=response.status)
+                        await self.limiter.feedback(
+                            response.status, response.headers.get("Retry-After")
+                        )
+                        yield response
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exc:
+                    if not responded:
+                        API_REQUESTS.inc(endpoint=endpoint, status=type(exc).__name__)
+                    self.limiter.on_congestion(type(exc).__name__)
+                    raise
+        finally:
+            ACTIVE_REQUESTS.set(concurrency.active, account=self.account)
+            CONCURRENCY_LIMIT.set(int(concurrency.limit), account=self.account)
+
+    async def _test(self):
         test_url = self.base_url + "/api/mine/getRecommendationTip?type=activityLive"
         try:
-            response = self._requestSession.get(test_url)
-            if response.status_code == 200:
-                return True
+            async with self._request("GET", test_url, endpoint="test") as response:
+                if response.status == 200:
+                    return True
 
-            self._set_init_error(f"连接测试失败 status={response.status_code}")
-            return False
+                self._set_init_error(f"连接测试失败 status={response.status}")
+                return False
         except Exception as exc:
             self._set_init_error(f"连接测试异常 error={exc}")
             return False
@@ -247,6 +576,13 @@ class Yuque:
 
         return books
 
+    def get_credential_headers(self) -> dict:
+        """访问语雀自身域名（如附件下载）时需要的 Cookie 与 Referer。"""
+        return {
+            "referer": self.base_url,
+            "cookie": f"yuque_ctoken={self._token}; _yuque_session={self._session}",
+        }
+
     def _build_export_headers(self) -> dict:
         return {
             "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/135.0.0.0 Safari/537.36",
@@ -257,26 +593,68 @@ class Yuque:
             "_yuque_session": self._session,
         }
 
-    def _is_unpublished_export(self, response) -> bool:
+    async def _is_unpublished_export(self, response) -> bool:
         try:
-            return response.json().get("message") == "请发布后再导出"
+            response_json = await response.json(content_type=None)
+            return response_json.get("message") == "请发布后再导出"
         except Exception:
             return False
 
-    async def _build_markdown_header(self, book: YuqueBook, doc: YuqueDocs) -> str:
-        context = format_doc_context(book, doc)
-        contributors_text = ""
+    def prefetch_doc_detail(self, book: YuqueBook, doc: YuqueDocs) -> None:
+        """在提交导出的同时后台获取文档详情，写入 markdown 头部时直接使用。"""
+        self._get_detail_task(book, doc)
+
+    def _get_detail_task(self, book: YuqueBook, doc: YuqueDocs) -> asyncio.Task:
+        """同一文档版本同时只有一个获取任务，完成后结果由 detail_cache 提供。"""
+        key = (doc.id, doc.updated_at)
+        task = self._detail_tasks.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load_doc_detail(book, doc))
+            self._detail_tasks[key] = task
+            task.add_done_callback(lambda _: self._detail_tasks.pop(key, None))
+        return task
+
+    async def _load_doc_detail(self, book: YuqueBook, doc: YuqueDocs) -> dict | None:
+        """
+        获取文档的协作者与字数
+
+        :return:  {"contributors": [{"name", "login"}], "word_count"}，失败时返回 None
+        """
+        detail = self.detail_cache.get(doc.id, doc.updated_at)
+        if detail is not None:
+            return detail
 
         try:
             doc_detail: YuqueDocDetail = await self.overview(book, doc)
-            contributors = [
-                f"{contributor.name}({contributor.login})"
+        except Exception as exc:
+            logger.warning(
+                "[export] 获取协作者信息失败 %s error=%s",
+                format_doc_context(book, doc),
+                exc,
+            )
+            return None
+
+        detail = {
+            "contributors": [
+                {"name": contributor.name, "login": contributor.login}
                 for contributor in doc_detail.contributors
+            ],
+            "word_count": doc_detail.word_count,
+        }
+        self.detail_cache.put(doc.id, doc.updated_at, detail)
+        return detail
+
+    async def _build_markdown_header(self, book: YuqueBook, doc: YuqueDocs) -> str:
+        contributors_text = ""
+        # 获取任务可能被多个导出共用，不能随调用方一起取消
+        detail = await asyncio.shield(self._get_detail_task(book, doc))
+        if detail:
+            contributors = [
+                f"{contributor['name']}({contributor['login']})"
+                for contributor in detail["contributors"]
             ]
             if contributors:
                 contributors_text = f"由{' '.join(contributors)} 编辑"
-        except Exception as exc:
-            logger.warning("[export] 获取协作者信息失败 %s error=%s", context, exc)
 
         lines = [
             "```meta_data",
@@ -298,46 +676,235 @@ class Yuque:
         lines.extend(["```", ""])
         return "\n".join(lines)
 
-    def _save_pdf_export(self, content: bytes, save_path: str, context: str) -> bool:
-        return save_content_atomically(save_path, content, binary=True, context=context)
-
-    async def _save_markdown_export(
+    async def _stream_to_file(
         self,
+        download_url: str,
         book: YuqueBook,
         doc: YuqueDocs,
-        content_text: str,
         save_path: str,
-        context: str,
+        export_format: str,
+        header: str | None = None,
+        previous_hash: str | None = None,
+    ) -> tuple[int, AtomicFileWriter | None, str | None]:
+        """
+        分块下载导出文件并写入 save_path
+
+        每块读取前向 download_budget 预留额度，写入磁盘后归还；
+        传入 header 时按 markdown 处理：先写入头部，正文逐行清理后写入，
+        开启资源本地化时在下载连接释放后再下载引用的资源并改写链接。
+        导出内容的 sha256 与 previous_hash 相同、文件仍在且其中的资源都已本地化时不替换原文件，
+        否则先把原文件保存为历史版本再替换。
+
+        :return:  (响应状态码, 写入器, 导出内容的 sha256)，状态码不是 200 时后两项为 None；
+                  writer.committed 表示是否替换了文件
+        """
+        digest = hashlib.sha256()
+        text_filter = None
+        transform_seconds = 0.0
+        started = time.perf_counter()
+
+        with AtomicFileWriter(save_path) as writer:
+            async with self._request(
+                "GET", download_url, endpoint="export_download"
+            ) as response:
+                if response.status != 200:
+                    return response.status, None, None
+
+                if header is not None:
+                    text_filter = MarkdownStreamFilter(
+                        response.charset, find_assets=self.assets.enabled
+                    )
+                    writer.write(header.encode("utf-8"))
+
+                while True:
+                    async with self.download_budget.reserve(DOWNLOAD_CHUNK_SIZE):
+                        chunk = await response.content.read(DOWNLOAD_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        digest.update(chunk)
+                        DOWNLOAD_BYTES.inc(len(chunk), format=export_format)
+                        if text_filter is not None:
+                            transform_started = time.perf_counter()
+                            chunk = text_filter.feed(chunk)
+                            transform_seconds += time.perf_counter() - transform_started
+                        writer.write(chunk)
+
+            # 下载耗时不含逐块清理 markdown 的时间，后者单独计入 transform
+            download_seconds = time.perf_counter() - started - transform_seconds
+            DOWNLOAD_SECONDS.observe(download_seconds, format=export_format)
+            profiler.record("download", download_seconds, book, doc)
+
+            if text_filter is not None:
+                transform_started = time.perf_counter()
+                writer.write(text_filter.flush())
+                transform_seconds += time.perf_counter() - transform_started
+                profiler.record("transform", transform_seconds, book, doc)
+
+            content_hash = digest.hexdigest()
+            # 上次有资源下载失败时，保存的文件中仍是远程链接，内容未变也要重新本地化
+            if (
+                content_hash == previous_hash
+                and os.path.exists(save_path)
+                and not (
+                    text_filter is not None
+                    and text_filter.asset_urls
+                    and has_remote_assets(save_path)
+                )
+            ):
+                return 200, writer, content_hash
+
+            if text_filter is not None and text_filter.asset_urls:
+                with profiler.phase("assets", book, doc):
+                    mapping = await self.assets.localize(
+                        text_filter.asset_urls, save_path, format_doc_context(book, doc)
+                    )
+                if mapping:
+                    with profiler.phase("transform", book, doc):
+                        writer.rewrite_lines(build_link_rewriter(mapping))
+
+            save_started = time.perf_counter()
+            with profiler.phase("save", book, doc):
+                if self.revisions.enabled and os.path.exists(save_path):
+                    await self._archive_revision(book, doc, save_path, export_format)
+                # 检查与替换文件之间没有 await，租约不会在两者之间被接手
+                if not self.can_write(book):
+                    raise LeaseLostError(f"知识库租约已丢失 book_id={book.id}")
+                writer.commit()
+        SAVE_SECONDS.observe(time.perf_counter() - save_started, format=export_format)
+        return 200, writer, content_hash
+
+    def can_write(self, book: YuqueBook) -> bool:
+        """知识库的文件与状态是否仍可由本进程写入，未开启分片时总是可以。"""
+        return self.write_guard is None or self.write_guard(book.id)
+
+    def attach_store(self, store: StateStore) -> None:
+        """绑定状态库，文档详情缓存与资源索引随之持久化。"""
+        self.detail_cache.attach(store)
+        self.assets.attach(store)
+
+    def detach_store(self) -> None:
+        self.detail_cache.detach()
+        self.assets.detach()
+
+    async def docs_remove(
+        self, book: YuqueBook, doc: YuqueDocs, save_path: str, export_format: str
     ) -> bool:
-        header_content = await self._build_markdown_header(book, doc)
-        markdown_body = re.sub(
-            r'<font\s+style="[^"]*">(.*?)</font>', r"\1", content_text
-        )
-        return save_content_atomically(
-            save_path, header_content + markdown_body, binary=False, context=context
-        )
+        """
+        删除语雀上已删除文档的本地文件，开启历史版本时先归档最后一版
+
+        :return:  文件已不存在或已删除时返回 True，租约丢失时返回 False
+        """
+        if not os.path.exists(save_path):
+            return True
+        if self.revisions.enabled:
+            await self._archive_revision(book, doc, save_path, export_format)
+        # 与写入文件相同，检查与删除之间没有 await
+        if not self.can_write(book):
+            return False
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(save_path)
+        return True
+
+    async def _archive_revision(
+        self, book: YuqueBook, doc: YuqueDocs, path: str, export_format: str
+    ) -> None:
+        context = format_doc_context(book, doc)
+        try:
+            await self.revisions.archive_async(
+                book.id, doc.id, path, export_format, context
+            )
+        except Exception as exc:
+            logger.warning(
+                "[revision] 保存历史版本失败 %s path=%s error=%s", context, path, exc
+            )
+
+    async def _paginate(self, fetch_page, context: str):
+        """
+        分页遍历列表接口，并预取下一页
+
+        当前页交给调用方处理的同时，下一页已经在请求中。
+        接口忽略分页参数、重复返回同一批数据时，按 id 去重后自动停止。
+        单页遇到限流、服务端错误或网络异常时最多尝试 PAGE_MAX_ATTEMPTS 次，仍失败才抛出。
+
+        :param fetch_page:  async fetch_page(offset, limit) -> (原始数据列表, 解析后对象列表)
+        :param context:     日志上下文
+        """
+        page_size = self.page_size
+        offset = 0
+        seen_ids = set()
+
+        async def fetch(offset: int):
+            for attempt in range(1, PAGE_MAX_ATTEMPTS + 1):
+                try:
+                    return await fetch_page(offset, page_size)
+                except Exception as exc:
+                    if attempt >= PAGE_MAX_ATTEMPTS or not is_retryable_error(exc):
+                        raise
+                    wait = get_retry_wait(exc, attempt)
+                    logger.warning(
+                        "[page] 获取分页失败，将重试 %s offset=%s attempt=%s/%s "
+                        "wait=%.1fs error=%s",
+                        context,
+                        offset,
+                        attempt,
+                        PAGE_MAX_ATTEMPTS,
+                        wait,
+                        exc,
+                    )
+                    await asyncio.sleep(wait)
+
+        next_page = asyncio.create_task(fetch(offset))
+
+        try:
+            while next_page is not None:
+                raw_items, items = await next_page
+                next_page = None
+
+                new_items = [item for item in items if item.id not in seen_ids]
+                if not new_items:
+                    break
+                seen_ids.update(item.id for item in new_items)
+
+                if len(raw_items) >= page_size:
+                    offset += page_size
+                    next_page = asyncio.create_task(fetch(offset))
+                    logger.debug("[page] 预取下一页 %s offset=%s", context, offset)
+
+                for item in new_items:
+                    yield item
+        finally:
+            if next_page is not None:
+                next_page.cancel()
+                with contextlib.suppress(BaseException):
+                    await next_page
 
     async def books(self) -> list[YuqueBook]:
         """
-        获取知识库
+        获取全部知识库
+
+        :return:  知识库列表
+        """
+        return [book async for book in self.iter_books()]
+
+    async def iter_books(self):
+        """
+        分页获取知识库
         使用通用接口
         /api/mine/user_books
 
-        :return:  知识库列表
+        :return:  知识库异步迭代器
         """
         if not self.is_initialized:
             logger.error(
                 "[books] 客户端未初始化，无法获取知识库 error=%s",
                 self.init_error or "未知初始化错误",
             )
-            return []
+            return
 
         api_config = {
             "name": "user_books",
             "path": "/api/mine/user_books",
             "params": {
-                "offset": 0,
-                "limit": 100,
                 "query": "",
                 "user_type": "User",
             },
@@ -346,30 +913,45 @@ class Yuque:
         if self.base_url != "https://www.yuque.com":
             api_config["params"]["user_type"] = "Group"
             api_config["name"] = "group_books"
-            
 
         api_name = api_config["name"]
-        api_path = api_config["path"]
-        api_params = api_config["params"]
-        url = self.base_url + api_path
-
         logger.info("[books] 请求知识库 api=%s", api_name)
+
+        count = 0
+        async for book in self._paginate(
+            lambda offset, limit: self._fetch_books_page(api_config, offset, limit),
+            f"api={api_name}",
+        ):
+            count += 1
+            yield book
+
+        if not count:
+            logger.warning("[books] 知识库列表为空 api=%s", api_name)
+            return
+
+        logger.info("[books] 获取成功 api=%s count=%s", api_name, count)
+
+    async def _fetch_books_page(
+        self, api_config: dict, offset: int, limit: int
+    ) -> tuple[list, list[YuqueBook]]:
+        api_name = api_config["name"]
+        api_params = {**api_config["params"], "offset": offset, "limit": limit}
+        url = self.base_url + api_config["path"]
+
         try:
-            response = (
-                self._requestSession.get(url, params=api_params)
-                if api_params
-                else self._requestSession.get(url)
-            )
+            async with self._request(
+                "GET", url, endpoint="books", params=api_params
+            ) as response:
+                if response.status != 200:
+                    logger.warning(
+                        "[books] 请求失败 api=%s status=%s",
+                        api_name,
+                        response.status,
+                    )
+                    response.raise_for_status()
 
-            if response.status_code != 200:
-                logger.warning(
-                    "[books] 请求失败 api=%s status=%s",
-                    api_name,
-                    response.status_code,
-                )
-                response.raise_for_status()
+                response_json = await response.json(content_type=None)
 
-            response_json = response.json()
             if "data" not in response_json:
                 logger.warning("[books] 响应缺少 data 字段 api=%s", api_name)
                 raise ValueError("响应JSON中缺少 data 字段")
@@ -379,15 +961,15 @@ class Yuque:
                 logger.warning("[books] 响应数据结构无法识别 api=%s", api_name)
                 raise ValueError("无法识别的知识库数据结构")
 
-            if not books_data:
-                logger.warning("[books] 知识库列表为空 api=%s", api_name)
-                return []
-
-            books = self._parse_books(books_data, api_name)
-            logger.info("[books] 获取成功 api=%s count=%s", api_name, len(books))
-            return books
+            logger.info(
+                "[books] 获取分页 api=%s offset=%s count=%s",
+                api_name,
+                offset,
+                len(books_data),
+            )
+            return books_data, self._parse_books(books_data, api_name)
 
-        except requests.exceptions.RequestException as exc:
+        except aiohttp.ClientError as exc:
             logger.error("[books] 网络请求异常 api=%s error=%s", api_name, exc)
             raise
         except json.JSONDecodeError as exc:
@@ -399,29 +981,53 @@ class Yuque:
 
     async def docs(self, book: YuqueBook) -> list[YuqueDocs]:
         """
-        获取知识库的文档列表
+        获取知识库的全部文档
         :return:  文档列表
         """
+        return [doc async for doc in self.iter_docs(book)]
+
+    async def iter_docs(self, book: YuqueBook):
+        """
+        分页获取知识库的文档列表
+        :return:  文档异步迭代器
+        """
         if not self.is_initialized:
             logger.error(
                 "[docs] 客户端未初始化 %s error=%s",
                 format_book_context(book),
                 self.init_error or "未知初始化错误",
             )
-            return []
+            return
 
+        context = format_book_context(book)
+        count = 0
+        async for doc in self._paginate(
+            lambda offset, limit: self._fetch_docs_page(book, offset, limit), context
+        ):
+            count += 1
+            yield doc
+
+        logger.info("[docs] 获取成功 %s count=%s", context, count)
+
+    async def _fetch_docs_page(
+        self, book: YuqueBook, offset: int, limit: int
+    ) -> tuple[list, list[YuqueDocs]]:
         context = format_book_context(book)
         url = self.base_url + "/api/docs"
+        params = {"book_id": book.id, "offset": offset, "limit": limit}
 
         try:
-            response = self._requestSession.get(url, params={"book_id": book.id})
-            if response.status_code != 200:
-                logger.error(
-                    "[docs] 获取失败 %s status=%s", context, response.status_code
-                )
-                response.raise_for_status()
+            async with self._request(
+                "GET", url, endpoint="docs", params=params
+            ) as response:
+                if response.status != 200:
+                    logger.error(
+                        "[docs] 获取失败 %s status=%s", context, response.status
+                    )
+                    response.raise_for_status()
+
+                response_json = await response.json(content_type=None)
 
-            response_json = response.json()
             docs_data = response_json.get("data")
             if not isinstance(docs_data, list):
                 raise ValueError("data 字段不是列表类型")
@@ -434,190 +1040,250 @@ class Yuque:
                     logger.warning(
                         "[docs] 解析文档失败 %s index=%s error=%s",
                         context,
-                        idx + 1,
+                        offset + idx + 1,
                         exc,
                     )
 
-            logger.info("[docs] 获取成功 %s count=%s", context, len(docs))
-            return docs
+            return docs_data, docs
         except Exception as exc:
             logger.error("[docs] 获取文档列表异常 %s error=%s", context, exc)
             raise
 
-    async def docs_export(
-        self, book: YuqueBook, doc: YuqueDocs, save_path: str, retry: int = 5
-    ) -> bool:
+    async def submit_export(
+        self, book: YuqueBook, doc: YuqueDocs, export_format: str
+    ) -> tuple[str, str | None]:
         """
-        导出文档到本地
+        提交或轮询一次服务端导出任务
+
+        语雀对同一文档重复提交会返回同一导出任务的当前状态，轮询即再次提交。
 
-        :param book:        知识库对象
-        :param doc:         文档对象
-        :param save_path:   保存路径
-        :param retry:       重试次数
-        :return:            是否成功
+        :param book:            知识库对象
+        :param doc:             文档对象
+        :param export_format:   导出格式
+        :return:                (导出状态, 下载链接)
         """
         context = format_doc_context(book, doc)
-        if retry <= 0:
-            logger.error("[export] 重试次数必须大于0 %s retry=%s", context, retry)
-            return False
-
-        export_format = get_export_format()
         export_payload = get_export_payload(export_format)
         export_url = f"{self.base_url}/api/docs/{doc.id}/export"
 
-        for attempt in range(1, retry + 1):
-            logger.info(
-                "[export] 发起导出请求 %s format=%s attempt=%s/%s",
-                context,
-                export_format,
-                attempt,
-                retry,
-            )
-
-            try:
-                response = self._requestSession.post(
-                    export_url,
-                    json=export_payload,
-                    headers=self._build_export_headers(),
-                )
-            except Exception as exc:
-                logger.warning(
-                    "[export] 请求异常 %s attempt=%s/%s error=%s",
-                    context,
-                    attempt,
-                    retry,
-                    exc,
-                )
-                continue
-
-            if response.status_code != 200:
-                if self._is_unpublished_export(response):
-                    logger.warning("[export] 文档未发布，跳过导出 %s", context)
-                    return False
+        try:
+            async with self._request(
+                "POST",
+                export_url,
+                endpoint="doc_export",
+                json=export_payload,
+                headers=self._build_export_headers(),
+            ) as response:
+                status = response.status
+                if status != 200:
+                    unpublished = await self._is_unpublished_export(response)
+                    response_data = None
+                else:
+                    unpublished = False
+                    response_data = await response.json(content_type=None)
+        except json.JSONDecodeError as exc:
+            logger.warning("[export] 导出响应 JSON 解析失败 %s error=%s", context, exc)
+            return EXPORT_RETRY, None
+        except Exception as exc:
+            logger.warning("[export] 请求异常 %s error=%s", context, exc)
+            return EXPORT_RETRY, None
+
+        if status != 200:
+            if unpublished:
+                logger.warning("[export] 文档未发布，跳过导出 %s", context)
+                return EXPORT_FAILED, None
+
+            if status == 404:
+                logger.warning("[export] 文档不存在，跳过导出 %s", context)
+                return EXPORT_FAILED, None
+
+            logger.warning("[export] 导出请求失败 %s status=%s", context, status)
+            return EXPORT_RETRY, None
+
+        export_data = response_data.get("data")
+        if not isinstance(export_data, dict):
+            logger.warning("[export] 导出响应缺少 data 字段 %s", context)
+            return EXPORT_RETRY, None
+
+        state = export_data.get("state")
+        if state == "pending":
+            return EXPORT_PENDING, None
+
+        if state == "error":
+            logger.error("[export] 服务端导出失败 %s", context)
+            return EXPORT_FAILED, None
+
+        download_url = export_data.get("url")
+        if not download_url:
+            logger.warning("[export] 导出响应缺少下载链接 %s", context)
+            return EXPORT_RETRY, None
+
+        if download_url.startswith("/"):
+            download_url = self.base_url + download_url
+
+        return EXPORT_READY, download_url
+
+    @contextlib.asynccontextmanager
+    async def _export_lock(self, doc_id: int, export_format: str):
+        """同一文档同一格式同时只有一个下载在写入，没有使用者时删除锁。"""
+        key = (doc_id, export_format)
+        entry = self._export_locks.setdefault(key, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._export_locks[key]
+
+    async def download_export(
+        self,
+        book: YuqueBook,
+        doc: YuqueDocs,
+        download_url: str,
+        save_path: str,
+        export_format: str,
+        previous_hash: str | None = None,
+    ) -> tuple[str, str | None]:
+        """
+        下载已就绪的导出文件并保存
 
-                if response.status_code == 404:
-                    logger.warning("[export] 文档不存在，跳过导出 %s", context)
-                    return False
+        :param previous_hash:  上次导出内容的 sha256，内容未变时不改写文件
+        :return:  (DOWNLOAD_SAVED / DOWNLOAD_UNCHANGED / DOWNLOAD_NOT_READY /
+                  DOWNLOAD_FAILED, 导出内容的 sha256)
+        """
+        context = format_doc_context(book, doc)
+        # 头部需要单独请求文档详情，必须在占用下载连接之前获取
+        header = None
+        if export_format != "pdf":
+            header = await self._build_markdown_header(book, doc)
 
-                logger.warning(
-                    "[export] 导出请求失败 %s status=%s attempt=%s/%s",
-                    context,
-                    response.status_code,
-                    attempt,
-                    retry,
+        try:
+            async with self._export_lock(doc.id, export_format):
+                download_status, writer, content_hash = await self._stream_to_file(
+                    download_url,
+                    book,
+                    doc,
+                    save_path,
+                    export_format,
+                    header,
+                    previous_hash,
                 )
-                continue
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            logger.warning("[export] 下载请求异常 %s error=%s", context, exc)
+            return DOWNLOAD_FAILED, None
+        except LeaseLostError:
+            logger.warning("[shard] 知识库租约已丢失，放弃写入 %s", context)
+            return DOWNLOAD_FAILED, None
+        except OSError as exc:
+            logger.error(
+                "[file] 保存文件失败 %s path=%s error=%s", context, save_path, exc
+            )
+            return DOWNLOAD_FAILED, None
+        except Exception as exc:
+            logger.warning("[export] 下载异常 %s error=%s", context, exc)
+            return DOWNLOAD_FAILED, None
 
-            try:
-                response_data = response.json()
-            except json.JSONDecodeError as exc:
-                logger.warning(
-                    "[export] 导出响应 JSON 解析失败 %s attempt=%s/%s error=%s",
-                    context,
-                    attempt,
-                    retry,
-                    exc,
-                )
-                continue
+        if download_status == 422:
+            logger.info("[export] 下载资源未就绪 %s", context)
+            return DOWNLOAD_NOT_READY, None
 
-            export_data = response_data.get("data")
-            if not isinstance(export_data, dict):
-                logger.warning(
-                    "[export] 导出响应缺少 data 字段 %s attempt=%s/%s",
-                    context,
-                    attempt,
-                    retry,
-                )
-                continue
+        if download_status != 200:
+            logger.warning("[export] 下载失败 %s status=%s", context, download_status)
+            return DOWNLOAD_FAILED, None
 
-            state = export_data.get("state")
-            if state == "pending":
-                logger.info(
-                    "[export] 文档导出处理中 %s wait=%ss",
-                    context,
-                    EXPORT_PENDING_WAIT_SECONDS,
-                )
-                await asyncio.sleep(EXPORT_PENDING_WAIT_SECONDS)
-                continue
+        if not writer.committed:
+            logger.info(
+                "[export] 导出内容未变化，保留原文件 %s sha256=%s",
+                context,
+                content_hash[:12],
+            )
+            return DOWNLOAD_UNCHANGED, content_hash
 
-            if state == "error":
-                logger.error("[export] 服务端导出失败 %s", context)
-                return False
+        logger.info(
+            "[export] 导出成功 %s format=%s path=%s size=%s sha256=%s",
+            context,
+            export_format,
+            save_path,
+            writer.size,
+            content_hash[:12],
+        )
+        return DOWNLOAD_SAVED, content_hash
 
-            download_url = export_data.get("url")
-            if not download_url:
-                logger.warning(
-                    "[export] 导出响应缺少下载链接 %s attempt=%s/%s",
-                    context,
-                    attempt,
-                    retry,
-                )
-                continue
+    async def docs_export(
+        self,
+        book: YuqueBook,
+        doc: YuqueDocs,
+        save_path: str,
+        retry: int = 5,
+        previous_hash: str | None = None,
+        export_format: str | None = None,
+    ) -> str | None:
+        """
+        导出单个文档到本地
+
+        依次执行提交、轮询、下载，处理中的状态按自适应间隔轮询，不计入重试次数。
+        批量导出请使用 pipeline.ExportPipeline。
+
+        :param book:           知识库对象
+        :param doc:            文档对象
+        :param save_path:      保存路径
+        :param retry:          重试次数
+        :param previous_hash:  上次导出内容的 sha256，内容未变时不改写文件
+        :param export_format:  导出格式，默认为配置的主格式
+        :return:               成功时返回导出内容的 sha256，失败时返回 None
+        """
+        context = format_doc_context(book, doc)
+        if retry <= 0:
+            logger.error("[export] 重试次数必须大于0 %s retry=%s", context, retry)
+            return None
 
-            if download_url.startswith("/"):
-                download_url = self.base_url + download_url
+        export_format = export_format or self.settings.export_format
+        loop = asyncio.get_running_loop()
+        started_at = loop.time()
+        wait = None
+        attempt = 0
 
-            try:
-                download_response = self._requestSession.get(download_url)
-            except Exception as exc:
-                logger.warning(
-                    "[export] 下载请求异常 %s attempt=%s/%s error=%s",
-                    context,
-                    attempt,
-                    retry,
-                    exc,
+        while attempt < retry:
+            logger.info(
+                "[export] 发起导出请求 %s format=%s attempt=%s/%s",
+                context,
+                export_format,
+                attempt + 1,
+                retry,
+            )
+            state, download_url = await self.submit_export(book, doc, export_format)
+            if state == EXPORT_FAILED:
+                return None
+
+            result = DOWNLOAD_FAILED
+            if state == EXPORT_READY:
+                result, content_hash = await self.download_export(
+                    book, doc, download_url, save_path, export_format, previous_hash
                 )
-                continue
+                if result in (DOWNLOAD_SAVED, DOWNLOAD_UNCHANGED):
+                    return content_hash
 
-            if download_response.status_code == 422:
-                logger.info(
-                    "[export] 下载资源未就绪 %s wait=%ss",
-                    context,
-                    EXPORT_PENDING_WAIT_SECONDS,
-                )
-                await asyncio.sleep(EXPORT_PENDING_WAIT_SECONDS)
-                continue
+            if state == EXPORT_PENDING or result == DOWNLOAD_NOT_READY:
+                if loop.time() - started_at > EXPORT_PENDING_TIMEOUT_SECONDS:
+                    logger.error("[export] 等待导出超时 %s", context)
+                    return None
 
-            if download_response.status_code != 200:
-                logger.warning(
-                    "[export] 下载失败 %s status=%s attempt=%s/%s",
-                    context,
-                    download_response.status_code,
-                    attempt,
-                    retry,
-                )
+                wait = next_pending_wait(wait)
+                logger.info("[export] 文档导出处理中 %s wait=%.1fs", context, wait)
+                await asyncio.sleep(wait)
                 continue
 
-            if export_format == "pdf":
-                saved = self._save_pdf_export(
-                    download_response.content, save_path, context
-                )
-            else:
-                download_response.encoding = download_response.apparent_encoding
-                saved = await self._save_markdown_export(
-                    book, doc, download_response.text, save_path, context
-                )
-
-            if saved:
-                logger.info(
-                    "[export] 导出成功 %s format=%s path=%s",
-                    context,
-                    export_format,
-                    save_path,
-                )
-                return True
-
+            attempt += 1
             logger.warning(
-                "[export] 文件保存失败，将重试 %s attempt=%s/%s",
-                context,
-                attempt,
-                retry,
+                "[export] 导出失败，将重试 %s attempt=%s/%s", context, attempt, retry
             )
 
         logger.error(
             "[export] 导出失败，达到最大重试次数 %s retries=%s", context, retry
         )
-        return False
+        return None
 
     async def overview(self, book: YuqueBook, doc: YuqueDocs) -> YuqueDocDetail:
         """
@@ -629,366 +1295,83 @@ class Yuque:
 
         url = self.base_url + api
 
-        response = self._requestSession.get(url)
-        response.raise_for_status()
+        async with self._request("GET", url, endpoint="doc_detail") as response:
+            response.raise_for_status()
+            response_json = await response.json(content_type=None)
 
-        return YuqueDocDetail(response.json()["data"])
+        return YuqueDocDetail(response_json["data"])
 
     async def quick_links(self) -> QuickLinksData:
         api = "/api/mine/group_quick_links"
         url = self.base_url + api
 
-        response = self._requestSession.get(url)
-        response.raise_for_status()
-        return QuickLinksData(response.json()["data"])
+        async with self._request("GET", url, endpoint="quick_links") as response:
+            response.raise_for_status()
+            response_json = await response.json(content_type=None)
+
+        return QuickLinksData(response_json["data"])
 
     async def groups(self) -> list[YuqueGroup]:
+        """
+        获取加入的全部团队
+        :return:  团队列表
+        """
+        return [group async for group in self.iter_groups()]
+
+    async def iter_groups(self):
+        """
+        分页获取加入的团队
+        :return:  团队异步迭代器
+        """
+        async for group in self._paginate(self._fetch_groups_page, "api=groups"):
+            yield group
+
+    async def _fetch_groups_page(
+        self, offset: int, limit: int
+    ) -> tuple[list, list[YuqueGroup]]:
         params = {
-            "offset": 0,
-            "limit": 200,
+            "offset": offset,
+            "limit": limit,
         }
         api = "/api/mine/groups"
         url = self.base_url + api
 
-        response = self._requestSession.get(url, params=params)
-        response.raise_for_status()
-        return [YuqueGroup(i) for i in response.json()["data"]]
-
-
-async def download_all():
-    """下载所有语雀文档"""
-    cfg = get_config()
-    yuque = Yuque()
-    save_base_path = cfg["save_path"]
-    export_format = cfg.get("export_format", "pdf")
-
-    if not yuque.is_initialized:
-        logger.error(
-            "[download] 客户端初始化失败，终止下载 error=%s",
-            yuque.init_error or "未知初始化错误",
-        )
-        return False
-
-    stats = {
-        "books": 0,
-        "docs": 0,
-        "success": 0,
-        "skip": 0,
-        "fail": 0,
-    }
-
-    try:
-        versions = await load_document_versions()
-        logger.info("[download] 开始下载全部文档")
-
-        books = await yuque.books()
-        stats["books"] = len(books)
-        logger.info("[download] 知识库数量 count=%s", stats["books"])
-
-        for book in books:
-            book_context = format_book_context(book)
-            try:
-                docs = await yuque.docs(book)
-                stats["docs"] += len(docs)
-
-                export_tasks, skip_count = await build_book_export_tasks(
-                    book=book,
-                    docs=docs,
-                    versions=versions,
-                    save_base_path=save_base_path,
-                    export_format=export_format,
-                )
-                stats["skip"] += skip_count
-
-                if not export_tasks:
-                    logger.info("[download] 无需下载 %s", book_context)
-                    continue
-
-                results = await export_book_docs(yuque, book, export_tasks)
-                versions, success_count, fail_count = await apply_export_results(
-                    book=book,
-                    export_tasks=export_tasks,
-                    results=results,
-                    versions=versions,
-                )
-
-                stats["success"] += success_count
-                stats["fail"] += fail_count
-
-                await save_document_versions(versions)
-            except Exception as exc:
-                logger.exception(
-                    "[download] 处理知识库失败 %s error=%s", book_context, exc
-                )
-
-        await save_document_versions(versions)
-        logger.info(
-            "[download] 任务完成 books=%s docs=%s success=%s skip=%s fail=%s",
-            stats["books"],
-            stats["docs"],
-            stats["success"],
-            stats["skip"],
-            stats["fail"],
-        )
-        return True
-    except Exception as exc:
-        logger.exception("[download] 下载过程中发生错误 error=%s", exc)
-        return False
-
-
-# 文档版本记录相关函数
-
-
-def get_version_file_path():
-    """获取存储文档版本信息的文件路径"""
-    cfg = get_config()
-    base_path = os.path.abspath(cfg["save_path"])
-    return os.path.join(base_path, "document_versions.json")
-
-
-async def load_document_versions():
-    """加载文档版本信息"""
-    version_file = get_version_file_path()
-    if os.path.exists(version_file):
-        try:
-            with open(version_file, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception as exc:
-            logger.error(
-                "[version] 加载版本文件失败 path=%s error=%s", version_file, exc
-            )
-    return {}
-
-
-async def save_document_versions(versions):
-    """保存文档版本信息"""
-    version_file = get_version_file_path()
-    try:
-        with open(version_file, "w", encoding="utf-8") as f:
-            json.dump(versions, f, ensure_ascii=False, indent=2)
-        return True
-    except Exception as exc:
-        logger.error("[version] 保存版本文件失败 path=%s error=%s", version_file, exc)
-        return False
-
-
-async def check_document_updates(book: YuqueBook, doc: YuqueDocs, versions: dict):
-    """检查文档是否有更新"""
-    doc_key = f"{book.id}_{doc.id}"
-
-    current_version = versions.get(doc_key, {})
-    current_updated_at = current_version.get("updated_at", "")
-    return doc.updated_at > current_updated_at
-
-
-async def update_document_version(versions, book: YuqueBook, doc: YuqueDocs):
-    """更新文档版本信息"""
-    doc_key = f"{book.id}_{doc.id}"
-    versions[doc_key] = {
-        "book_id": book.id,
-        "book_name": book.name,
-        "doc_id": doc.id,
-        "doc_title": doc.title,
-        "updated_at": doc.updated_at,
-        "last_check_time": datetime.datetime.now().isoformat(),
-    }
-    return versions
-
-
-async def build_book_export_tasks(
-    book: YuqueBook,
-    docs: list[YuqueDocs],
-    versions: dict,
-    save_base_path: str,
-    export_format: str,
-) -> tuple[list[tuple[YuqueDocs, str]], int]:
-    """构建单个知识库的导出任务。"""
-    export_tasks = []
-    skip_count = 0
-
-    for doc in docs:
-        if doc.type != "Doc":
-            skip_count += 1
-            continue
-
-        save_path = build_doc_save_path(save_base_path, book, doc, export_format)
-        if not os.path.exists(save_path):
-            export_tasks.append((doc, save_path))
-            continue
-
-        has_update = await check_document_updates(book, doc, versions)
-        if not has_update:
-            skip_count += 1
-            continue
-
-        logger.info(
-            "[download] 文档有更新，准备重新下载 %s", format_doc_context(book, doc)
-        )
-        export_tasks.append((doc, save_path))
-
-    return export_tasks, skip_count
-
-
-async def export_book_docs(
-    yuque: Yuque, book: YuqueBook, export_tasks: list[tuple[YuqueDocs, str]]
-) -> list:
-    """并发导出单个知识库下的文档。"""
-    if not export_tasks:
-        return []
+        async with self._request(
+            "GET", url, endpoint="groups", params=params
+        ) as response:
+            response.raise_for_status()
+            response_json = await response.json(content_type=None)
 
-    max_workers = min(MAX_EXPORT_WORKERS, len(export_tasks))
-    logger.info(
-        "[download] 开始并发导出 %s tasks=%s workers=%s",
-        format_book_context(book),
-        len(export_tasks),
-        max_workers,
-    )
-
-    loop = asyncio.get_running_loop()
-    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = [
-            loop.run_in_executor(executor, run_doc_export_sync, yuque, book, doc, path)
-            for doc, path in export_tasks
-        ]
-        return await asyncio.gather(*futures, return_exceptions=True)
-
-
-async def apply_export_results(
-    book: YuqueBook,
-    export_tasks: list[tuple[YuqueDocs, str]],
-    results: list,
-    versions: dict,
-) -> tuple[dict, int, int]:
-    """统计导出结果并更新版本信息。"""
-    success_count = 0
-    fail_count = 0
-
-    for (doc, _), result in zip(export_tasks, results):
-        context = format_doc_context(book, doc)
-
-        if isinstance(result, Exception):
-            fail_count += 1
-            logger.error("[download] 导出任务异常 %s error=%s", context, result)
-            continue
-
-        if result:
-            versions = await update_document_version(versions, book, doc)
-            success_count += 1
-            logger.info("[download] 下载成功 %s", context)
-            continue
-
-        fail_count += 1
-        logger.warning("[download] 下载失败 %s", context)
-
-    return versions, success_count, fail_count
-
-
-async def monitor_updates():
-    """监控文档更新并下载"""
-    cfg = get_config()
-    yuque = Yuque()
-    save_base_path = cfg["save_path"]
-    export_format = cfg.get("export_format", "pdf")
-
-    if not yuque.is_initialized:
-        logger.error(
-            "[monitor] 客户端初始化失败，终止监控 error=%s",
-            yuque.init_error or "未知初始化错误",
-        )
-        return False
-
-    versions = await load_document_versions()
-    logger.info("[monitor] 开始监控更新 at=%s", datetime.datetime.now().isoformat())
-
-    try:
-        books = await yuque.books()
-        update_count = 0
-        fail_count = 0
-
-        for book in books:
-            book_context = format_book_context(book)
-            try:
-                docs = await yuque.docs(book)
-                docs.sort(key=lambda d: d.updated_at, reverse=True)
-
-                for doc in docs:
-                    if doc.type != "Doc":
-                        continue
-
-                    try:
-                        context = format_doc_context(book, doc)
-                        has_update = await check_document_updates(book, doc, versions)
-                        if not has_update:
-                            continue
-
-                        save_path = build_doc_save_path(
-                            save_base_path, book, doc, export_format
-                        )
-                        export_success = await yuque.docs_export(book, doc, save_path)
-                        if export_success:
-                            versions = await update_document_version(
-                                versions, book, doc
-                            )
-                            update_count += 1
-                            logger.info("[monitor] 更新成功 %s", context)
-                        else:
-                            fail_count += 1
-                            logger.warning("[monitor] 更新失败 %s", context)
-                    except Exception as exc:
-                        fail_count += 1
-                        logger.exception(
-                            "[monitor] 处理文档失败 %s error=%s",
-                            format_doc_context(book, doc),
-                            exc,
-                        )
-
-            except Exception as exc:
-                logger.exception(
-                    "[monitor] 获取知识库文档失败 %s error=%s", book_context, exc
-                )
-
-        await save_document_versions(versions)
-        logger.info(
-            "[monitor] 监控完成 updates=%s fail=%s at=%s",
-            update_count,
-            fail_count,
-            datetime.datetime.now().isoformat(),
-        )
-        return True
-
-    except Exception as exc:
-        logger.exception("[monitor] 监控更新过程中发生错误 error=%s", exc)
-        return False
+        groups_data = response_json["data"]
+        return groups_data, [YuqueGroup(i) for i in groups_data]
 
+    async def iter_group_activities(self, group: YuqueGroup):
+        """
+        分页获取团队动态，最新的在前
+        :return:  动态异步迭代器
+        """
+        async for activity in self._paginate(
+            lambda offset, limit: self._fetch_activities_page(group, offset, limit),
+            f"group={group.name}({group.id})",
+        ):
+            yield activity
+
+    async def _fetch_activities_page(
+        self, group: YuqueGroup, offset: int, limit: int
+    ) -> tuple[list, list[YuqueActivities]]:
+        params = {
+            "group_id": group.id,
+            "offset": offset,
+            "limit": limit,
+        }
+        api = "/api/activities"
+        url = self.base_url + api
 
-async def download_and_monitor(interval_minutes=60):
-    """下载所有文档并持续监控更新"""
-    get_config()
+        async with self._request(
+            "GET", url, endpoint="activities", params=params
+        ) as response:
+            response.raise_for_status()
+            response_json = await response.json(content_type=None)
 
-    try:
-        logger.info("[monitor] 首次运行，执行全量下载")
-        first_download_ok = await download_all()
-        if not first_download_ok:
-            logger.error("[monitor] 首次全量下载失败，终止监控")
-            return False
-
-        while True:
-            try:
-                monitor_ok = await monitor_updates()
-                if not monitor_ok:
-                    logger.error("[monitor] 监控任务执行失败，等待60秒后重试")
-                    await asyncio.sleep(60)
-                    continue
-
-                logger.info(
-                    "[monitor] 等待下次检查 interval_minutes=%s", interval_minutes
-                )
-                await asyncio.sleep(interval_minutes * 60)
-            except Exception as exc:
-                logger.error("[monitor] 监控循环异常 error=%s", exc)
-                logger.info("[monitor] 等待60秒后重试")
-                await asyncio.sleep(60)
-    except Exception as exc:
-        logger.exception("[monitor] 程序运行异常 error=%s", exc)
-        logger.info("[monitor] 程序将退出，请检查错误原因后重启")
-        return False
+        activities_data = response_json["data"]
+        return activities_data, [YuqueActivities(i) for i in activities_data]